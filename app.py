@@ -1,19 +1,123 @@
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, render_template, request, jsonify, Response, g, send_file
 import json
 import os
 from datetime import datetime
 import uuid
-import openai
-import requests
 import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from werkzeug.utils import secure_filename
+from chat_store import open_store
+from hot_cache import HotChatCache, CHAT_CACHE_MB
+from archive import ARCHIVE_DAYS, ARCHIVE_INTERVAL
+from changes import ChangeLog, KEEPALIVE_SECONDS
+from providers import get_provider, PROVIDERS
+from resilience import ProviderError, error_info
+from metrics import (render as render_metrics, RequestTimings, CHAT_LOAD, CHAT_SAVE, CHAT_LIST,
+                     CACHED_RESPONSES, HTTP_REQUESTS, ROUTED_CALLS, CALL_OBSERVERS)
+from config_cache import CachedFile
+from context_builder import build_context, context_budget
+from response_cache import ResponseCache, RESPONSE_CACHE, replay
+from chat_catalog import ChatCatalog
+from search_index import SearchIndex
+from attachments import AttachmentStore, AttachmentTooLarge, ATTACHMENT_TOKENS
+from retrieval import Retriever, RETRIEVAL, insert_passages
+from relay import Coalescer, content_framer, COALESCE_MS
+from jobs import JobQueue, PROVIDER_CONCURRENCY
+from batch import BatchRun, read_items, parse_models, completed
+from locks import FileLock
+from routing import LatencyTracker, routed_selection, selection_providers, hedged_call
+from compression import (StaticVersions, compress, compressible, encodings, etag_matches, negotiate, variant_etag,
+                         COMPRESS_MIN_BYTES, IMMUTABLE_MAX_AGE)
 
 app = Flask(__name__)
+static_versions = StaticVersions(app.static_folder)
+
+# Multi-model requests are dispatched concurrently on this pool. A call's
+# timeout starts when a worker picks it up, so calls queued behind a busy
+# pool wait for a thread instead of timing out before they reach the provider
+MODEL_WORKERS = int(os.environ.get('QUERYQUEST_MODEL_WORKERS', '16'))
+MODEL_TIMEOUT = float(os.environ.get('QUERYQUEST_MODEL_TIMEOUT', '120'))
+model_executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix='model')
+# Candidates of routed selections, hedges included, run on their own pool
+route_executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix='route')
+
+# Rolling latency per model from every provider call, for routed selections
+latency = LatencyTracker()
+CALL_OBSERVERS.append(latency.observe)
 
 # Ensure chat history directory exists
 os.makedirs('chat_history', exist_ok=True)
 os.makedirs('text_notes', exist_ok=True)
 
+# Uploaded files, stored once by content hash and referenced from messages
+attachments = AttachmentStore('attachments')
+
+# Passage index over notes and large attachments; the passages relevant to
+# a message are sent with it instead of whole files
+retriever = Retriever('retrieval_index')
+
+# Opt-in cache of complete model responses
+response_cache = ResponseCache('response_cache')
+
+def reindex_chat(chat_id, start):
+    """Bring the indexes up to date after a deferred save was merged with another worker's"""
+    chat = store.load(chat_id)
+    if chat is not None:
+        catalog.upsert(chat)
+        search_index.index_messages(chat_id, chat['messages'], start)
+
+# Append-only chat storage (or SQLite, see QUERYQUEST_STORAGE) behind an
+# in-memory cache of active chats, plus a metadata index used to list chats
+# without opening every chat
+chat_storage = open_store('chat_history')
+store = HotChatCache(chat_storage, on_merged=reindex_chat) if CHAT_CACHE_MB > 0 else chat_storage
+
+# Versioned log of chat and note list changes, behind the list ETags, the
+# ?since= delta responses and the /api/changes feed
+changes = ChangeLog(os.path.join('chat_history', 'changes.db'))
+# Each /api/changes feed holds a thread of the threaded server, so it is
+# closed after this long and the browser reconnects from its last event id
+CHANGE_FEED_SECONDS = float(os.environ.get('QUERYQUEST_CHANGE_FEED_SECONDS', '300'))
+catalog = ChatCatalog(store, changes=changes)
+catalog.repair()
+
+# Full-text index over chat messages and notes, kept current on every save.
+# A missing or empty index is built in the background on first start.
+search_index = SearchIndex(os.path.join('chat_history', 'search.db'))
+if search_index.is_empty():
+    threading.Thread(target=search_index.rebuild, args=(store, 'text_notes'), daemon=True).start()
+
+def index_notes():
+    """Add every note to the retrieval index"""
+    for filename in os.listdir('text_notes'):
+        if filename.endswith('.txt') and filename != 'behavior.txt':
+            with open(os.path.join('text_notes', filename), 'r', encoding='utf-8', errors='replace') as f:
+                retriever.index(f'note:{filename}', f.read())
+
+if retriever.available and retriever.is_empty():
+    threading.Thread(target=index_notes, daemon=True).start()
+
+def archive_idle_chats(days=ARCHIVE_DAYS):
+    """Move chats idle for ``days`` to the compressed archive; returns the report"""
+    if isinstance(store, HotChatCache):
+        store.flush()
+    return chat_storage.archive_idle(days)
+
+def archive_loop():
+    while True:
+        time.sleep(ARCHIVE_INTERVAL)
+        try:
+            archive_idle_chats()
+        except Exception:
+            # Tried again next interval
+            continue
+
+# The SQLite store has no per-chat files to archive
+if ARCHIVE_DAYS > 0 and hasattr(chat_storage, 'archive_idle'):
+    threading.Thread(target=archive_loop, daemon=True).start()
+
 def extract_text_from_file(file_path):
     """Extract text content from file"""
     try:
@@ -27,190 +131,597 @@ def extract_text_from_file(file_path):
             return f"[Could not read file: {os.path.basename(file_path)}]"
 
 def process_uploaded_files(files):
-    """Process uploaded files and extract text content"""
-    file_contents = []
+    """Stream uploaded files into the attachment store and return their handles"""
+    handles = []
     for file in files:
         if file.filename:
-            content = file.read().decode('utf-8', errors='ignore')
-            file_contents.append({
-                'name': file.filename,
-                'content': content
-            })
-    return file_contents
+            handle = attachments.ingest(file.stream, file.filename)
+            # Files too large to inline are answered from their relevant passages
+            source = f"attachment:{handle['id']}"
+            if handle['tokens'] > ATTACHMENT_TOKENS and retriever.available and not retriever.has(source):
+                text = ''.join(attachments.read_chunk(handle['id'], index) for index in range(len(handle['chunks'])))
+                retriever.index(source, text)
+            handles.append(handle)
+    return handles
+
+def _read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _read_stripped_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+# Config files are memoized and re-read only when they change on disk
+credentials_cache = CachedFile('credentials.json', _read_json, default={})
+behavior_cache = CachedFile(os.path.join('text_notes', 'behavior.txt'), _read_stripped_text, default="")
+# Equivalence groups for routed selections: {"name": ["provider/model", ...]}
+model_groups_cache = CachedFile('model_groups.json', _read_json, default={})
 
 def load_credentials():
     """Load credentials from credentials.json file"""
-    try:
-        with open('credentials.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return credentials_cache.get()
 
 def load_behavior_instructions():
     """Load behavior instructions from text_notes directory"""
-    behavior_file = os.path.join('text_notes', 'behavior.txt')
-    try:
-        with open(behavior_file, 'r', encoding='utf-8') as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        return ""
-
-def save_chat_history(chat_id, messages, title="New Chat", folder_name='check'):
-    """Save chat history to JSON file"""
-    chat_data = {
-        'id': chat_id,
-        'title': title,
-        'folder_name': folder_name,
-        'created_at': datetime.now().isoformat(),
-        'updated_at': datetime.now().isoformat(),
-        'messages': messages
-    }
-    
-    with open(f'chat_history/{chat_id}.json', 'w') as f:
-        json.dump(chat_data, f, indent=2)
+    return behavior_cache.get()
 
-def load_chat_history(chat_id):
-    """Load chat history from JSON file"""
-    try:
-        with open(f'chat_history/{chat_id}.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return None
+def reload_config():
+    """Drop cached config so the next request re-reads it from disk"""
+    credentials_cache.invalidate()
+    behavior_cache.invalidate()
+    model_groups_cache.invalidate()
 
-def get_all_chats():
-    """Get all chat histories"""
-    chats = []
-    if os.path.exists('chat_history'):
-        for filename in os.listdir('chat_history'):
-            if filename.endswith('.json'):
-                try:
-                    with open(f'chat_history/{filename}', 'r') as f:
-                        chat = json.load(f)
-                        chats.append({
-                            'id': chat['id'],
-                            'title': chat['title'],
-                            'folder_name': chat.get('folder_name'),
-                            'updated_at': chat['updated_at']
-                        })
-                except:
-                    continue
+def save_chat_history(chat_id, messages, title="New Chat", folder_name='check', base=None):
+    """Save chat history, appending only the messages not yet stored.
     
-    # Sort by updated_at descending
-    chats.sort(key=lambda x: x['updated_at'], reverse=True)
-    return chats
+    ``base`` is the message count when the chat was opened. Turns another
+    worker saved since then are kept, with the new messages after them.
+    """
+    # Retrieved passages were only needed for the request
+    with CHAT_SAVE.time():
+        for msg in messages:
+            msg.pop('context', None)
+        chat_meta = store.save(chat_id, messages, title, folder_name, base)
+        catalog.upsert(chat_meta)
+        if chat_meta['merged']:
+            messages = store.load(chat_id)['messages']
+        search_index.index_messages(chat_id, messages, chat_meta['appended_from'])
+        if chat_meta.get('created'):
+            search_index.index_title(chat_id, title)
 
-def call_openai_api(messages, model, api_key, stream=False):
-    """Call OpenAI API"""
-    openai.api_key = api_key
-    
-    # Add behavior instructions to messages
+def load_chat_history(chat_id):
+    """Load chat history from the chat store"""
+    with CHAT_LOAD.time():
+        return store.load(chat_id)
+
+def load_chat_page(chat_id, limit, before=None):
+    """Load a chat with only the ``limit`` messages before index ``before`` (default: the latest)"""
+    with CHAT_LOAD.time():
+        return store.load_page(chat_id, limit, before)
+
+def get_all_chats(limit=None, offset=0, folder_name=None, order='desc'):
+    """Get chat summaries from the catalog, newest first by default"""
+    with CHAT_LIST.time():
+        return catalog.list(limit=limit, offset=offset, folder_name=folder_name, order=order)
+
+def with_behavior(messages):
+    """Prepend behavior instructions to messages as a system prompt"""
     behavior_instructions = load_behavior_instructions()
     if behavior_instructions:
-        enhanced_messages = [{'role': 'system', 'content': behavior_instructions}] + messages
-    else:
-        enhanced_messages = messages
+        return [{'role': 'system', 'content': behavior_instructions}] + messages
+    return messages
+
+def prepare_messages(provider, model, messages, provider_config):
+    """Build the payload for one model: trimmed history plus behavior instructions"""
+    context = build_context(messages, provider, model, context_budget(provider_config, model))
+    return with_behavior(attachments.expand(insert_passages(context)))
+
+def model_timeout(model_info):
+    """Per-model timeout in seconds, overridable per request"""
+    try:
+        return float(model_info.get('timeout') or MODEL_TIMEOUT)
+    except (TypeError, ValueError):
+        return MODEL_TIMEOUT
+
+def resolve_model_call(provider, model, messages, provider_config, use_cache=False):
+    """Work out how to answer one model call.
     
+    Returns (adapter, payload, cache_key, cached) where cached is the cached
+    response text on a cache hit and cache_key is None when caching is off.
+    """
+    adapter = get_provider(provider)
+    if adapter is None:
+        raise ValueError(f'Unsupported provider {provider}')
+    payload = prepare_messages(provider, model, messages, provider_config)
+    if not use_cache:
+        return adapter, payload, None, None
+    cache_key = response_cache.key(provider, model, payload, adapter.temperature, adapter.max_tokens)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        CACHED_RESPONSES.inc(provider=provider, model=model)
+    return adapter, payload, cache_key, cached
+
+def call_model(provider, model, messages, credentials, timeout=None, use_cache=False):
+    """Call a single model and return its full response"""
+    if provider not in credentials:
+        raise ValueError(f'Provider {provider} not found in credentials')
+    provider_config = credentials[provider]
+    adapter, payload, cache_key, cached = resolve_model_call(provider, model, messages, provider_config, use_cache)
+    if cached is not None:
+        return cached
+    
+    response = adapter.complete(payload, model, provider_config, timeout=timeout)
+    if cache_key:
+        response_cache.put(cache_key, response, provider=provider, model=model)
+    return response
+
+def iter_model_stream(provider, model, messages, provider_config, timeout=None, use_cache=False):
+    """Stream a model response, yielding text deltas as they arrive"""
+    adapter, payload, cache_key, cached = resolve_model_call(provider, model, messages, provider_config, use_cache)
+    if cached is not None:
+        return replay(cached)
+    stream = adapter.stream(payload, model, provider_config, timeout=timeout)
+    if cache_key:
+        return _caching_stream(stream, cache_key, provider, model)
+    return stream
+
+def _caching_stream(stream, cache_key, provider, model):
+    """Relay a live stream and cache the response once it completes"""
+    parts = []
     try:
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=enhanced_messages,
-            temperature=0.7,
-            max_tokens=2000,
-            stream=stream
-        )
-        if stream:
-            return response
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error: {str(e)}"
+        for content in stream:
+            parts.append(content)
+            yield content
+    finally:
+        stream.close()
+    response_cache.put(cache_key, ''.join(parts), provider=provider, model=model)
+
+def provider_available(provider, credentials):
+    """Whether a provider is configured and its circuit breaker lets calls through"""
+    adapter = get_provider(provider)
+    return provider in credentials and adapter is not None and adapter.resilience.breaker.state != 'open'
 
-def call_anthropic_api(messages, model, api_key, stream=False):
-    """Call Anthropic API (Claude)"""
-    headers = {
-        'Content-Type': 'application/json',
-        'x-api-key': api_key,
-        'anthropic-version': '2023-06-01'
-    }
+def rank_candidates(model_info, credentials):
+    """A routed selection's candidates, best first"""
+    ranked = latency.rank(model_info['candidates'], lambda provider: provider_available(provider, credentials))
+    if not ranked:
+        raise ValueError(f"Model group {model_info['group']} has no models")
+    return ranked
+
+def routed_fields(model_info, candidate, hedged):
+    """Response fields naming the candidate that answered a routed selection"""
+    ROUTED_CALLS.inc(group=model_info['group'], provider=candidate['provider'], model=candidate['model'],
+                     hedged=str(hedged).lower())
+    return {'provider': candidate['provider'], 'model': candidate['model'], 'group': model_info['group'],
+            'hedged': hedged}
+
+def call_routed(model_info, messages, credentials, use_cache=False):
+    """Answer a routed selection with the fastest available candidate.
     
-    # Convert messages format for Anthropic
-    system_message = ""
-    claude_messages = []
+    The next candidate is asked when one fails, and with 'hedge' also once
+    the first is slower than its usual (p95) answer time. Returns
+    (candidate, response, hedged).
+    """
+    ranked = rank_candidates(model_info, credentials)
+    delay = None
+    if model_info.get('hedge') and len(ranked) > 1:
+        delay = latency.hedge_delay(ranked[0]['provider'], ranked[0]['model'], stream=False)
     
-    # Add behavior instructions
-    behavior_instructions = load_behavior_instructions()
+    def call(candidate, cancel):
+        # Streamed so that a losing candidate can stop reading and close its request
+        if cancel.is_set():
+            return None
+        provider = candidate['provider']
+        if provider not in credentials:
+            raise ValueError(f'Provider {provider} not found in credentials')
+        parts = []
+        stream = iter_model_stream(provider, candidate['model'], messages, credentials[provider],
+                                   timeout=model_timeout(candidate), use_cache=use_cache)
+        try:
+            for content in stream:
+                if cancel.is_set():
+                    return None
+                parts.append(content)
+        finally:
+            stream.close()
+        return ''.join(parts)
+    return hedged_call(ranked, call, route_executor, model_timeout(model_info), delay)
+
+class _PooledCall:
+    """A call run on an executor whose deadline starts when a worker picks it up"""
     
-    for msg in messages:
-        if msg['role'] == 'system':
-            system_message = msg['content']
-        else:
-            claude_messages.append(msg)
+    def __init__(self, executor, func, *args, **kwargs):
+        self.started = None
+        self._picked = threading.Event()
+        self.future = executor.submit(self._run, func, *args, **kwargs)
     
-    # Combine behavior instructions with existing system message
-    if behavior_instructions:
-        if system_message:
-            system_message = behavior_instructions + "\n\n" + system_message
-        else:
-            system_message = behavior_instructions
+    def _run(self, func, *args, **kwargs):
+        self.started = time.monotonic()
+        self._picked.set()
+        return func(*args, **kwargs)
     
-    data = {
-        'model': model,
-        'max_tokens': 2000,
-        'messages': claude_messages,
-        'stream': stream
-    }
+    def result(self, timeout):
+        """The call's result, raising FutureTimeoutError once it has run ``timeout`` seconds"""
+        self._picked.wait()
+        return self.future.result(timeout=max(self.started + timeout - time.monotonic(), 0))
     
-    if system_message:
-        data['system'] = system_message
+    def cancel(self):
+        return self.future.cancel()
+
+def dispatch_models(selected_models, messages, credentials, use_cache=False):
+    """Query all selected models concurrently, returning results in request order"""
+    calls = []
+    for model_info in selected_models:
+        if 'candidates' in model_info:
+            calls.append(_PooledCall(model_executor, call_routed, model_info, messages, credentials, use_cache))
+            continue
+        calls.append(_PooledCall(
+            model_executor, call_model, model_info['provider'], model_info['model'], messages, credentials,
+            timeout=model_timeout(model_info), use_cache=use_cache
+        ))
     
+    responses = []
+    for model_info, call in zip(selected_models, calls):
+        provider = model_info['provider']
+        model = model_info['model']
+        timeout = model_timeout(model_info)
+        try:
+            response = call.result(timeout)
+            if 'candidates' in model_info:
+                candidate, response, hedged = response
+                responses.append(dict(routed_fields(model_info, candidate, hedged), response=response, success=True))
+                continue
+            responses.append({'provider': provider, 'model': model, 'response': response, 'success': True})
+        except FutureTimeoutError:
+            call.cancel()
+            error = ProviderError(provider, 'timeout', f'Timed out after {timeout:g}s')
+            responses.append(dict(error_info(error), provider=provider, model=model, success=False))
+        except Exception as e:
+            responses.append(dict(error_info(e), provider=provider, model=model, success=False))
+    return responses
+
+def _start_model_stream(index, model_info, messages, credentials, events, cancel, use_cache=False):
+    """Worker for stream_models: report being picked up, which starts the model's deadline, then pump"""
+    if cancel.is_set():
+        return
+    events.put((index, 'start', None))
+    _pump_model_stream(index, model_info, messages, credentials, events, cancel, use_cache)
+
+def _pump_model_stream(index, model_info, messages, credentials, events, cancel, use_cache=False):
+    """Worker for stream_models: forward one model's deltas onto the shared queue"""
+    if 'candidates' in model_info:
+        return _pump_routed_stream(index, model_info, messages, credentials, events, cancel, use_cache)
+    provider = model_info['provider']
     try:
-        response = requests.post(
-            'https://api.anthropic.com/v1/messages',
-            headers=headers,
-            json=data,
-            stream=stream
-        )
-        response.raise_for_status()
-        if stream:
-            return response
-        return response.json()['content'][0]['text']
+        if provider not in credentials:
+            raise ValueError(f'Provider {provider} not found')
+        stream = iter_model_stream(provider, model_info['model'], messages, credentials[provider],
+                                   timeout=model_timeout(model_info), use_cache=use_cache)
+        try:
+            for content in stream:
+                if cancel.is_set():
+                    break
+                events.put((index, 'content', content))
+        finally:
+            stream.close()
+        events.put((index, 'done', None))
     except Exception as e:
-        return f"Error: {str(e)}"
+        events.put((index, 'error', error_info(e)))
 
+def _pump_routed_stream(index, model_info, messages, credentials, events, cancel, use_cache=False):
+    """Worker for stream_models on a routed selection.
+    
+    Streams the best candidate, starting the next when it fails before its
+    first delta and, with 'hedge', also once it is slower to start than its
+    usual (p95) time to first token. The first candidate to send text wins
+    and a 'route' event names it; the others stop at their next delta.
+    """
+    try:
+        ranked = rank_candidates(model_info, credentials)
+    except ValueError as e:
+        events.put((index, 'error', error_info(e)))
+        return
+    attempts = queue.Queue()
+    cancels = []
+    
+    def launch():
+        cancels.append(threading.Event())
+        route_executor.submit(_pump_model_stream, len(cancels) - 1, ranked[len(cancels) - 1], messages, credentials,
+                              attempts, cancels[-1], use_cache)
+    
+    launch()
+    hedge_at = None
+    if model_info.get('hedge') and len(ranked) > 1:
+        hedge_at = time.monotonic() + latency.hedge_delay(ranked[0]['provider'], ranked[0]['model'])
+    winner = None
+    failed = 0
+    try:
+        while True:
+            try:
+                attempt, kind, payload = attempts.get(
+                    timeout=None if hedge_at is None else max(hedge_at - time.monotonic(), 0))
+            except queue.Empty:
+                hedge_at = None
+                if winner is None and len(cancels) < len(ranked):
+                    launch()
+                continue
+            if cancel.is_set():
+                return
+            if winner is None:
+                if kind == 'error':
+                    failed += 1
+                    if failed == len(cancels):
+                        if len(cancels) == len(ranked):
+                            events.put((index, kind, payload))
+                            return
+                        launch()
+                    continue
+                winner = attempt
+                for number, other in enumerate(cancels):
+                    if number != winner:
+                        other.set()
+                events.put((index, 'route', routed_fields(model_info, ranked[winner], len(cancels) > 1)))
+            if attempt == winner:
+                events.put((index, kind, payload))
+                if kind != 'content':
+                    return
+    finally:
+        for other in cancels:
+            other.set()
 
-def call_coforge_api(messages, model, api_key, stream=False):
-    headers = {
-        "Content-Type": "application/json",
-        "X-API-KEY": api_key
-    }
+def stream_models(selected_models, messages, credentials, use_cache=False, coalescer=None):
+    """Stream all selected models concurrently.
     
-    # Add behavior instructions to messages
-    behavior_instructions = load_behavior_instructions()
-    if behavior_instructions:
-        enhanced_messages = [{'role': 'system', 'content': behavior_instructions}] + messages
+    Yields (index, kind, payload) tuples as chunks arrive from any model, where
+    kind is 'content', 'done' or 'error' (payload is then an error_info dict),
+    or 'route' with the routed_fields of the candidate a routed selection uses.
+    With a Coalescer, deltas arriving close together are merged into one
+    'content' chunk. A model that runs past its timeout is cancelled and
+    reported as an error; closing the generator cancels the rest.
+    """
+    events = queue.Queue()
+    cancels = [threading.Event() for _ in selected_models]
+    # Models still waiting for a worker; their deadline starts once one picks them up
+    waiting = set(range(len(selected_models)))
+    deadlines = {}
+    for index, model_info in enumerate(selected_models):
+        model_executor.submit(_start_model_stream, index, model_info, messages, credentials,
+                              events, cancels[index], use_cache)
+    
+    try:
+        while deadlines or waiting:
+            now = time.monotonic()
+            if coalescer is not None and coalescer.due(now):
+                for index, content in coalescer.flush():
+                    yield index, 'content', content
+            remaining = min(deadlines.values()) - now if deadlines else MODEL_TIMEOUT
+            if coalescer is not None:
+                remaining = coalescer.wait(now, remaining)
+            try:
+                index, kind, payload = events.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                now = time.monotonic()
+                for index, deadline in list(deadlines.items()):
+                    if deadline <= now:
+                        cancels[index].set()
+                        del deadlines[index]
+                        if coalescer is not None:
+                            for _, content in coalescer.flush(index):
+                                yield index, 'content', content
+                        model_info = selected_models[index]
+                        error = ProviderError(model_info['provider'], 'timeout',
+                                              f'Timed out after {model_timeout(model_info):g}s')
+                        yield index, 'error', error_info(error)
+                continue
+            
+            if kind == 'start':
+                waiting.discard(index)
+                deadlines[index] = time.monotonic() + model_timeout(selected_models[index])
+                continue
+            # Ignore stragglers from models that already timed out
+            if index not in deadlines:
+                continue
+            if kind == 'content' and coalescer is not None:
+                coalescer.add(index, payload, time.monotonic())
+                continue
+            if kind not in ('content', 'route'):
+                del deadlines[index]
+                # Text held back for this model goes out before its end
+                if coalescer is not None:
+                    for _, content in coalescer.flush(index):
+                        yield index, 'content', content
+            yield index, kind, payload
+    finally:
+        for cancel in cancels:
+            cancel.set()
+
+def parse_model_selection(data):
+    """Selected models from a chat request, accepting the legacy provider/model fields.
+    
+    Routed selections ({'group': name} or provider 'auto') get their
+    candidates from model_groups.json.
+    """
+    selected_models = data.get('selected_models', [])
+    if not selected_models:
+        provider = data.get('provider')
+        model = data.get('model')
+        if provider and model:
+            selected_models = [{'provider': provider, 'model': model}]
+    groups = model_groups_cache.get()
+    return [routed_selection(model_info, groups) or model_info for model_info in selected_models]
+
+def open_chat(chat_id, message, folder_name):
+    """Load the chat a message belongs to, or start a new one.
+    
+    Returns (chat_id, messages, title, folder_name, is_new).
+    """
+    title = message[:50] + "..." if len(message) > 50 else message
+    if chat_id:
+        chat_data = load_chat_history(chat_id)
+        if chat_data:
+            return chat_id, chat_data['messages'], chat_data['title'], chat_data.get('folder_name'), False
+        return chat_id, [], title, folder_name, False
+    return str(uuid.uuid4()), [], title, folder_name, True
+
+def use_retrieval(data):
+    return retriever.available and bool(data.get('retrieval', RETRIEVAL))
+
+def user_message(data):
+    """The user turn for a request, with references to its uploaded attachments"""
+    message = {'role': 'user', 'content': data.get('message')}
+    refs = []
+    for item in data.get('attachments') or []:
+        info = attachments.info(item.get('id', ''))
+        if info is None:
+            continue
+        inline = not (use_retrieval(data) and info['tokens'] > ATTACHMENT_TOKENS
+                      and retriever.has(f"attachment:{info['id']}"))
+        refs.append(attachments.reference(info, item.get('name') or 'attachment', inline))
+    if refs:
+        message['attachments'] = refs
+    return message
+
+def add_retrieved_context(messages, data):
+    """Attach the note and file passages most relevant to the newest message"""
+    if not use_retrieval(data):
+        return
+    labels = {source: source[len('note:'):] for source in retriever.sources('note:')}
+    for msg in messages:
+        for ref in msg.get('attachments', ()):
+            if not ref.get('inline', True):
+                labels[f"attachment:{ref['id']}"] = ref['name']
+    passages = retriever.search(messages[-1]['content'], list(labels))
+    if passages:
+        messages[-1]['context'] = [dict(passage, label=labels[passage['source']]) for passage in passages]
+
+def combine_responses(responses):
+    """Join the successful multi-model responses into a single history entry.
+    
+    Failed models are reported to the client but never stored as if the
+    assistant had said something; returns None when every model failed.
+    """
+    succeeded = [resp for resp in responses if resp['success']]
+    if not succeeded:
+        return None
+    return "\n\n---\n\n".join([
+        f"**{resp['provider']} - {resp['model']}:**\n{resp['response']}"
+        for resp in succeeded
+    ])
+
+def saved_turn_events(messages, turn_id, selected_models):
+    """Events sending a job's turn again when it was saved before the job was re-run.
+    
+    Returns None when ``messages`` holds no user turn tagged with ``turn_id``.
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].get('turn') == turn_id:
+            break
     else:
-        enhanced_messages = messages
+        return None
+    answer = messages[index + 1]['content'] if index + 1 < len(messages) else ''
+    if len(selected_models) == 1:
+        return [{'type': 'content', 'content': answer}]
+    # Split the combined answer back into what each model said
+    sections = answer.split('\n\n---\n\n')
+    events = []
+    for model_info in selected_models:
+        provider, model = model_info['provider'], model_info['model']
+        header = f'**{provider} - {model}:**\n'
+        events.append({'type': 'model_start', 'provider': provider, 'model': model})
+        section = next((section for section in sections if section.startswith(header)), None)
+        if section is None:
+            events.append({'type': 'model_error', 'provider': provider, 'model': model,
+                           'error': 'No answer was saved for this model', 'code': 'not_saved', 'retryable': False})
+            continue
+        events.append({'type': 'model_content', 'provider': provider, 'model': model,
+                       'content': section[len(header):]})
+        events.append({'type': 'model_done', 'provider': provider, 'model': model})
+    return events
+
+def error_status(info):
+    """HTTP status for a failed single-model /api/chat request"""
+    return {'bad_request': 400, 'rate_limited': 429, 'circuit_open': 503, 'timeout': 504}.get(info['code'], 502)
+
+def sse_event(event):
+    """Frame an event for a Server-Sent Events stream"""
+    return f"data: {json.dumps(event)}\n\n"
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUESTS.observe(time.perf_counter() - started, method=request.method,
+                              endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.url_defaults
+def versioned_static_urls(endpoint, values):
+    """Static URLs carry the file's content hash (?v=), so browsers can keep them for good"""
+    if endpoint == 'static' and 'v' not in values:
+        version = static_versions.version(values.get('filename', ''))
+        if version:
+            values['v'] = version
+
+@app.after_request
+def finish_response(response):
+    """Cache headers, strong ETags and gzip/brotli for pages, static files and JSON.
     
-    data = {
-        'model': model,
-        'messages': enhanced_messages,
-        "temperature": 0.7,
-        "max_tokens": 2000,
-        "stream": stream
-    }
+    Streamed responses (SSE, file downloads) pass through untouched, so
+    their frames are still flushed as they are written.
+    """
+    static = request.endpoint == 'static'
+    if static and response.status_code in (200, 304) and request.args.get('v'):
+        if request.args['v'] == static_versions.version(request.view_args['filename']):
+            response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    if request.method not in ('GET', 'HEAD'):
+        return response
+    if response.status_code == 304:
+        # Answer with the ETag of the encoding the client holds
+        etag, weak = response.get_etag()
+        for encoding in encodings() if etag and not weak else ():
+            if request.if_none_match.contains(variant_etag(etag, encoding)):
+                response.set_etag(variant_etag(etag, encoding))
+                break
+        return response
+    if response.status_code != 200 or not compressible(response) or (response.is_streamed and not static):
+        return response
     
-    try:
-        response = requests.post(
-            'https://quasarmarket.coforge.com/qag/llmrouter-api/v2/chat/completions',
-            headers=headers,
-            json=data,
-            stream=stream
-        )
-        response.raise_for_status()
-        if stream:
+    response.vary.add('Accept-Encoding')
+    if static:
+        response.direct_passthrough = False
+    etag, weak = response.get_etag()
+    if etag is None:
+        response.add_etag()
+        etag, weak = response.get_etag()
+        response.headers.setdefault('Cache-Control', 'no-cache')
+    encoding = negotiate(request.accept_encodings) if COMPRESS_MIN_BYTES > 0 else None
+    if encoding and len(response.get_data()) < COMPRESS_MIN_BYTES:
+        encoding = None
+    if not weak:
+        response.set_etag(variant_etag(etag, encoding))
+        response.make_conditional(request.environ)
+        if response.status_code == 304:
             return response
-        return response.json()['choices'][0]['message']['content']
-    except Exception as e:
-        return f"Error: {str(e)}"
+    if encoding:
+        data = response.get_data()
+        if static:
+            body = static_versions.compressed(request.view_args['filename'], etag, encoding, data)
+        else:
+            body = compress(data, encoding)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -227,16 +738,194 @@ def get_credentials():
     credentials = load_credentials()
     return jsonify(credentials)
 
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    """Get hit/miss counters for the in-process caches"""
+    return jsonify({
+        'credentials': credentials_cache.stats(),
+        'behavior': behavior_cache.stats(),
+        'model_groups': model_groups_cache.stats(),
+        'responses': response_cache.stats()
+    })
+
+@app.route('/api/cache/responses', methods=['DELETE'])
+def clear_response_cache():
+    """Remove every cached model response"""
+    response_cache.clear()
+    return jsonify({'success': True})
+
+@app.route('/api/providers/status')
+def get_provider_status():
+    """Circuit breaker and rate limit state of every provider adapter"""
+    return jsonify({name: adapter.resilience.stats() for name, adapter in PROVIDERS.items()})
+
+@app.route('/api/routing')
+def get_routing():
+    """Model groups and the rolling latency estimates routed selections are ranked by"""
+    return jsonify({'groups': model_groups_cache.get(), 'models': latency.stats()})
+
+@app.route('/api/cache/reload', methods=['POST'])
+def reload_cache():
+    """Re-read credentials.json and behavior.txt on the next request"""
+    reload_config()
+    return jsonify({'success': True})
+
+def list_response(response, etag, version):
+    """Mark a list response with its ETag and change version; browsers revalidate it on every use"""
+    response.set_etag(etag)
+    response.headers['X-Change-Version'] = str(version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(etag, version):
+    return list_response(Response(status=304), etag, version)
+
+def list_delta(kind):
+    """The changes to a list since ?since=<version>, or a reset when the client must reload it"""
+    version = changes.version()
+    delta = changes.since(request.args.get('since', 0, type=int), kind, upto=version)
+    if delta is None:
+        return jsonify({'version': version, 'reset': True})
+    return jsonify({'version': version, 'changes': delta})
+
+def feed_start(since):
+    """The version a change feed starts after: ``since`` or the latest; None if invalid"""
+    try:
+        return int(since or changes.version())
+    except ValueError:
+        return None
+
+def change_frames(since, version):
+    """SSE frames for the changes after version ``since`` up to ``version``"""
+    # A version ahead of the log is from before it was recreated
+    delta = changes.since(since, upto=version) if version > since else None
+    if delta is None:
+        delta = [{'version': version, 'kind': None, 'id': None, 'op': 'reset', 'data': None}]
+    return [f"id: {change['version']}\ndata: {json.dumps(change)}\n\n" for change in delta]
+
+def change_events(since):
+    """SSE frames for every chat and note change after version ``since``.
+    
+    Ends after CHANGE_FEED_SECONDS, as each open feed holds a server thread.
+    The last frame carries the feed's position as its event id, so the
+    browser reconnects from there without missing a change.
+    """
+    ends = time.monotonic() + CHANGE_FEED_SECONDS
+    while True:
+        remaining = ends - time.monotonic()
+        if remaining <= 0:
+            yield f'id: {since}\n\n'
+            return
+        version = changes.wait(since, min(KEEPALIVE_SECONDS, remaining))
+        if version == since:
+            yield ': keepalive\n\n'
+            continue
+        yield from change_frames(since, version)
+        since = version
+
+@app.route('/api/changes')
+def change_feed():
+    """Server-Sent Events feed of chat and note list changes.
+    
+    Starts after the Last-Event-ID header or ?since=<version>. A 'reset'
+    change means the client should reload both lists.
+    """
+    since = feed_start(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    if since is None:
+        return jsonify({'error': 'Invalid version'}), 400
+    return Response(change_events(since), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/api/chats')
 def get_chats():
-    """Get all chat histories"""
-    chats = get_all_chats()
-    return jsonify(chats)
+    """Get chat histories, optionally paginated and filtered by folder"""
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    folder_name = request.args.get('folder')
+    order = 'asc' if request.args.get('order') == 'asc' else 'desc'
+    
+    if 'since' in request.args:
+        return list_delta('chat')
+    version = changes.version('chat')
+    etag = f'chats-{version}'
+    if etag_matches(request.if_none_match, etag):
+        return not_modified(etag, version)
+    
+    chats = get_all_chats(limit, offset, folder_name, order)
+    response = jsonify(chats)
+    response.headers['X-Total-Count'] = str(catalog.count(folder_name))
+    return list_response(response, etag, version)
+
+@app.route('/api/chats/reindex', methods=['POST'])
+def reindex_chats():
+    """Repair the chat catalog against the history directory"""
+    if request.args.get('full'):
+        report = catalog.rebuild()
+    else:
+        report = catalog.repair()
+    return jsonify(report)
+
+@app.route('/api/archive')
+def get_archive_stats():
+    """Archived chat count and bytes before and after archiving"""
+    if not hasattr(chat_storage, 'archive'):
+        return jsonify({'error': 'This chat store has no archive'}), 404
+    return jsonify(chat_storage.archive.stats())
+
+@app.route('/api/archive/run', methods=['POST'])
+def run_archive():
+    """Archive idle chats now (?days= overrides QUERYQUEST_ARCHIVE_DAYS)"""
+    if not hasattr(chat_storage, 'archive_idle'):
+        return jsonify({'error': 'This chat store has no archive'}), 404
+    return jsonify(archive_idle_chats(request.args.get('days', ARCHIVE_DAYS, type=float)))
+
+@app.route('/api/search')
+def search():
+    """Search chat messages, titles and notes, best matches first.
+    
+    Snippets are escaped HTML with the matched words in <mark> tags.
+    """
+    query = request.args.get('q', '')
+    # A negative LIMIT would mean no limit at all to SQLite
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    kind = request.args.get('kind')
+    
+    results = []
+    titles = {}
+    for hit in search_index.search(query, limit, offset, kind):
+        if hit['kind'] == 'note':
+            results.append({'type': 'note', 'filename': hit['doc_id'], 'snippet': hit['snippet'],
+                            'score': hit['score']})
+            continue
+        chat_id = hit['doc_id']
+        if chat_id not in titles:
+            entry = catalog.get(chat_id)
+            titles[chat_id] = entry['title'] if entry else None
+        result = {'type': hit['kind'], 'chat_id': chat_id, 'title': titles[chat_id],
+                  'snippet': hit['snippet'], 'score': hit['score']}
+        if hit['kind'] == 'message':
+            result['message_index'] = hit['position']
+            result['role'] = hit['role']
+        results.append(result)
+    return jsonify(results)
+
+@app.route('/api/search/reindex', methods=['POST'])
+def reindex_search():
+    """Rebuild the search index from chat history and notes"""
+    return jsonify(search_index.rebuild(store, 'text_notes'))
 
 @app.route('/api/chat/<chat_id>')
 def get_chat(chat_id):
-    """Get specific chat history"""
-    chat = load_chat_history(chat_id)
+    """Get specific chat history.
+    
+    With ?limit=N only the latest N messages are returned, plus a
+    next_cursor to pass as ?before= for the page of older ones.
+    """
+    limit = request.args.get('limit', type=int)
+    if limit and limit > 0:
+        chat = load_chat_page(chat_id, limit, request.args.get('before', type=int))
+    else:
+        chat = load_chat_history(chat_id)
     if chat:
         return jsonify(chat)
     return jsonify({'error': 'Chat not found'}), 404
@@ -246,140 +935,81 @@ def send_message():
     """Send message to LLM(s)"""
     data = request.json
     message = data.get('message')
-    chat_id = data.get('chat_id')
-    folder_name = data.get('folder_name')
-    selected_models = data.get('selected_models', [])
-    
-    # Handle backward compatibility for single model
-    if not selected_models:
-        provider = data.get('provider')
-        model = data.get('model')
-        if provider and model:
-            selected_models = [{'provider': provider, 'model': model}]
+    selected_models = parse_model_selection(data)
     
     if not selected_models:
         return jsonify({'error': 'No models selected'}), 400
     
+    use_cache = bool(data.get('use_cache', RESPONSE_CACHE))
     credentials = load_credentials()
     
     # Load existing chat or create new one
-    if chat_id:
-        chat_data = load_chat_history(chat_id)
-        if chat_data:
-            messages = chat_data['messages']
-            title = chat_data['title']
-            folder_name = chat_data.get('folder_name')
-        else:
-            messages = []
-            title = message[:50] + "..." if len(message) > 50 else message
-    else:
-        chat_id = str(uuid.uuid4())
-        messages = []
-        title = message[:50] + "..." if len(message) > 50 else message
-        # folder_name already defined from request data
+    chat_id, messages, title, folder_name, _ = open_chat(data.get('chat_id'), message, data.get('folder_name'))
+    base = len(messages)
     
     # Add user message
-    messages.append({'role': 'user', 'content': message})
+    messages.append(user_message(data))
+    add_retrieved_context(messages, data)
     
     # Handle single model (backward compatibility)
     if len(selected_models) == 1:
         model_info = selected_models[0]
         provider = model_info['provider']
         model = model_info['model']
+        routed = 'candidates' in model_info
         
-        if provider not in credentials:
+        if not routed and provider not in credentials:
             return jsonify({'error': f'Provider {provider} not found in credentials'}), 400
         
-        provider_config = credentials[provider]
+        if not routed and get_provider(provider) is None:
+            return jsonify({'error': 'Unsupported provider'}), 400
         
         try:
-            if provider == 'openai':
-                response = call_openai_api(messages, model, provider_config['api_key'])
-            elif provider == 'anthropic':
-                response = call_anthropic_api(messages, model, provider_config['api_key'])
-            elif provider == 'coforge':
-                response = call_coforge_api(messages, model, provider_config['api_key'])
-            else:
-                return jsonify({'error': 'Unsupported provider'}), 400
+            route = {}
+            try:
+                if routed:
+                    candidate, response, hedged = call_routed(model_info, messages, credentials, use_cache)
+                    route = routed_fields(model_info, candidate, hedged)
+                else:
+                    response = call_model(provider, model, messages, credentials,
+                                          timeout=model_timeout(model_info), use_cache=use_cache)
+            except Exception as e:
+                # Nothing is saved, so the message can simply be sent again
+                info = error_info(e)
+                response = jsonify(dict(info, chat_id=chat_id, title=title, is_multi=False))
+                if info.get('retry_after'):
+                    response.headers['Retry-After'] = str(int(info['retry_after'] + 0.5))
+                return response, error_status(info)
             
             # Add assistant response
             messages.append({'role': 'assistant', 'content': response})
             
             # Save chat history
-            save_chat_history(chat_id, messages, title, folder_name)
+            save_chat_history(chat_id, messages, title, folder_name, base)
             
-            return jsonify({
+            return jsonify(dict(route, **{
                 'response': response,
                 'chat_id': chat_id,
                 'title': title,
                 'is_multi': False
-            })
+            }))
             
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
     # Handle multiple models
     else:
-        responses = []
-        
-        for model_info in selected_models:
-            provider = model_info['provider']
-            model = model_info['model']
-            
-            if provider not in credentials:
-                responses.append({
-                    'provider': provider,
-                    'model': model,
-                    'response': f'Error: Provider {provider} not found in credentials',
-                    'success': False
-                })
-                continue
-            
-            provider_config = credentials[provider]
-            
-            try:
-                if provider == 'openai':
-                    response = call_openai_api(messages, model, provider_config['api_key'])
-                elif provider == 'anthropic':
-                    response = call_anthropic_api(messages, model, provider_config['api_key'])
-                elif provider == 'coforge':
-                    response = call_coforge_api(messages, model, provider_config['api_key'])
-                else:
-                    response = f'Error: Unsupported provider {provider}'
-                    responses.append({
-                        'provider': provider,
-                        'model': model,
-                        'response': response,
-                        'success': False
-                    })
-                    continue
-                
-                responses.append({
-                    'provider': provider,
-                    'model': model,
-                    'response': response,
-                    'success': True
-                })
-                
-            except Exception as e:
-                responses.append({
-                    'provider': provider,
-                    'model': model,
-                    'response': f'Error: {str(e)}',
-                    'success': False
-                })
-        
-        # Create combined response for chat history
-        combined_response = "\n\n---\n\n".join([
-            f"**{resp['provider']} - {resp['model']}:**\n{resp['response']}"
-            for resp in responses
-        ])
+        responses = dispatch_models(selected_models, messages, credentials, use_cache)
         
-        # Add assistant response to chat history
-        messages.append({'role': 'assistant', 'content': combined_response})
+        # Add combined response to chat history
+        combined = combine_responses(responses)
+        if combined is None:
+            return jsonify({'error': 'All models failed', 'code': 'all_failed', 'responses': responses,
+                            'chat_id': chat_id, 'title': title, 'is_multi': True}), 502
+        messages.append({'role': 'assistant', 'content': combined})
         
         # Save chat history
-        save_chat_history(chat_id, messages, title, folder_name)
+        save_chat_history(chat_id, messages, title, folder_name, base)
         
         return jsonify({
             'responses': responses,
@@ -388,184 +1018,321 @@ def send_message():
             'is_multi': True
         })
 
-@app.route('/api/chat/stream', methods=['POST'])
-def stream_message():
-    """Stream message response using Server-Sent Events"""
-    data = request.json
+def generate_stream(data, timings, turn_id=None):
+    """Run a streamed chat turn, yielding its SSE frames; the chat is saved at the end.
+    
+    The user message is tagged with ``turn_id`` (the job id), so a job re-run
+    after a crash sends the saved answer again instead of a second turn.
+    """
     message = data.get('message')
-    chat_id = data.get('chat_id')
-    folder_name = data.get('folder_name')
-    selected_models = data.get('selected_models', [])
+    selected_models = parse_model_selection(data)
+    use_cache = bool(data.get('use_cache', RESPONSE_CACHE))
+    credentials = load_credentials()
     
-    if not selected_models:
-        provider = data.get('provider')
-        model = data.get('model')
-        if provider and model:
-            selected_models = [{'provider': provider, 'model': model}]
+    # Clients can ask for a timing breakdown on the final 'done' event
+    def done_event(**fields):
+        event = dict(fields, type='done')
+        if data.get('timings'):
+            event['timings'] = timings.as_dict(selected_models)
+        return sse_event(event)
     
-    if not selected_models:
-        return jsonify({'error': 'No models selected'}), 400
+    # Load existing chat or create new one
+    with timings.phase('load'):
+        chat_id, messages, title, folder_name, _ = open_chat(data.get('chat_id'), message, data.get('folder_name'))
+    base = len(messages)
+    if data.get('new_chat'):
+        yield sse_event({'type': 'chat_id', 'chat_id': chat_id, 'title': title})
+    if turn_id:
+        saved = saved_turn_events(messages, turn_id, selected_models)
+        if saved is not None:
+            for event in saved:
+                yield sse_event(event)
+            yield done_event()
+            return
     
-    credentials = load_credentials()
+    # Add user message
+    with timings.phase('retrieval'):
+        messages.append(dict(user_message(data), turn=turn_id) if turn_id else user_message(data))
+        add_retrieved_context(messages, data)
+    timings.start_models()
     
-    def generate():
-        # Use folder_name from outer scope
-        current_folder_name = folder_name
+    # Every model runs concurrently and chunks are relayed as they arrive,
+    # coalesced into fewer frames, while results keep the request order
+    multi = len(selected_models) > 1
+    if multi:
+        for model_info in selected_models:
+            yield sse_event({'type': 'model_start', 'provider': model_info['provider'], 'model': model_info['model']})
+        framers = [content_framer({'type': 'model_content', 'provider': model_info['provider'],
+                                   'model': model_info['model']}) for model_info in selected_models]
+    else:
+        framers = [content_framer({'type': 'content'})]
+    
+    parts = [[] for _ in selected_models]
+    responses = [None] * len(selected_models)
+    routes = [{} for _ in selected_models]
+    coalescer = Coalescer() if COALESCE_MS > 0 else None
+    for index, kind, payload in stream_models(selected_models, messages, credentials, use_cache, coalescer):
+        provider = selected_models[index]['provider']
+        model = selected_models[index]['model']
         
-        # Load existing chat or create new one
-        if chat_id:
-            chat_data = load_chat_history(chat_id)
-            if chat_data:
-                messages = chat_data['messages']
-                title = chat_data['title']
-                current_folder_name = chat_data.get('folder_name')
-            else:
-                messages = []
-                title = message[:50] + "..." if len(message) > 50 else message
-                # Keep current_folder_name from request data
+        if kind == 'content':
+            timings.chunk(index)
+            parts[index].append(payload)
+            yield framers[index](payload)
+            continue
+        if kind == 'route':
+            # Frames keep the selection's provider and model; this names the one answering
+            routes[index] = payload
+            yield sse_event({'type': 'routed', 'provider': provider, 'model': model, 'routed_provider': payload['provider'],
+                             'routed_model': payload['model'], 'hedged': payload['hedged']})
+            continue
+        timings.model_done(index)
+        if kind == 'done':
+            responses[index] = dict({'provider': provider, 'model': model, 'response': ''.join(parts[index]),
+                                     'success': True}, **routes[index])
+            if multi:
+                yield sse_event({'type': 'model_done', 'provider': provider, 'model': model})
         else:
-            new_chat_id = str(uuid.uuid4())
-            messages = []
-            title = message[:50] + "..." if len(message) > 50 else message
-            # Keep current_folder_name from request data
-            yield f"data: {json.dumps({'type': 'chat_id', 'chat_id': new_chat_id, 'title': title})}\n\n"
-        
-        # Add user message
-        messages.append({'role': 'user', 'content': message})
-        
-        if len(selected_models) == 1:
-            # Single model streaming
-            model_info = selected_models[0]
-            provider = model_info['provider']
-            model = model_info['model']
-            
-            if provider not in credentials:
-                yield f"data: {json.dumps({'type': 'error', 'error': f'Provider {provider} not found'})}\n\n"
+            responses[index] = dict(payload, provider=provider, model=model, success=False)
+            if not multi:
+                yield sse_event(dict(payload, type='error'))
                 return
-            
-            provider_config = credentials[provider]
-            full_response = ""
-            
+            yield sse_event(dict(payload, type='model_error', provider=provider, model=model))
+    
+    if multi:
+        combined = combine_responses(responses)
+        if combined is None:
+            yield done_event(saved=False)
+            return
+        messages.append({'role': 'assistant', 'content': combined})
+    else:
+        messages.append({'role': 'assistant', 'content': responses[0]['response']})
+    with timings.phase('save'):
+        save_chat_history(chat_id, messages, title, folder_name, base)
+    yield done_event()
+
+def run_stream_job(job):
+    """Job queue runner: generate a streamed turn and publish its frames"""
+    timings = RequestTimings()
+    timings.phases['queue'] = time.time() - job.created_at
+    frames = generate_stream(job.request, timings, job.id)
+    try:
+        for frame in frames:
+            if job.cancelled.is_set():
+                job.emit(sse_event({'type': 'error', 'error': 'Cancelled', 'code': 'cancelled', 'retryable': False}))
+                return
+            job.emit(frame)
+    except Exception as e:
+        job.emit(sse_event(dict(error_info(e), type='error')))
+        raise
+    finally:
+        frames.close()
+
+def provider_concurrency(provider):
+    """Jobs allowed to use a provider at once: credentials.json 'max_concurrency' or the default"""
+    return load_credentials().get(provider, {}).get('max_concurrency') or PROVIDER_CONCURRENCY
+
+# Streamed generations run as persistent background jobs, so they finish and
+# are saved even when the client disconnects
+jobs = JobQueue(os.path.join('chat_history', 'jobs.db'), run_stream_job, provider_concurrency)
+jobs.start()
+
+def submit_stream(data, user):
+    """Queue a streamed turn as a job; returns None when no models are selected"""
+    selected_models = parse_model_selection(data)
+    if not selected_models:
+        return None
+    data['selected_models'] = selected_models
+    
+    # Fix the chat id now so a job re-run after a restart keeps to the same chat
+    if not data.get('chat_id'):
+        data['chat_id'] = str(uuid.uuid4())
+        data['new_chat'] = True
+    return jobs.submit(user, data, selection_providers(selected_models))
+
+def job_response(job_id, last_event_id=None):
+    """SSE response following a job's events from after last_event_id"""
+    events = jobs.subscribe(job_id, last_event_id)
+    if events is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def relay():
+        for event_id, frame in events:
+            yield frame if event_id is None else f'id: {event_id}\n{frame}'
+    
+    return Response(relay(), mimetype='text/event-stream',
+                    headers={'X-Job-Id': job_id, 'Cache-Control': 'no-cache'})
+
+@app.route('/api/chat/stream', methods=['POST'])
+def stream_message():
+    """Stream message response using Server-Sent Events.
+    
+    The turn runs as a background job; its id is in the X-Job-Id header and
+    a dropped stream can be resumed from /api/jobs/<job_id>/events.
+    """
+    job = submit_stream(request.json, request.remote_addr)
+    if job is None:
+        return jsonify({'error': 'No models selected'}), 400
+    return job_response(job.id)
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Get a job's status"""
+    info = jobs.status(job_id)
+    if info is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(info)
+
+@app.route('/api/jobs/<job_id>/events')
+def resume_job(job_id):
+    """Follow a job's events, resuming after the Last-Event-ID header if given"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return job_response(job_id, last_event_id)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    if not jobs.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    return jsonify({'success': True})
+
+# Batch runs keep their input, results and final report in BATCH_DIR; a
+# run's lock file is held by the process running it
+BATCH_DIR = os.path.join('chat_history', 'batches')
+os.makedirs(BATCH_DIR, exist_ok=True)
+batch_runs = {}
+batch_runs_lock = threading.Lock()
+
+def batch_path(batch_id, suffix):
+    return os.path.join(BATCH_DIR, secure_filename(batch_id) + suffix)
+
+def batch_call(credentials):
+    """A BatchRun ``call`` that answers like a chat turn"""
+    def call(provider, model, messages, timeout):
+        return call_model(provider, model, [dict(message) for message in messages], credentials, timeout=timeout)
+    return call
+
+def start_batch(batch_id):
+    """Run a stored batch in the background, skipping answers it already has.
+    
+    Returns the BatchRun, or None when another process is running it.
+    """
+    lock = FileLock(batch_path(batch_id, '.lock'))
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        with open(batch_path(batch_id, '.input.jsonl'), encoding='utf-8') as f:
+            items = read_items(f)
+        credentials = load_credentials()
+        prices = {provider: config.get('prices') or {} for provider, config in credentials.items()
+                  if isinstance(config, dict)}
+        run = BatchRun(items, batch_path(batch_id, '.results.jsonl'), batch_call(credentials),
+                       provider_concurrency, prices)
+    except BaseException:
+        lock.release()
+        raise
+    
+    def work():
+        try:
             try:
-                if provider == 'openai':
-                    stream = call_openai_api(messages, model, provider_config['api_key'], stream=True)
-                    for chunk in stream:
-                        if chunk.choices[0].delta.get('content'):
-                            content = chunk.choices[0].delta.content
-                            full_response += content
-                            yield f"data: {json.dumps({'type': 'content', 'content': content})}\n\n"
-                elif provider == 'anthropic':
-                    stream = call_anthropic_api(messages, model, provider_config['api_key'], stream=True)
-                    for line in stream.iter_lines():
-                        if line:
-                            line = line.decode('utf-8')
-                            if line.startswith('data: '):
-                                try:
-                                    chunk_data = json.loads(line[6:])
-                                    if chunk_data.get('type') == 'content_block_delta':
-                                        content = chunk_data.get('delta', {}).get('text', '')
-                                        if content:
-                                            full_response += content
-                                            yield f"data: {json.dumps({'type': 'content', 'content': content})}\n\n"
-                                except json.JSONDecodeError:
-                                    continue
-                elif provider == 'coforge':
-                    stream = call_coforge_api(messages, model, provider_config['api_key'], stream=True)
-                    for line in stream.iter_lines():
-                        if line:
-                            line = line.decode('utf-8')
-                            if line.startswith('data: '):
-                                try:
-                                    chunk_data = json.loads(line[6:])
-                                    if chunk_data.get('choices') and chunk_data['choices'][0].get('delta', {}).get('content'):
-                                        content = chunk_data['choices'][0]['delta']['content']
-                                        full_response += content
-                                        yield f"data: {json.dumps({'type': 'content', 'content': content})}\n\n"
-                                except json.JSONDecodeError:
-                                    continue
-                
-                # Add assistant response and save
-                messages.append({'role': 'assistant', 'content': full_response})
-                save_chat_history(chat_id or new_chat_id, messages, title, current_folder_name)
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                
-            except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
-        else:
-            # Multi-model streaming
-            responses = []
-            for model_info in selected_models:
-                provider = model_info['provider']
-                model = model_info['model']
-                
-                yield f"data: {json.dumps({'type': 'model_start', 'provider': provider, 'model': model})}\n\n"
-                
-                if provider not in credentials:
-                    error_msg = f'Provider {provider} not found'
-                    responses.append({'provider': provider, 'model': model, 'response': f'Error: {error_msg}', 'success': False})
-                    yield f"data: {json.dumps({'type': 'model_error', 'provider': provider, 'model': model, 'error': error_msg})}\n\n"
-                    continue
-                
-                provider_config = credentials[provider]
-                full_response = ""
-                
-                try:
-                    if provider == 'openai':
-                        stream = call_openai_api(messages, model, provider_config['api_key'], stream=True)
-                        for chunk in stream:
-                            if chunk.choices[0].delta.get('content'):
-                                content = chunk.choices[0].delta.content
-                                full_response += content
-                                yield f"data: {json.dumps({'type': 'model_content', 'provider': provider, 'model': model, 'content': content})}\n\n"
-                    elif provider == 'anthropic':
-                        stream = call_anthropic_api(messages, model, provider_config['api_key'], stream=True)
-                        for line in stream.iter_lines():
-                            if line:
-                                line = line.decode('utf-8')
-                                if line.startswith('data: '):
-                                    try:
-                                        chunk_data = json.loads(line[6:])
-                                        if chunk_data.get('type') == 'content_block_delta':
-                                            content = chunk_data.get('delta', {}).get('text', '')
-                                            if content:
-                                                full_response += content
-                                                yield f"data: {json.dumps({'type': 'model_content', 'provider': provider, 'model': model, 'content': content})}\n\n"
-                                    except json.JSONDecodeError:
-                                        continue
-                    elif provider == 'coforge':
-                        stream = call_coforge_api(messages, model, provider_config['api_key'], stream=True)
-                        for line in stream.iter_lines():
-                            if line:
-                                line = line.decode('utf-8')
-                                if line.startswith('data: '):
-                                    try:
-                                        chunk_data = json.loads(line[6:])
-                                        if chunk_data.get('choices') and chunk_data['choices'][0].get('delta', {}).get('content'):
-                                            content = chunk_data['choices'][0]['delta']['content']
-                                            full_response += content
-                                            yield f"data: {json.dumps({'type': 'model_content', 'provider': provider, 'model': model, 'content': content})}\n\n"
-                                    except json.JSONDecodeError:
-                                        continue
-                    
-                    responses.append({'provider': provider, 'model': model, 'response': full_response, 'success': True})
-                    yield f"data: {json.dumps({'type': 'model_done', 'provider': provider, 'model': model})}\n\n"
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    responses.append({'provider': provider, 'model': model, 'response': f'Error: {error_msg}', 'success': False})
-                    yield f"data: {json.dumps({'type': 'model_error', 'provider': provider, 'model': model, 'error': error_msg})}\n\n"
-            
-            # Create combined response for chat history
-            combined_response = "\n\n---\n\n".join([
-                f"**{resp['provider']} - {resp['model']}:**\n{resp['response']}"
-                for resp in responses
-            ])
-            
-            messages.append({'role': 'assistant', 'content': combined_response})
-            save_chat_history(chat_id or new_chat_id, messages, title, current_folder_name)
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                report = run.run()
+            except Exception:
+                report = dict(run.report(), status='failed')
+            with open(batch_path(batch_id, '.report.json'), 'w', encoding='utf-8') as f:
+                json.dump(report, f)
+        finally:
+            lock.release()
+    
+    with batch_runs_lock:
+        batch_runs[batch_id] = run
+    threading.Thread(target=work, name=f'batch-{batch_id[:8]}', daemon=True).start()
+    return run
+
+def batch_status(batch_id):
+    """A batch's report: live if it runs here, else from its files"""
+    with batch_runs_lock:
+        run = batch_runs.get(batch_id)
+    if run is not None and run.status in ('pending', 'running'):
+        return run.report()
+    if not os.path.exists(batch_path(batch_id, '.input.jsonl')):
+        return None
+    lock = FileLock(batch_path(batch_id, '.lock'))
+    running = not lock.acquire(blocking=False)
+    if not running:
+        lock.release()
+        try:
+            with open(batch_path(batch_id, '.report.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+    with open(batch_path(batch_id, '.input.jsonl'), encoding='utf-8') as f:
+        total = sum(len(item['models']) for item in read_items(f))
+    done = len(completed(batch_path(batch_id, '.results.jsonl')))
+    # Running in another process, or stopped before it finished
+    return {'status': 'running' if running else 'interrupted', 'total': total, 'succeeded': done,
+            'remaining': total - done}
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """Start a batch from a JSONL upload ('file') or request body.
     
-    return Response(generate(), mimetype='text/event-stream')
+    Lines that select no models use ?models=provider/model,...; see batch.py
+    for the line format. Results stream to GET /api/batch/<id>/results.
+    """
+    upload = request.files.get('file')
+    data = upload.read() if upload is not None else request.get_data()
+    try:
+        items = read_items(data.decode('utf-8').splitlines(), parse_models(request.values.get('models', '')))
+    except (UnicodeDecodeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if not items:
+        return jsonify({'error': 'No prompts given'}), 400
+    
+    batch_id = str(uuid.uuid4())
+    with open(batch_path(batch_id, '.input.jsonl'), 'w', encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item) + '\n')
+    run = start_batch(batch_id)
+    return jsonify(dict(run.report(), id=batch_id)), 202
+
+@app.route('/api/batch/<batch_id>')
+def get_batch(batch_id):
+    """Get a batch's progress, throughput and token and cost totals"""
+    report = batch_status(batch_id)
+    if report is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(dict(report, id=batch_id))
+
+@app.route('/api/batch/<batch_id>/results')
+def get_batch_results(batch_id):
+    """Download the answers written so far, one JSON line each"""
+    path = batch_path(batch_id, '.results.jsonl')
+    if not os.path.exists(batch_path(batch_id, '.input.jsonl')):
+        return jsonify({'error': 'Batch not found'}), 404
+    if not os.path.exists(path):
+        return Response('', mimetype='application/x-ndjson')
+    return send_file(os.path.abspath(path), mimetype='application/x-ndjson', as_attachment=True,
+                     download_name=f'{batch_id}.jsonl', max_age=0)
+
+@app.route('/api/batch/<batch_id>/resume', methods=['POST'])
+def resume_batch(batch_id):
+    """Run the answers a batch is still missing, such as after a restart"""
+    if not os.path.exists(batch_path(batch_id, '.input.jsonl')):
+        return jsonify({'error': 'Batch not found'}), 404
+    run = start_batch(batch_id)
+    if run is None:
+        return jsonify({'error': 'Batch is already running'}), 409
+    return jsonify(dict(run.report(), id=batch_id)), 202
+
+@app.route('/api/batch/<batch_id>', methods=['DELETE'])
+def cancel_batch(batch_id):
+    """Stop a batch running in this process; answers in flight are still written"""
+    with batch_runs_lock:
+        run = batch_runs.get(batch_id)
+    if run is None or run.status not in ('pending', 'running'):
+        return jsonify({'error': 'Batch not found or not running here'}), 404
+    run.cancel()
+    return jsonify({'success': True})
 
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
@@ -574,9 +1341,25 @@ def upload_files():
         return jsonify({'error': 'No files uploaded'}), 400
     
     files = request.files.getlist('files')
-    file_contents = process_uploaded_files(files)
+    try:
+        handles = process_uploaded_files(files)
+    except AttachmentTooLarge as e:
+        return jsonify({'error': str(e)}), 413
     
-    return jsonify({'files': file_contents})
+    return jsonify({'files': handles})
+
+@app.route('/api/attachments/<attachment_id>')
+def get_attachment(attachment_id):
+    """Get an attachment's chunk layout, or the text of one chunk with ?chunk=N"""
+    info = attachments.info(attachment_id)
+    if info is None:
+        return jsonify({'error': 'Attachment not found'}), 404
+    chunk = request.args.get('chunk', type=int)
+    if chunk is None:
+        return jsonify(info)
+    if not 0 <= chunk < len(info['chunks']):
+        return jsonify({'error': 'Chunk not found'}), 404
+    return jsonify({'index': chunk, 'content': attachments.read_chunk(attachment_id, chunk)})
 
 @app.route('/api/chat/<chat_id>/folder', methods=['PUT'])
 def update_chat_folder(chat_id):
@@ -585,15 +1368,10 @@ def update_chat_folder(chat_id):
     folder_name = data.get('folder_name')
     
     try:
-        chat_data = load_chat_history(chat_id)
-        if not chat_data:
+        chat_meta = store.update(chat_id, folder_name=folder_name)
+        if not chat_meta:
             return jsonify({'error': 'Chat not found'}), 404
-        
-        chat_data['folder_name'] = folder_name
-        chat_data['updated_at'] = datetime.now().isoformat()
-        
-        with open(f'chat_history/{chat_id}.json', 'w') as f:
-            json.dump(chat_data, f, indent=2)
+        catalog.upsert(chat_meta)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -606,48 +1384,98 @@ def update_chat_title(chat_id):
     title = data.get('title')
     
     try:
-        chat_data = load_chat_history(chat_id)
-        if not chat_data:
+        chat_meta = store.update(chat_id, title=title)
+        if not chat_meta:
             return jsonify({'error': 'Chat not found'}), 404
-        
-        chat_data['title'] = title
-        chat_data['updated_at'] = datetime.now().isoformat()
-        
-        with open(f'chat_history/{chat_id}.json', 'w') as f:
-            json.dump(chat_data, f, indent=2)
+        catalog.upsert(chat_meta)
+        search_index.index_title(chat_id, title)
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def branch_changed(chat):
+    """Bring the catalog and search index in line after the active branch changed"""
+    catalog.upsert(chat)
+    search_index.index_messages(chat['id'], chat['messages'], chat['appended_from'])
+
+@app.route('/api/chat/<chat_id>/branches')
+def get_branches(chat_id):
+    """List the chat's active and inactive branches"""
+    branches = store.branches(chat_id)
+    if branches is None:
+        return jsonify({'error': 'Chat not found'}), 404
+    return jsonify({'branches': branches})
+
+@app.route('/api/chat/<chat_id>/fork', methods=['POST'])
+def fork_chat(chat_id):
+    """Start a new branch after the first `at` messages; the rest stays available as a branch"""
+    data = request.json or {}
+    at = data.get('at')
+    # JSON true/false would pass as the ints 1/0
+    if isinstance(at, bool) or not isinstance(at, int):
+        return jsonify({'error': 'at must be a message index'}), 400
+    try:
+        chat = store.fork(chat_id, at)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if chat is None:
+        return jsonify({'error': 'Chat not found'}), 404
+    branch_changed(chat)
+    return jsonify({'success': True, 'branches': store.branches(chat_id)})
+
+@app.route('/api/chat/<chat_id>/switch', methods=['POST'])
+def switch_branch(chat_id):
+    """Make another branch the active one"""
+    data = request.json or {}
+    chat = store.switch(chat_id, data.get('branch_id', ''))
+    if chat is None:
+        return jsonify({'error': 'Chat or branch not found'}), 404
+    branch_changed(chat)
+    return jsonify({'success': True, 'branches': store.branches(chat_id)})
+
 @app.route('/api/chat/<chat_id>', methods=['DELETE'])
 def delete_chat(chat_id):
     """Delete a chat"""
-    try:
-        os.remove(f'chat_history/{chat_id}.json')
-        return jsonify({'success': True})
-    except FileNotFoundError:
+    found = store.delete(chat_id)
+    catalog.remove(chat_id)
+    search_index.remove_chat(chat_id)
+    if not found:
         return jsonify({'error': 'Chat not found'}), 404
+    return jsonify({'success': True})
+
+def note_summary(filename):
+    """A note as listed by /api/notes, or None if it is gone"""
+    try:
+        stat = os.stat(os.path.join('text_notes', filename))
+    except OSError:
+        return None
+    return {'filename': filename, 'name': filename[:-4],
+            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()}
 
 @app.route('/api/notes')
 def get_notes():
     """Get all text notes"""
+    if 'since' in request.args:
+        return list_delta('note')
+    # Notes added or removed outside the app change the directory mtime
+    version = changes.version('note')
+    try:
+        etag = f"notes-{version}-{os.stat('text_notes').st_mtime_ns}"
+    except FileNotFoundError:
+        etag = f'notes-{version}'
+    if etag_matches(request.if_none_match, etag):
+        return not_modified(etag, version)
+    
     notes = []
     if os.path.exists('text_notes'):
         for filename in os.listdir('text_notes'):
             if filename.endswith('.txt'):
-                filepath = os.path.join('text_notes', filename)
-                try:
-                    stat = os.stat(filepath)
-                    notes.append({
-                        'filename': filename,
-                        'name': filename[:-4],
-                        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
-                    })
-                except:
-                    continue
+                note = note_summary(filename)
+                if note is not None:
+                    notes.append(note)
     notes.sort(key=lambda x: x['modified'], reverse=True)
-    return jsonify(notes)
+    return list_response(jsonify(notes), etag, version)
 
 @app.route('/api/notes/<filename>')
 def get_note(filename):
@@ -677,6 +1505,12 @@ def save_note():
     try:
         with open(filepath, 'w', encoding='utf-8') as f:
             f.write(content)
+        if filename == 'behavior.txt':
+            behavior_cache.invalidate()
+        else:
+            retriever.index(f'note:{filename}', content)
+        search_index.index_note(filename, content)
+        changes.record('note', filename, 'upsert', note_summary(filename))
         return jsonify({'success': True, 'filename': filename})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -689,6 +1523,11 @@ def delete_note(filename):
     filepath = os.path.join('text_notes', filename)
     try:
         os.remove(filepath)
+        if filename == 'behavior.txt':
+            behavior_cache.invalidate()
+        retriever.remove(f'note:{filename}')
+        search_index.remove_note(filename)
+        changes.record('note', filename, 'delete')
         return jsonify({'success': True})
     except FileNotFoundError:
         return jsonify({'error': 'Note not found'}), 404
@@ -0,0 +1,286 @@
+import os
+import gzip
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from locks import FileLock
+
+# Chats untouched for this many days are moved to the archive; 0 turns it off
+ARCHIVE_DAYS = float(os.environ.get('QUERYQUEST_ARCHIVE_DAYS', '30'))
+# How often the app looks for chats to archive
+ARCHIVE_INTERVAL = float(os.environ.get('QUERYQUEST_ARCHIVE_INTERVAL', str(6 * 3600)))
+# Text blocks at least this long are stored once, by hash, however often they repeat
+BLOB_MIN_CHARS = int(os.environ.get('QUERYQUEST_ARCHIVE_BLOB_CHARS', '2048'))
+# A new segment file is started once the current one reaches this size
+SEGMENT_BYTES = 64 * 1024 * 1024
+# Older clients appended pasted files to the message after this marker
+FILE_MARKER = '\n\n--- File: '
+
+
+class ChatArchive:
+    """Compressed cold storage for chats nobody has touched in a while.
+
+    Each archived chat is one gzip member appended to a segment file, and
+    an SQLite index records its segment, offset and length, so a chat is
+    read back with one seek and one decompress. Message text is split at
+    the markers older clients put before pasted files; every block of
+    BLOB_MIN_CHARS or more is stored once as its own member, keyed by its
+    SHA-256, however many messages and chats repeat it.
+
+    Segments are only appended to. vacuum() copies what is still referenced
+    into fresh segments once most of their bytes belong to chats that have
+    been restored.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+        self.db_path = os.path.join(archive_dir, 'archive.db')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS chats (
+                    id TEXT PRIMARY KEY,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    raw_bytes INTEGER NOT NULL,
+                    mtime REAL,
+                    archived_at REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS refs (
+                    chat_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, hash)
+                ) WITHOUT ROWID
+            ''')
+
+    def _connect(self):
+        """Return this thread's connection to the archive index"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _segment_path(self, segment):
+        return os.path.join(self.archive_dir, f'{segment:06d}.seg')
+
+    def _segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.archive_dir) if name.endswith('.seg'))
+
+    @contextmanager
+    def _writing(self):
+        """Hold the archive for appending, against other threads and processes"""
+        with self._lock, FileLock(os.path.join(self.archive_dir, 'archive.lock')):
+            yield
+
+    def _append(self, data, segment=None):
+        """Compress and append one member; returns (segment, offset, length)"""
+        if segment is None:
+            segments = self._segments()
+            segment = segments[-1] if segments else 1
+            try:
+                if os.path.getsize(self._segment_path(segment)) >= SEGMENT_BYTES:
+                    segment += 1
+            except FileNotFoundError:
+                pass
+        member = gzip.compress(data, compresslevel=6)
+        with open(self._segment_path(segment), 'ab') as f:
+            offset = f.tell()
+            f.write(member)
+            f.flush()
+            os.fsync(f.fileno())
+        return segment, offset, len(member)
+
+    def _read(self, segment, offset, length):
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return gzip.decompress(f.read(length))
+
+    @staticmethod
+    def _split(text):
+        """Split message text into prose and pasted-file blocks; ''.join() restores it"""
+        pieces = text.split(FILE_MARKER)
+        return [pieces[0]] + [FILE_MARKER + piece for piece in pieces[1:]]
+
+    def _pack(self, conn, message, hashes):
+        """The message with long text blocks replaced by blob references"""
+        content = message.get('content')
+        if not isinstance(content, str) or len(content) < BLOB_MIN_CHARS:
+            return message, 0
+        parts = []
+        written = 0
+        for block in self._split(content):
+            if len(block) < BLOB_MIN_CHARS:
+                parts.append(block)
+                continue
+            data = block.encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()
+            if digest not in hashes and conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone() is None:
+                segment, offset, length = self._append(data)
+                conn.execute('INSERT INTO blobs (hash, segment, offset, length, size) VALUES (?, ?, ?, ?, ?)',
+                             (digest, segment, offset, length, len(data)))
+                written += length
+            hashes.add(digest)
+            parts.append({'blob': digest})
+        return dict(message, content=parts), written
+
+    def _unpack(self, conn, message, blobs):
+        content = message.get('content')
+        if not isinstance(content, list):
+            return message
+        text = []
+        for part in content:
+            if isinstance(part, str):
+                text.append(part)
+                continue
+            digest = part['blob']
+            if digest not in blobs:
+                row = conn.execute('SELECT segment, offset, length FROM blobs WHERE hash = ?', (digest,)).fetchone()
+                blobs[digest] = self._read(row['segment'], row['offset'], row['length']).decode('utf-8')
+            text.append(blobs[digest])
+        return dict(message, content=''.join(text))
+
+    def put(self, chat_id, chat, nodes, mtime, raw_bytes):
+        """Archive a chat and its inactive-branch ``nodes``; returns the bytes written.
+
+        ``raw_bytes`` is the size of the files it replaces, kept for stats().
+        """
+        hashes = set()
+        written = 0
+        with self._writing():
+            with self._connect() as conn:
+                messages = []
+                for message in chat['messages']:
+                    message, size = self._pack(conn, message, hashes)
+                    messages.append(message)
+                    written += size
+                packed_nodes = []
+                for node in nodes:
+                    message, size = self._pack(conn, node['message'], hashes)
+                    packed_nodes.append(dict(node, message=message))
+                    written += size
+                record = {'chat': dict(chat, messages=messages), 'nodes': packed_nodes}
+                segment, offset, length = self._append(json.dumps(record).encode('utf-8'))
+                written += length
+                conn.execute('INSERT OR REPLACE INTO chats (id, segment, offset, length, raw_bytes, mtime, archived_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (chat_id, segment, offset, length, raw_bytes, mtime, time.time()))
+                conn.execute('DELETE FROM refs WHERE chat_id = ?', (chat_id,))
+                conn.executemany('INSERT INTO refs (chat_id, hash) VALUES (?, ?)',
+                                 [(chat_id, digest) for digest in hashes])
+        return written
+
+    def get(self, chat_id):
+        """Return (chat, nodes) for an archived chat, or None"""
+        conn = self._connect()
+        for _ in range(2):
+            row = conn.execute('SELECT segment, offset, length FROM chats WHERE id = ?', (chat_id,)).fetchone()
+            if row is None:
+                return None
+            try:
+                record = json.loads(self._read(row['segment'], row['offset'], row['length']))
+                break
+            except FileNotFoundError:
+                # A vacuum moved it meanwhile; the index has the new place
+                continue
+        else:
+            return None
+        blobs = {}
+        chat = record['chat']
+        chat['messages'] = [self._unpack(conn, message, blobs) for message in chat['messages']]
+        nodes = [dict(node, message=self._unpack(conn, node['message'], blobs)) for node in record['nodes']]
+        return chat, nodes
+
+    def has(self, chat_id):
+        return self._connect().execute('SELECT 1 FROM chats WHERE id = ?', (chat_id,)).fetchone() is not None
+
+    def mtime(self, chat_id):
+        row = self._connect().execute('SELECT mtime FROM chats WHERE id = ?', (chat_id,)).fetchone()
+        return row['mtime'] if row else None
+
+    def scan(self):
+        """Map every archived chat id to its modification time when archived"""
+        return {row['id']: row['mtime'] for row in self._connect().execute('SELECT id, mtime FROM chats')}
+
+    def remove(self, chat_id):
+        """Forget an archived chat; its bytes are reclaimed by vacuum()"""
+        with self._connect() as conn:
+            found = conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,)).rowcount > 0
+            conn.execute('DELETE FROM refs WHERE chat_id = ?', (chat_id,))
+        return found
+
+    def _live_bytes(self, conn):
+        chats = conn.execute('SELECT COALESCE(SUM(length), 0) FROM chats').fetchone()[0]
+        blobs = conn.execute('SELECT COALESCE(SUM(length), 0) FROM blobs WHERE hash IN (SELECT hash FROM refs)'
+                             ).fetchone()[0]
+        return chats + blobs
+
+    def _segment_bytes(self):
+        total = 0
+        for segment in self._segments():
+            try:
+                total += os.path.getsize(self._segment_path(segment))
+            except FileNotFoundError:
+                continue
+        return total
+
+    def stats(self):
+        """Archived chat and blob counts, and bytes before and after archiving"""
+        conn = self._connect()
+        chats, raw_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0) FROM chats').fetchone()
+        blobs = conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+        stored = self._segment_bytes()
+        return {'chats': chats, 'blobs': blobs, 'raw_bytes': raw_bytes, 'stored_bytes': stored,
+                'live_bytes': self._live_bytes(conn), 'saved_bytes': raw_bytes - stored}
+
+    def vacuum(self, min_garbage=0.5):
+        """Rewrite the segments once more than ``min_garbage`` of their bytes are unreferenced.
+
+        Returns the bytes reclaimed.
+        """
+        with self._writing():
+            conn = self._connect()
+            before = self._segment_bytes()
+            if not before or self._live_bytes(conn) > before * (1 - min_garbage):
+                return 0
+            old = self._segments()
+            segment = old[-1] + 1
+            with conn:
+                conn.execute('DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM refs)')
+                for table, key in (('blobs', 'hash'), ('chats', 'id')):
+                    rows = conn.execute(f'SELECT {key}, segment, offset, length FROM {table}').fetchall()
+                    for row in rows:
+                        data = self._read(row['segment'], row['offset'], row['length'])
+                        if os.path.exists(self._segment_path(segment)) and \
+                                os.path.getsize(self._segment_path(segment)) >= SEGMENT_BYTES:
+                            segment += 1
+                        new_segment, offset, length = self._append(data, segment)
+                        conn.execute(f'UPDATE {table} SET segment = ?, offset = ?, length = ? WHERE {key} = ?',
+                                     (new_segment, offset, length, row[key]))
+            for number in old:
+                try:
+                    os.remove(self._segment_path(number))
+                except OSError:
+                    # Still open in a reader on Windows; removed by the next vacuum
+                    pass
+            return before - self._segment_bytes()
+
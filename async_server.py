@@ -0,0 +1,541 @@
+"""Asyncio server for QueryQuest.
+
+/api/chat/stream, /api/jobs/<job_id>/events and /api/changes are served
+natively on the event loop. As under Flask a streamed turn runs as a job,
+so it is saved even if the client goes away, but the job runs as a task
+on the loop and reads its provider streams with aiohttp, holding no job
+worker thread. Job and change subscribers are relayed by coroutines, so open feeds
+do not each hold a thread. Every other route is handed to the Flask app
+through a small WSGI bridge running on a thread pool.
+
+    python async_server.py --host 0.0.0.0 --port 5000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_to_bytes
+
+from aiohttp import web
+
+from app import (app as flask_app, load_credentials, parse_model_selection, open_chat,
+                 user_message, add_retrieved_context, save_chat_history, combine_responses,
+                 model_timeout, resolve_model_call, response_cache, sse_event, RESPONSE_CACHE,
+                 latency, rank_candidates, routed_fields, jobs, submit_stream, saved_turn_events,
+                 changes, feed_start, change_frames)
+from changes import KEEPALIVE_SECONDS
+from providers import close_async_sessions
+from resilience import ProviderError, error_info
+from metrics import RequestTimings
+from response_cache import replay
+from relay import Coalescer, content_framer, COALESCE_MS
+
+# Threads for the Flask routes behind the WSGI bridge
+WSGI_THREADS = int(os.environ.get('QUERYQUEST_WSGI_THREADS', '32'))
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+# How long the change watcher's thread waits on the change log at a time
+WATCH_SECONDS = 1.0
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+
+async def run_sync(func, *args):
+    """Run blocking work (chat storage, attachments, the response cache) off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(wsgi_executor, func, *args)
+
+
+async def model_stream(model_info, messages, credentials, use_cache):
+    """Yield one model's text deltas, replaying or filling the response cache"""
+    provider = model_info['provider']
+    model = model_info['model']
+    if provider not in credentials:
+        raise ValueError(f'Provider {provider} not found')
+    provider_config = credentials[provider]
+    # Expanding attachments and the cache lookup read files
+    adapter, payload, cache_key, cached = await run_sync(resolve_model_call, provider, model, messages,
+                                                         provider_config, use_cache)
+    if cached is not None:
+        for content in replay(cached):
+            yield content
+        return
+
+    parts = []
+    async for content in adapter.astream(payload, model, provider_config, timeout=model_timeout(model_info)):
+        parts.append(content)
+        yield content
+    if cache_key:
+        await run_sync(functools.partial(response_cache.put, cache_key, ''.join(parts), provider=provider,
+                                         model=model))
+
+
+async def routed_stream(model_info, messages, credentials, use_cache):
+    """Async counterpart of app._pump_routed_stream.
+
+    Yields ('route', routed_fields) for the first candidate to send text and
+    then ('content', delta) from it; the other candidates are cancelled.
+    """
+    ranked = rank_candidates(model_info, credentials)
+    attempts = asyncio.Queue()
+    tasks = []
+
+    async def pump(attempt, candidate):
+        try:
+            async for content in model_stream(candidate, messages, credentials, use_cache):
+                await attempts.put((attempt, 'content', content))
+            await attempts.put((attempt, 'done', None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await attempts.put((attempt, 'error', e))
+
+    def launch():
+        tasks.append(asyncio.create_task(pump(len(tasks), ranked[len(tasks)])))
+
+    loop = asyncio.get_running_loop()
+    launch()
+    hedge_at = None
+    if model_info.get('hedge') and len(ranked) > 1:
+        hedge_at = loop.time() + latency.hedge_delay(ranked[0]['provider'], ranked[0]['model'])
+    winner = None
+    failed = 0
+    try:
+        while True:
+            try:
+                if hedge_at is None:
+                    attempt, kind, payload = await attempts.get()
+                else:
+                    attempt, kind, payload = await asyncio.wait_for(attempts.get(),
+                                                                    timeout=max(hedge_at - loop.time(), 0.001))
+            except asyncio.TimeoutError:
+                hedge_at = None
+                if winner is None and len(tasks) < len(ranked):
+                    launch()
+                continue
+            if winner is None:
+                if kind == 'error':
+                    failed += 1
+                    if failed == len(tasks):
+                        if len(tasks) == len(ranked):
+                            raise payload
+                        launch()
+                    continue
+                winner = attempt
+                for number, task in enumerate(tasks):
+                    if number != winner:
+                        task.cancel()
+                yield 'route', routed_fields(model_info, ranked[winner], len(tasks) > 1)
+            if attempt != winner:
+                continue
+            if kind == 'error':
+                raise payload
+            if kind == 'done':
+                return
+            yield 'content', payload
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_models(selected_models, messages, credentials, use_cache, coalescer=None):
+    """Async counterpart of app.stream_models.
+
+    Yields (index, kind, payload) as chunks arrive from any model, merging
+    close deltas when given a Coalescer; a model that runs past its timeout
+    is cancelled and reported as an error.
+    """
+    events = asyncio.Queue()
+
+    async def pump(index, model_info):
+        try:
+            if 'candidates' in model_info:
+                async for kind, payload in routed_stream(model_info, messages, credentials, use_cache):
+                    await events.put((index, kind, payload))
+            else:
+                async for content in model_stream(model_info, messages, credentials, use_cache):
+                    await events.put((index, 'content', content))
+            await events.put((index, 'done', None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await events.put((index, 'error', error_info(e)))
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadlines = {}
+    tasks = []
+    for index, model_info in enumerate(selected_models):
+        deadlines[index] = started + model_timeout(model_info)
+        tasks.append(asyncio.create_task(pump(index, model_info)))
+
+    try:
+        while deadlines:
+            now = loop.time()
+            if coalescer is not None and coalescer.due(now):
+                for index, content in coalescer.flush():
+                    yield index, 'content', content
+            try:
+                if events.empty():
+                    remaining = min(deadlines.values()) - now
+                    if coalescer is not None:
+                        remaining = coalescer.wait(now, remaining)
+                    index, kind, payload = await asyncio.wait_for(events.get(), timeout=max(remaining, 0.001))
+                else:
+                    # Skip wait_for's timer when a delta is already queued
+                    index, kind, payload = events.get_nowait()
+            except asyncio.TimeoutError:
+                now = loop.time()
+                for index, deadline in list(deadlines.items()):
+                    if deadline <= now:
+                        tasks[index].cancel()
+                        del deadlines[index]
+                        if coalescer is not None:
+                            for _, content in coalescer.flush(index):
+                                yield index, 'content', content
+                        model_info = selected_models[index]
+                        error = ProviderError(model_info['provider'], 'timeout',
+                                              f'Timed out after {model_timeout(model_info):g}s')
+                        yield index, 'error', error_info(error)
+                continue
+
+            if index not in deadlines:
+                continue
+            if kind == 'content' and coalescer is not None:
+                coalescer.add(index, payload, loop.time())
+                continue
+            if kind not in ('content', 'route'):
+                del deadlines[index]
+                if coalescer is not None:
+                    for _, content in coalescer.flush(index):
+                        yield index, 'content', content
+            yield index, kind, payload
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def generate_stream(data, timings, turn_id=None):
+    """Async counterpart of app.generate_stream, yielding the turn's SSE frames"""
+    message = data.get('message')
+    selected_models = parse_model_selection(data)
+    use_cache = bool(data.get('use_cache', RESPONSE_CACHE))
+    credentials = load_credentials()
+
+    def done_event(**fields):
+        event = dict(fields, type='done')
+        if data.get('timings'):
+            event['timings'] = timings.as_dict(selected_models)
+        return sse_event(event)
+
+    with timings.phase('load'):
+        chat_id, messages, title, folder_name, _ = await run_sync(
+            open_chat, data.get('chat_id'), message, data.get('folder_name'))
+    base = len(messages)
+    if data.get('new_chat'):
+        yield sse_event({'type': 'chat_id', 'chat_id': chat_id, 'title': title})
+    if turn_id:
+        saved = saved_turn_events(messages, turn_id, selected_models)
+        if saved is not None:
+            for event in saved:
+                yield sse_event(event)
+            yield done_event()
+            return
+
+    with timings.phase('retrieval'):
+        user_turn = await run_sync(user_message, data)
+        messages.append(dict(user_turn, turn=turn_id) if turn_id else user_turn)
+        await run_sync(add_retrieved_context, messages, data)
+    timings.start_models()
+
+    multi = len(selected_models) > 1
+    if multi:
+        for model_info in selected_models:
+            yield sse_event({'type': 'model_start', 'provider': model_info['provider'], 'model': model_info['model']})
+        framers = [content_framer({'type': 'model_content', 'provider': model_info['provider'],
+                                   'model': model_info['model']}) for model_info in selected_models]
+    else:
+        framers = [content_framer({'type': 'content'})]
+
+    parts = [[] for _ in selected_models]
+    responses = [None] * len(selected_models)
+    routes = [{} for _ in selected_models]
+    coalescer = Coalescer() if COALESCE_MS > 0 else None
+    events = stream_models(selected_models, messages, credentials, use_cache, coalescer)
+    try:
+        async for index, kind, payload in events:
+            provider = selected_models[index]['provider']
+            model = selected_models[index]['model']
+
+            if kind == 'content':
+                timings.chunk(index)
+                parts[index].append(payload)
+                yield framers[index](payload)
+                continue
+            if kind == 'route':
+                routes[index] = payload
+                yield sse_event({'type': 'routed', 'provider': provider, 'model': model,
+                                 'routed_provider': payload['provider'], 'routed_model': payload['model'],
+                                 'hedged': payload['hedged']})
+                continue
+            timings.model_done(index)
+            if kind == 'done':
+                responses[index] = dict({'provider': provider, 'model': model, 'response': ''.join(parts[index]),
+                                         'success': True}, **routes[index])
+                if multi:
+                    yield sse_event({'type': 'model_done', 'provider': provider, 'model': model})
+            else:
+                responses[index] = dict(payload, provider=provider, model=model, success=False)
+                if not multi:
+                    yield sse_event(dict(payload, type='error'))
+                    return
+                yield sse_event(dict(payload, type='model_error', provider=provider, model=model))
+    finally:
+        await events.aclose()
+
+    if multi:
+        combined = combine_responses(responses)
+        if combined is None:
+            yield done_event(saved=False)
+            return
+        messages.append({'role': 'assistant', 'content': combined})
+    else:
+        messages.append({'role': 'assistant', 'content': responses[0]['response']})
+    with timings.phase('save'):
+        await run_sync(save_chat_history, chat_id, messages, title, folder_name, base)
+    yield done_event()
+
+
+async def run_stream_job(job):
+    """Async counterpart of app.run_stream_job"""
+    timings = RequestTimings()
+    timings.phases['queue'] = time.time() - job.created_at
+    frames = generate_stream(job.request, timings, job.id)
+    try:
+        async for frame in frames:
+            if job.cancelled.is_set():
+                job.emit(sse_event({'type': 'error', 'error': 'Cancelled', 'code': 'cancelled', 'retryable': False}))
+                return
+            job.emit(frame)
+    except Exception as e:
+        job.emit(sse_event(dict(error_info(e), type='error')))
+        raise
+    finally:
+        await frames.aclose()
+
+
+async def job_stream(request, job_id, last_event_id=None):
+    """Async counterpart of app.job_response"""
+    events = await jobs.asubscribe(job_id, last_event_id)
+    if events is None:
+        return web.json_response({'error': 'Job not found'}, status=404)
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream; charset=utf-8',
+                                           'Cache-Control': 'no-cache', 'X-Job-Id': job_id})
+    await response.prepare(request)
+    try:
+        async for event_id, frame in events:
+            await response.write((frame if event_id is None else f'id: {event_id}\n{frame}').encode('utf-8'))
+    finally:
+        await events.aclose()
+    return response
+
+
+async def resume_job(request):
+    """Async counterpart of app.resume_job"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.query.get('last_event_id')
+    return await job_stream(request, request.match_info['job_id'], last_event_id)
+
+
+class ChangeWatcher:
+    """Follows the change log for every /api/changes subscriber on the loop.
+
+    A single task waits on ChangeLog.wait in the executor, a short while at
+    a time, and wakes the subscribers when the version moves. It stops once
+    nobody is waiting.
+    """
+
+    def __init__(self):
+        self.latest = None
+        self._changed = asyncio.Event()
+        self._task = None
+        self._waiters = 0
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _watch(self):
+        self.latest = await run_sync(changes.version)
+        self._wake()
+        while self._waiters:
+            latest = await run_sync(changes.wait, self.latest, WATCH_SECONDS)
+            if latest != self.latest:
+                self.latest = latest
+                self._wake()
+
+    async def wait(self, version, timeout):
+        """Async counterpart of ChangeLog.wait"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch())
+        self._waiters += 1
+        try:
+            deadline = asyncio.get_running_loop().time() + timeout
+            while self.latest is None or self.latest <= version:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), deadline - asyncio.get_running_loop().time())
+                except asyncio.TimeoutError:
+                    break
+            return version if self.latest is None else self.latest
+        finally:
+            self._waiters -= 1
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+change_watcher = web.AppKey('change_watcher', ChangeWatcher)
+
+
+async def change_feed(request):
+    """Async counterpart of app.change_feed; a subscriber costs a coroutine, not a thread"""
+    since = await run_sync(feed_start, request.headers.get('Last-Event-ID') or request.query.get('since'))
+    if since is None:
+        return web.json_response({'error': 'Invalid version'}, status=400)
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream; charset=utf-8',
+                                           'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+    watcher = request.app[change_watcher]
+    while True:
+        version = await watcher.wait(since, KEEPALIVE_SECONDS)
+        if version == since:
+            await response.write(b': keepalive\n\n')
+            continue
+        for frame in await run_sync(change_frames, since, version):
+            await response.write(frame.encode('utf-8'))
+        since = version
+
+
+async def stream_message(request):
+    """Stream message response using Server-Sent Events.
+
+    As with the Flask route the turn runs as a job, so it is still saved
+    when the client disconnects and can be resumed from
+    /api/jobs/<job_id>/events; its provider streams are read on this loop.
+    """
+    data = await request.json()
+    job = await run_sync(submit_stream, data, request.remote or '')
+    if job is None:
+        return web.json_response({'error': 'No models selected'}, status=400)
+    return await job_stream(request, job.id)
+
+
+def build_environ(request, body):
+    """WSGI environ for an aiohttp request"""
+    path = request.raw_path.split('?', 1)[0]
+    host, _, port = (request.host or 'localhost').partition(':')
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+        'QUERY_STRING': request.query_string,
+        'SERVER_NAME': host,
+        'SERVER_PORT': port or ('443' if request.secure else '80'),
+        'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+        'REMOTE_ADDR': request.remote or '',
+        'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+        'CONTENT_LENGTH': request.headers.get('Content-Length', ''),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def wsgi_bridge(request):
+    """Serve a request with the Flask app, streaming its response body"""
+    body = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    async for chunk in request.content.iter_chunked(64 * 1024):
+        body.write(chunk)
+    body.seek(0)
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = status
+        started['headers'] = headers
+
+    def call_app():
+        result = flask_app(build_environ(request, body), start_response)
+        return result, iter(result)
+
+    result, chunks = await run_sync(call_app)
+    try:
+        status = started['status']
+        response = web.StreamResponse(status=int(status[:3]), reason=status[4:] or None)
+        for name, value in started['headers']:
+            if name.lower() not in ('connection', 'transfer-encoding'):
+                response.headers.add(name, value)
+        await response.prepare(request)
+        while True:
+            chunk = await run_sync(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await response.write(chunk)
+        await response.write_eof()
+        return response
+    finally:
+        if hasattr(result, 'close'):
+            await run_sync(result.close)
+        body.close()
+
+
+async def _start_jobs(web_app):
+    # Streamed turns run as tasks on this loop, so a turn holds no job worker thread
+    jobs.attach(asyncio.get_running_loop(), run_stream_job)
+
+
+async def _stop_jobs(web_app):
+    jobs.detach()
+
+
+async def _stop_watcher(web_app):
+    await web_app[change_watcher].stop()
+
+
+async def _close_sessions(web_app):
+    await close_async_sessions()
+
+
+def create_app():
+    web_app = web.Application(client_max_size=MAX_REQUEST_BYTES)
+    web_app[change_watcher] = ChangeWatcher()
+    web_app.router.add_post('/api/chat/stream', stream_message)
+    # Long-lived feeds stay on the loop rather than holding a bridge thread each
+    web_app.router.add_get('/api/jobs/{job_id}/events', resume_job)
+    web_app.router.add_get('/api/changes', change_feed)
+    web_app.router.add_route('*', '/{tail:.*}', wsgi_bridge)
+    web_app.on_startup.append(_start_jobs)
+    web_app.on_cleanup.append(_stop_jobs)
+    web_app.on_cleanup.append(_stop_watcher)
+    web_app.on_cleanup.append(_close_sessions)
+    return web_app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run QueryQuest on the asyncio server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,185 @@
+import os
+import json
+import codecs
+import hashlib
+import tempfile
+from functools import lru_cache
+
+# Largest single file accepted by /api/upload
+UPLOAD_MAX_BYTES = int(os.environ.get('QUERYQUEST_UPLOAD_MAX_BYTES', str(50 * 1024 * 1024)))
+# Most of an attachment sent to a model with each message; the rest is cut
+ATTACHMENT_TOKENS = int(os.environ.get('QUERYQUEST_ATTACHMENT_TOKENS', '8000'))
+
+READ_BYTES = 64 * 1024
+CHUNK_BYTES = 16 * 1024
+
+
+class AttachmentTooLarge(ValueError):
+    pass
+
+
+class AttachmentStore:
+    """Content-addressed store for uploaded files.
+
+    Uploads are streamed to disk in fixed-size reads while being hashed, so
+    a file is never held in memory whole. The bytes are stored once under
+    their sha256 (``<sha>``) next to a small JSON description (``<sha>.json``)
+    holding the detected encoding and the chunk layout: byte ranges of about
+    CHUNK_BYTES, cut at line ends, that can be read back individually.
+    Encoding is detected incrementally: utf-8 until a read fails to decode,
+    latin-1 from then on, as extract_text_from_file does for whole files.
+    """
+
+    def __init__(self, root='attachments', max_bytes=UPLOAD_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._read_text = lru_cache(maxsize=32)(self._read_text)
+
+    def _path(self, attachment_id):
+        if len(attachment_id) != 64 or not all(c in '0123456789abcdef' for c in attachment_id):
+            raise KeyError(attachment_id)
+        return os.path.join(self.root, attachment_id)
+
+    def ingest(self, stream, name):
+        """Store a file read from ``stream`` and return its handle"""
+        digest = hashlib.sha256()
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        encoding = 'utf-8'
+        size = 0
+        chunks = []
+        pending = b''
+        pending_offset = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    block = stream.read(READ_BYTES)
+                    if not block:
+                        break
+                    size += len(block)
+                    if size > self.max_bytes:
+                        raise AttachmentTooLarge(f'{name} is larger than {self.max_bytes} bytes')
+                    digest.update(block)
+                    out.write(block)
+                    if encoding == 'utf-8':
+                        try:
+                            decoder.decode(block)
+                        except UnicodeDecodeError:
+                            encoding = 'latin-1'
+
+                    pending += block
+                    while len(pending) > CHUNK_BYTES:
+                        cut = self._chunk_end(pending)
+                        chunks.append(self._chunk(len(chunks), pending_offset, pending[:cut]))
+                        pending_offset += cut
+                        pending = pending[cut:]
+            if encoding == 'utf-8':
+                try:
+                    decoder.decode(b'', final=True)
+                except UnicodeDecodeError:
+                    encoding = 'latin-1'
+            if pending:
+                chunks.append(self._chunk(len(chunks), pending_offset, pending))
+
+            attachment_id = digest.hexdigest()
+            path = self._path(attachment_id)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        info = {
+            'id': attachment_id,
+            'size': size,
+            'encoding': encoding,
+            'tokens': sum(chunk['tokens'] for chunk in chunks),
+            'chunks': chunks
+        }
+        with open(path + '.json', 'w') as f:
+            json.dump(info, f)
+        return dict(info, name=name)
+
+    @staticmethod
+    def _chunk_end(data):
+        """Where to cut a chunk: after the last newline, else on a character boundary"""
+        newline = data.rfind(b'\n', 0, CHUNK_BYTES)
+        if newline >= 0:
+            return newline + 1
+        cut = CHUNK_BYTES
+        # Step back over utf-8 continuation bytes
+        while cut > CHUNK_BYTES - 4 and 0x80 <= data[cut] < 0xC0:
+            cut -= 1
+        return cut
+
+    @staticmethod
+    def _chunk(index, offset, data):
+        return {'index': index, 'offset': offset, 'length': len(data),
+                'lines': data.count(b'\n'), 'tokens': (len(data) + 3) // 4}
+
+    def info(self, attachment_id):
+        """Return an attachment's description, or None if it is unknown"""
+        try:
+            with open(self._path(attachment_id) + '.json', 'r') as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def read_chunk(self, attachment_id, index):
+        """Return the text of one chunk"""
+        info = self.info(attachment_id)
+        if info is None:
+            raise KeyError(attachment_id)
+        chunk = info['chunks'][index]
+        with open(self._path(attachment_id), 'rb') as f:
+            f.seek(chunk['offset'])
+            return f.read(chunk['length']).decode(info['encoding'], errors='replace')
+
+    def _read_text(self, attachment_id, max_tokens):
+        info = self.info(attachment_id)
+        if info is None:
+            return f'[Attachment {attachment_id} is no longer available]'
+        parts = []
+        used = 0
+        with open(self._path(attachment_id), 'rb') as f:
+            for chunk in info['chunks']:
+                if parts and used + chunk['tokens'] > max_tokens:
+                    omitted = len(info['chunks']) - len(parts)
+                    parts.append(f'\n[... {omitted} more part(s) of this file omitted]')
+                    break
+                f.seek(chunk['offset'])
+                parts.append(f.read(chunk['length']).decode(info['encoding'], errors='replace'))
+                used += chunk['tokens']
+        return ''.join(parts)
+
+    def read_text(self, attachment_id, max_tokens=ATTACHMENT_TOKENS):
+        """Return an attachment's text, cut to whole chunks within max_tokens"""
+        return self._read_text(attachment_id, max_tokens)
+
+    @staticmethod
+    def reference(info, name, inline=True):
+        """The reference stored on a message for an attachment.
+
+        Attachments that are not inlined are only reached through retrieval.
+        """
+        if not inline:
+            return {'id': info['id'], 'name': name, 'tokens': 0, 'inline': False}
+        return {'id': info['id'], 'name': name, 'tokens': min(info['tokens'], ATTACHMENT_TOKENS)}
+
+    def expand(self, messages):
+        """Inline the attachments referenced by messages into their content"""
+        expanded = []
+        for message in messages:
+            refs = [ref for ref in message.get('attachments', ()) if ref.get('inline', True)]
+            if not refs:
+                expanded.append({'role': message['role'], 'content': message['content']})
+                continue
+            content = message['content'] + ''.join(
+                f"\n\n--- File: {ref['name']} ---\n{self.read_text(ref['id'])}" for ref in refs)
+            expanded.append({'role': message['role'], 'content': content})
+        return expanded
@@ -0,0 +1,321 @@
+"""Run a JSONL file of prompts against one or more models.
+
+Each input line is a JSON object with an optional "id" (default: the line
+number), the prompt as "message" or a "messages" list, an optional
+"system" prompt, and the models to ask as "models" (a list of
+{"provider", "model"}) or "provider" and "model". Lines without models
+use --models.
+
+Every (id, provider, model) answer is appended to the output file as a
+JSON line as soon as it finishes, and each provider has its own worker
+pool of its 'max_concurrency' in credentials.json (default
+QUERYQUEST_PROVIDER_CONCURRENCY). Run it again with the same output file
+to resume: answers already there are skipped and failures are retried.
+A summary of throughput, tokens and cost is printed at the end.
+
+    python batch.py prompts.jsonl -o results.jsonl --models openai/gpt-4o,anthropic/claude-3-5-sonnet-20241022
+
+Prompts are sent as given. POST /api/batch runs a file inside the app
+instead, with the behavior instructions and context handling of a chat.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from context_builder import estimate_tokens
+from jobs import PROVIDER_CONCURRENCY
+from resilience import error_info
+
+# Seconds allowed per answer unless the model selection sets 'timeout'
+BATCH_TIMEOUT = float(os.environ.get('QUERYQUEST_BATCH_TIMEOUT', '300'))
+
+
+def parse_models(spec):
+    """Model selections from 'provider/model,provider/model'"""
+    models = []
+    for part in spec.split(','):
+        provider, _, model = part.strip().partition('/')
+        if provider and model:
+            models.append({'provider': provider, 'model': model})
+    return models
+
+
+def read_items(lines, default_models=()):
+    """Parse batch input lines; raises ValueError naming the first bad line"""
+    items = []
+    seen = set()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f'Line {number}: {e}') from e
+        if not isinstance(data, dict):
+            raise ValueError(f'Line {number}: expected a JSON object')
+        item_id = str(data.get('id', number))
+        if item_id in seen:
+            raise ValueError(f'Line {number}: duplicate id {item_id}')
+        seen.add(item_id)
+        messages = data.get('messages')
+        if messages is None:
+            prompt = data.get('message', data.get('prompt'))
+            if not isinstance(prompt, str) or not prompt:
+                raise ValueError(f'Line {number}: no "message" or "messages"')
+            messages = [{'role': 'user', 'content': prompt}]
+        elif not isinstance(messages, list) or not messages or not all(
+                isinstance(message, dict) and isinstance(message.get('role'), str)
+                and isinstance(message.get('content'), str) for message in messages):
+            raise ValueError(f'Line {number}: "messages" must be a list of objects with string role and content')
+        if data.get('system'):
+            if not isinstance(data['system'], str):
+                raise ValueError(f'Line {number}: "system" must be a string')
+            messages = [{'role': 'system', 'content': data['system']}] + messages
+        models = data.get('models')
+        if not models and data.get('provider') and data.get('model'):
+            models = [{'provider': data['provider'], 'model': data['model']}]
+        models = models or list(default_models)
+        if not models:
+            raise ValueError(f'Line {number}: no models selected')
+        if not isinstance(models, list) or not all(
+                isinstance(selection, dict) and isinstance(selection.get('provider'), str) and selection['provider']
+                and isinstance(selection.get('model'), str) and selection['model'] for selection in models):
+            raise ValueError(f'Line {number}: "models" must be a list of objects with a provider and a model')
+        items.append({'id': item_id, 'messages': messages, 'models': models})
+    return items
+
+
+def completed(output_path):
+    """The (id, provider, model) answers an output file already has"""
+    done = set()
+    try:
+        with open(output_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # Cut short when a previous run was killed
+                    continue
+                if result.get('success'):
+                    done.add((result['id'], result['provider'], result['model']))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def price(prices, provider, model):
+    """(input, output) USD per million tokens for a model, or None when unknown"""
+    entry = (prices.get(provider) or {}).get(model)
+    if not entry:
+        return None
+    return float(entry.get('input', 0)), float(entry.get('output', 0))
+
+
+class BatchRun:
+    """One pass over a batch, writing each answer to ``output_path`` as it finishes.
+
+    ``call(provider, model, messages, timeout)`` returns the response text,
+    ``limit(provider)`` is the number of calls a provider gets at once, and
+    ``prices`` maps provider -> model -> {'input', 'output'} in USD per
+    million tokens. Token counts are estimates (see context_builder).
+    Progress can be read from another thread while run() works.
+    """
+
+    def __init__(self, items, output_path, call, limit=None, prices=None):
+        self.items = items
+        self.output_path = output_path
+        self.call = call
+        self.limit = limit or (lambda provider: PROVIDER_CONCURRENCY)
+        self.prices = prices or {}
+        self.cancelled = threading.Event()
+        self.status = 'pending'
+        self._lock = threading.Lock()
+        self._file = None
+        self.total = sum(len(item['models']) for item in items)
+        self.skipped = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.cost = 0.0
+        self.by_model = {}
+        self.started_at = None
+        self.finished_at = None
+
+    def _open_output(self):
+        partial = False
+        try:
+            with open(self.output_path, 'rb') as f:
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    partial = f.read(1) != b'\n'
+        except FileNotFoundError:
+            pass
+        f = open(self.output_path, 'a', encoding='utf-8')
+        if partial:
+            # A run killed mid-write left half a line; start after it
+            f.write('\n')
+        return f
+
+    def _answer(self, item, selection):
+        provider, model = selection['provider'], selection['model']
+        result = {'id': item['id'], 'provider': provider, 'model': model}
+        started = time.monotonic()
+        try:
+            if self.cancelled.is_set():
+                return
+            tokens_in = sum(estimate_tokens(message.get('content') or '') for message in item['messages'])
+            try:
+                timeout = float(selection.get('timeout') or BATCH_TIMEOUT)
+            except (TypeError, ValueError):
+                timeout = BATCH_TIMEOUT
+            response = self.call(provider, model, item['messages'], timeout)
+            result.update(success=True, response=response, tokens_in=tokens_in,
+                          tokens_out=estimate_tokens(response))
+        except Exception as e:
+            result.update(error_info(e), success=False, tokens_in=0, tokens_out=0)
+        result['latency_s'] = round(time.monotonic() - started, 3)
+        rates = price(self.prices, provider, model)
+        if rates is not None and result['success']:
+            result['cost_usd'] = round((tokens_in * rates[0] + result['tokens_out'] * rates[1]) / 1e6, 6)
+        self._record(result)
+
+    def _record(self, result):
+        with self._lock:
+            self._file.write(json.dumps(result) + '\n')
+            self._file.flush()
+            totals = self.by_model.setdefault(f"{result['provider']}/{result['model']}", {
+                'succeeded': 0, 'failed': 0, 'tokens_in': 0, 'tokens_out': 0, 'cost_usd': 0.0, 'latency_s': 0.0})
+            if result['success']:
+                self.succeeded += 1
+                totals['succeeded'] += 1
+            else:
+                self.failed += 1
+                totals['failed'] += 1
+            self.tokens_in += result['tokens_in']
+            self.tokens_out += result['tokens_out']
+            self.cost += result.get('cost_usd', 0.0)
+            totals['tokens_in'] += result['tokens_in']
+            totals['tokens_out'] += result['tokens_out']
+            totals['cost_usd'] += result.get('cost_usd', 0.0)
+            totals['latency_s'] += result['latency_s']
+
+    def run(self):
+        """Answer everything not in the output file yet; returns report()"""
+        done = completed(self.output_path)
+        pending = {}
+        for item in self.items:
+            for selection in item['models']:
+                if (item['id'], selection['provider'], selection['model']) in done:
+                    self.skipped += 1
+                else:
+                    pending.setdefault(selection['provider'], []).append((item, selection))
+        self.status = 'running'
+        self.started_at = time.time()
+        # A pool per provider: its limit is exact, and a slow provider does
+        # not hold up the others
+        pools = [ThreadPoolExecutor(max_workers=max(int(self.limit(provider)), 1),
+                                    thread_name_prefix=f'batch-{provider}') for provider in pending]
+        self._file = self._open_output()
+        try:
+            futures = [pool.submit(self._answer, item, selection)
+                       for pool, tasks in zip(pools, pending.values()) for item, selection in tasks]
+            wait(futures)
+            self.status = 'cancelled' if self.cancelled.is_set() else 'done'
+        except BaseException:
+            self.cancel()
+            self.status = 'interrupted'
+            raise
+        finally:
+            # Calls in flight finish and are written before the file is closed
+            for pool in pools:
+                pool.shutdown(cancel_futures=True)
+            self._file.close()
+            self.finished_at = time.time()
+        return self.report()
+
+    def cancel(self):
+        """Stop starting new calls; those in flight still finish and are written"""
+        self.cancelled.set()
+
+    def report(self):
+        """Progress so far: counts, throughput, tokens and cost"""
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            answered = self.succeeded + self.failed
+            by_model = {}
+            for name, totals in self.by_model.items():
+                count = totals['succeeded'] + totals['failed']
+                by_model[name] = dict(totals, cost_usd=round(totals['cost_usd'], 6),
+                                      latency_s=round(totals['latency_s'] / count, 3) if count else 0.0)
+            return {
+                'status': self.status,
+                'output': self.output_path,
+                'total': self.total,
+                'skipped': self.skipped,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'remaining': self.total - self.skipped - answered,
+                'elapsed_s': round(elapsed, 3),
+                'answers_per_s': round(answered / elapsed, 2) if elapsed else 0.0,
+                'tokens_in': self.tokens_in,
+                'tokens_out': self.tokens_out,
+                'tokens_per_s': round((self.tokens_in + self.tokens_out) / elapsed, 1) if elapsed else 0.0,
+                'cost_usd': round(self.cost, 6),
+                'by_model': by_model,
+            }
+
+
+def direct_call(credentials):
+    """A BatchRun ``call`` that sends prompts straight to the provider adapters"""
+    from providers import get_provider
+
+    def call(provider, model, messages, timeout):
+        adapter = get_provider(provider)
+        if adapter is None:
+            raise ValueError(f'Unsupported provider {provider}')
+        if provider not in credentials:
+            raise ValueError(f'Provider {provider} not found in credentials')
+        return adapter.complete(messages, model, credentials[provider], timeout=timeout)
+    return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='JSONL file of prompts')
+    parser.add_argument('-o', '--output', help='results file (default: <input>.results.jsonl)')
+    parser.add_argument('--models', default='', help='provider/model list for lines that name none')
+    parser.add_argument('--credentials', default='credentials.json')
+    parser.add_argument('--concurrency', type=int, help='calls per provider at once (default: per credentials.json)')
+    args = parser.parse_args()
+
+    with open(args.credentials, encoding='utf-8') as f:
+        credentials = json.load(f)
+    with open(args.input, encoding='utf-8') as f:
+        try:
+            items = read_items(f, parse_models(args.models))
+        except ValueError as e:
+            parser.error(f'{args.input}: {e}')
+    output = args.output or os.path.splitext(args.input)[0] + '.results.jsonl'
+
+    def limit(provider):
+        return args.concurrency or credentials.get(provider, {}).get('max_concurrency') or PROVIDER_CONCURRENCY
+
+    prices = {provider: config.get('prices') or {} for provider, config in credentials.items()
+              if isinstance(config, dict)}
+    run = BatchRun(items, output, direct_call(credentials), limit, prices)
+    try:
+        report = run.run()
+    except KeyboardInterrupt:
+        report = run.report()
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['status'] == 'done' and not report['failed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
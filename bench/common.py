@@ -0,0 +1,74 @@
+"""Helpers shared by the benchmark scripts"""
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_process(args, cwd, port, timeout=30):
+    """Start a server process and wait until it accepts connections"""
+    process = subprocess.Popen([sys.executable] + args, cwd=cwd,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f'{args[0]} exited with code {process.returncode}')
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{args[0]} did not start on port {port}')
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def server_command(kind, port, threads=16):
+    """Command line for the threaded Flask server or the asyncio server"""
+    if kind == 'sync':
+        return [os.path.join(BENCH_DIR, 'sync_server.py'), '--port', str(port), '--threads', str(threads)]
+    return [os.path.join(REPO_DIR, 'async_server.py'), '--host', '127.0.0.1', '--port', str(port)]
+
+
+def write_credentials(workdir, mock_port, max_concurrency=None):
+    """Point every provider at the mock provider, optionally with a job concurrency limit"""
+    base = f'http://127.0.0.1:{mock_port}'
+    credentials = {
+        'coforge': {'name': 'Mock Coforge', 'api_key': 'bench', 'models': ['mock'],
+                    'base_url': f'{base}/qag/llmrouter-api/v2/chat/completions'},
+        'openai': {'name': 'Mock OpenAI', 'api_key': 'bench', 'models': ['mock'],
+                   'base_url': f'{base}/v1/chat/completions'},
+        'anthropic': {'name': 'Mock Anthropic', 'api_key': 'bench', 'models': ['mock'],
+                      'base_url': f'{base}/v1/messages'},
+    }
+    if max_concurrency:
+        for provider in credentials.values():
+            provider['max_concurrency'] = max_concurrency
+    with open(os.path.join(workdir, 'credentials.json'), 'w') as f:
+        json.dump(credentials, f)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
@@ -0,0 +1,73 @@
+"""Compare two bench/harness.py result files and flag regressions.
+
+Latency and time-to-first-byte figures regress when they grow, throughput
+when it shrinks, by more than --threshold percent. Exits with status 1 if
+anything regressed, so it can gate CI.
+
+    python bench/compare.py bench/results/baseline.json bench/results/candidate.json
+"""
+import sys
+import json
+import argparse
+
+# Metric -> True when higher is better
+METRICS = {
+    'throughput_rps': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+    'ttfb_p50_ms': False,
+    'ttfb_p99_ms': False,
+    'errors': False,
+}
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, candidate, threshold):
+    """Return (rows, regressions) comparing every scenario both runs have"""
+    rows = []
+    regressions = []
+    for scenario in baseline['results']:
+        if scenario not in candidate['results']:
+            continue
+        before = baseline['results'][scenario]
+        after = candidate['results'][scenario]
+        for metric, higher_is_better in METRICS.items():
+            old = before.get(metric)
+            new = after.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else (0.0 if new == old else float('inf'))
+            worse = -change if higher_is_better else change
+            regressed = worse > threshold
+            rows.append((scenario, metric, old, new, change, regressed))
+            if regressed:
+                regressions.append((scenario, metric))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed change in percent')
+    args = parser.parse_args()
+
+    baseline = load(args.baseline)
+    candidate = load(args.candidate)
+    rows, regressions = compare(baseline, candidate, args.threshold)
+
+    print(f"{baseline['meta']['label']} ({baseline['meta'].get('commit')}) -> "
+          f"{candidate['meta']['label']} ({candidate['meta'].get('commit')})")
+    print(f"{'scenario':<8} {'metric':<16} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for scenario, metric, old, new, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f'{scenario:<8} {metric:<16} {old:>12} {new:>12} {change:>+8.1f}%{flag}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
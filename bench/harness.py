@@ -0,0 +1,212 @@
+"""End-to-end benchmark of the QueryQuest HTTP API against the mock provider.
+
+Seeds a fresh working directory with --chats chats of --history messages
+each, starts the mock provider and the app (threaded Flask or the asyncio
+server), then runs each scenario with --concurrency clients until
+--requests requests have completed:
+
+    chat     POST /api/chat on a seeded chat
+    stream   POST /api/chat/stream on a seeded chat
+    chats    GET /api/chats?limit=50
+    upload   POST /api/upload with a --upload-kb file
+
+For every scenario it reports throughput, p50/p99 latency and p50/p99 time
+to first byte (first SSE event for streams), and writes everything to
+bench/results/<label>.json for bench/compare.py.
+
+    python bench/harness.py --server async --concurrency 32 --history 200 --label baseline
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+import aiohttp
+
+from common import (BENCH_DIR, REPO_DIR, free_port, start_process, stop_process, server_command,
+                    write_credentials, percentile)
+
+SCENARIOS = ('chat', 'stream', 'chats', 'upload')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def seed_chats(workdir, chats, history):
+    """Write chats straight into the store; the app picks them up on startup"""
+    sys.path.insert(0, REPO_DIR)
+    from chat_store import ChatStore
+
+    store = ChatStore(os.path.join(workdir, 'chat_history'))
+    filler = 'Some earlier discussion about the benchmark topic. ' * 8
+    chat_ids = []
+    for index in range(chats):
+        chat_id = f'bench-{index:05d}'
+        messages = []
+        for turn in range(history // 2):
+            messages.append({'role': 'user', 'content': f'Question {turn}: {filler}'})
+            messages.append({'role': 'assistant', 'content': f'Answer {turn}: {filler}'})
+        store.save(chat_id, messages, f'Benchmark chat {index}', 'bench')
+        chat_ids.append(chat_id)
+    return chat_ids
+
+
+class Scenario:
+    def __init__(self, name, chat_ids, args):
+        self.name = name
+        self.chat_ids = chat_ids
+        self.args = args
+        self.upload = os.urandom(args.upload_kb * 512).hex().encode('ascii')
+
+    async def request(self, session, base_url, worker, number):
+        """Run one request; returns (ttfb, total, ok)"""
+        model = {'provider': self.args.provider, 'model': 'mock'}
+        # Each worker keeps to its own chats so concurrent turns do not collide
+        chat_id = self.chat_ids[(worker + number * self.args.concurrency) % len(self.chat_ids)]
+        started = time.perf_counter()
+        ttfb = None
+        if self.name == 'chat':
+            call = session.post(f'{base_url}/api/chat',
+                                json={'message': 'benchmark', 'chat_id': chat_id, 'selected_models': [model]})
+        elif self.name == 'stream':
+            call = session.post(f'{base_url}/api/chat/stream',
+                                json={'message': 'benchmark', 'chat_id': chat_id, 'selected_models': [model]})
+        elif self.name == 'chats':
+            call = session.get(f'{base_url}/api/chats', params={'limit': '50'})
+        else:
+            form = aiohttp.FormData()
+            form.add_field('files', self.upload, filename=f'bench-{worker}-{number}.txt',
+                           content_type='text/plain')
+            call = session.post(f'{base_url}/api/upload', data=form)
+
+        ok = False
+        try:
+            async with call as response:
+                if self.name == 'stream':
+                    async for line in response.content:
+                        if ttfb is None and line.startswith(b'data: '):
+                            ttfb = time.perf_counter() - started
+                        if line.startswith(b'data: {"type": "done"'):
+                            ok = True
+                else:
+                    async for _ in response.content.iter_any():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                    ok = response.status == 200
+        except aiohttp.ClientError:
+            pass
+        return ttfb, time.perf_counter() - started, ok
+
+    async def run(self, base_url):
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=600)
+        results = []
+        counter = iter(range(self.args.requests))
+
+        async def worker(index):
+            for number in counter:
+                results.append(await self.request(session, base_url, index, number))
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*[worker(index) for index in range(self.args.concurrency)])
+            wall = time.perf_counter() - started
+
+        ttfb = [r[0] for r in results if r[0] is not None]
+        latency = [r[1] for r in results if r[2]]
+        ms = lambda value: None if value is None else round(value * 1000, 2)  # noqa: E731
+        return {
+            'requests': len(results),
+            'errors': len(results) - len(latency),
+            'wall_s': round(wall, 3),
+            'throughput_rps': round(len(latency) / wall, 2) if wall else None,
+            'latency_p50_ms': ms(percentile(latency, 50)),
+            'latency_p99_ms': ms(percentile(latency, 99)),
+            'ttfb_p50_ms': ms(percentile(ttfb, 50)),
+            'ttfb_p99_ms': ms(percentile(ttfb, 99)),
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--threads', type=int, default=16, help='worker threads for the Flask server')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--chats', type=int, default=100, help='chats to seed')
+    parser.add_argument('--history', type=int, default=50, help='messages per seeded chat')
+    parser.add_argument('--upload-kb', type=int, default=256)
+    parser.add_argument('--provider', choices=('coforge', 'openai', 'anthropic'), default='coforge')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock provider latency before the first token')
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--token-rate', type=float, default=500, help='mock provider tokens per second')
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--break-rate', type=float, default=0.0)
+    parser.add_argument('--label', help='results file name (default: timestamp)')
+    args = parser.parse_args()
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    workdir = tempfile.mkdtemp(prefix='qq-harness-')
+    random.seed(0)
+    chat_ids = seed_chats(workdir, max(args.chats, args.concurrency), args.history)
+
+    mock_port = free_port()
+    mock = start_process([os.path.join(BENCH_DIR, 'mock_provider.py'), '--port', str(mock_port),
+                          '--latency', str(args.latency), '--tokens', str(args.tokens),
+                          '--token-rate', str(args.token_rate), '--fail-rate', str(args.fail_rate),
+                          '--fail-status', str(args.fail_status), '--break-rate', str(args.break_rate),
+                          '--seed', '0'], REPO_DIR, mock_port)
+    results = {}
+    try:
+        write_credentials(workdir, mock_port)
+        port = free_port()
+        server = start_process(server_command(args.server, port, args.threads), workdir, port)
+        try:
+            for name in scenarios:
+                results[name] = asyncio.run(Scenario(name, chat_ids, args).run(f'http://127.0.0.1:{port}'))
+                print(json.dumps(dict(results[name], scenario=name)), flush=True)
+        finally:
+            stop_process(server)
+    finally:
+        stop_process(mock)
+
+    now = datetime.now()
+    report = {
+        'meta': {
+            'label': args.label or now.strftime('%Y%m%d-%H%M%S'),
+            'created_at': now.isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{report['meta']['label']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Local stand-in for the LLM providers, used by the benchmarks.
+
+Speaks the OpenAI chat-completions format on /v1/chat/completions, the same
+format on the Coforge router path, and the Anthropic messages format on
+/v1/messages, streaming or not. It is an aiohttp server so it can hold
+thousands of slow streams itself without becoming the bottleneck.
+
+Failures can be injected: --fail-rate answers that fraction of requests
+with --fail-status (with a Retry-After header for 429), and --break-rate
+cuts that fraction of streams off halfway through.
+
+    python bench/mock_provider.py --port 8900 --latency 0.2 --tokens 100 --token-rate 50
+"""
+import json
+import random
+import asyncio
+import argparse
+
+from aiohttp import web
+
+COFORGE_PATH = '/qag/llmrouter-api/v2/chat/completions'
+
+
+class MockProvider:
+    def __init__(self, latency=0.2, tokens=100, token_delay=0.02, fail_rate=0.0, fail_status=503,
+                 break_rate=0.0, seed=None):
+        self.latency = latency
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.break_rate = break_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        # Body of the latest request, for tests checking what was sent
+        self.last_body = None
+
+    def words(self, model):
+        return [f'{model}-token{i} ' for i in range(self.tokens)]
+
+    def injected_failure(self):
+        """An error response for this request, or None"""
+        self.requests += 1
+        if self.fail_rate and self.random.random() < self.fail_rate:
+            self.failures += 1
+            headers = {'Retry-After': '1'} if self.fail_status == 429 else None
+            return web.json_response({'error': {'message': 'injected failure'}}, status=self.fail_status,
+                                     headers=headers)
+        return None
+
+    def breaks_off(self):
+        return self.break_rate and self.random.random() < self.break_rate
+
+    async def chat_completions(self, request):
+        body = self.last_body = await request.json()
+        failure = self.injected_failure()
+        if failure is not None:
+            return failure
+        words = self.words(body.get('model', 'mock'))
+        await asyncio.sleep(self.latency)
+        if not body.get('stream'):
+            await asyncio.sleep(self.token_delay * len(words))
+            return web.json_response({'choices': [{'message': {'role': 'assistant', 'content': ''.join(words)}}]})
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        cut = len(words) // 2 if self.breaks_off() else None
+        for index, word in enumerate(words):
+            if index == cut:
+                request.transport.close()
+                return response
+            event = {'choices': [{'index': 0, 'delta': {'content': word}}]}
+            await response.write(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+            await asyncio.sleep(self.token_delay)
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def messages(self, request):
+        body = self.last_body = await request.json()
+        failure = self.injected_failure()
+        if failure is not None:
+            return failure
+        words = self.words(body.get('model', 'mock'))
+        await asyncio.sleep(self.latency)
+        if not body.get('stream'):
+            await asyncio.sleep(self.token_delay * len(words))
+            return web.json_response({'content': [{'type': 'text', 'text': ''.join(words)}]})
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        await response.write(b'event: message_start\ndata: {"type": "message_start"}\n\n')
+        cut = len(words) // 2 if self.breaks_off() else None
+        for index, word in enumerate(words):
+            if index == cut:
+                # Anthropic reports failures after the stream started as an error event
+                error = {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'injected failure'}}
+                await response.write(f'event: error\ndata: {json.dumps(error)}\n\n'.encode('utf-8'))
+                await response.write_eof()
+                return response
+            event = {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': word}}
+            await response.write(f'event: content_block_delta\ndata: {json.dumps(event)}\n\n'.encode('utf-8'))
+            await asyncio.sleep(self.token_delay)
+        await response.write(b'event: message_stop\ndata: {"type": "message_stop"}\n\n')
+        await response.write_eof()
+        return response
+
+    async def stats(self, request):
+        return web.json_response({'requests': self.requests, 'failures': self.failures})
+
+    def create_app(self):
+        web_app = web.Application()
+        web_app.router.add_post('/v1/chat/completions', self.chat_completions)
+        web_app.router.add_post(COFORGE_PATH, self.chat_completions)
+        web_app.router.add_post('/v1/messages', self.messages)
+        web_app.router.add_get('/stats', self.stats)
+        return web_app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock LLM provider')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds before the first token')
+    parser.add_argument('--tokens', type=int, default=100, help='tokens per response')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='seconds between tokens')
+    parser.add_argument('--token-rate', type=float, help='tokens per second (overrides --token-delay)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--fail-status', type=int, default=503, help='HTTP status of injected failures')
+    parser.add_argument('--break-rate', type=float, default=0.0, help='fraction of streams cut off halfway')
+    parser.add_argument('--seed', type=int, help='seed for failure injection')
+    args = parser.parse_args()
+    token_delay = 1.0 / args.token_rate if args.token_rate else args.token_delay
+    mock = MockProvider(args.latency, args.tokens, token_delay, args.fail_rate, args.fail_status,
+                        args.break_rate, args.seed)
+    web.run_app(mock.create_app(), host=args.host, port=args.port, print=None)
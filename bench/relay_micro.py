@@ -0,0 +1,131 @@
+"""Microbenchmark of the SSE relay path, in events per second.
+
+parse   one upstream stream line -> text delta: decoding every event with
+        json.loads against Provider.parse_line's fast path
+relay   text delta -> SSE frames sent to the browser: one json.dumps'd frame
+        per delta with the answer built by string concatenation, against
+        content_framer frames coalesced over --window-ms with the answer
+        kept as a list of parts. Deltas arrive on a simulated clock at
+        --token-rate, so the coalescing ratio matches a real stream.
+
+    python bench/relay_micro.py --events 200000 --token-rate 100
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from providers import get_provider  # noqa: E402
+from relay import Coalescer, content_framer  # noqa: E402
+
+WORDS = ['the ', 'model ', 'streams ', 'tokens ', 'one ', 'at ', 'a ', 'time, ', '"quoted" ', 'ünïcode ']
+
+
+def openai_lines(count):
+    return [b'data: ' + json.dumps({
+        'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': 1700000000, 'model': 'mock',
+        'choices': [{'index': 0, 'delta': {'content': WORDS[i % len(WORDS)]}, 'finish_reason': None}],
+    }, separators=(',', ':')).encode('utf-8') for i in range(count)]
+
+
+def anthropic_lines(count):
+    lines = []
+    for i in range(count):
+        if i % 10 == 0:
+            lines.append(b'event: ping')
+            lines.append(b'data: {"type": "ping"}')
+        lines.append(b'event: content_block_delta')
+        lines.append(b'data: ' + json.dumps({
+            'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': WORDS[i % len(WORDS)]},
+        }).encode('utf-8'))
+    return lines
+
+
+def parse_baseline(adapter, lines):
+    out = 0
+    for line in lines:
+        if not line.startswith(b'data: '):
+            continue
+        try:
+            data = json.loads(line[6:])
+        except ValueError:
+            continue
+        if adapter.parse_event(data):
+            out += 1
+    return out
+
+
+def parse_fast(adapter, lines):
+    out = 0
+    for line in lines:
+        if adapter.parse_line(line):
+            out += 1
+    return out
+
+
+def relay_baseline(deltas):
+    full_response = ''
+    frames = 0
+    for content in deltas:
+        full_response += content
+        f'data: {json.dumps({"type": "content", "content": content})}\n\n'
+        frames += 1
+    return frames
+
+
+def relay_coalesced(deltas, interval, window):
+    frame = content_framer({'type': 'content'})
+    coalescer = Coalescer(window)
+    parts = []
+    frames = 0
+    now = 0.0
+    for content in deltas:
+        now += interval
+        if coalescer.due(now):
+            for _, text in coalescer.flush():
+                parts.append(text)
+                frame(text)
+                frames += 1
+        coalescer.add(0, content, now)
+    for _, text in coalescer.flush():
+        parts.append(text)
+        frame(text)
+        frames += 1
+    ''.join(parts)
+    return frames
+
+
+def timed(label, events, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    print(f'{label:<34} {events / elapsed:>12,.0f} events/s   {result:>9,} out')
+    return events / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--token-rate', type=float, default=100, help='simulated deltas per second per stream')
+    parser.add_argument('--window-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    for name, make_lines in (('openai', openai_lines), ('anthropic', anthropic_lines)):
+        adapter = get_provider(name)
+        lines = make_lines(args.events)
+        before = timed(f'parse {name} json.loads', args.events, parse_baseline, adapter, lines)
+        after = timed(f'parse {name} fast path', args.events, parse_fast, adapter, lines)
+        print(f'{"":<34} {after / before:>11.2f}x')
+
+    deltas = [WORDS[i % len(WORDS)] for i in range(args.events)]
+    before = timed('relay frame per delta', args.events, relay_baseline, deltas)
+    after = timed(f'relay coalesced {args.window_ms:g}ms', args.events, relay_coalesced,
+                  deltas, 1.0 / args.token_rate, args.window_ms / 1000.0)
+    print(f'{"":<34} {after / before:>11.2f}x')
+
+
+if __name__ == '__main__':
+    main()
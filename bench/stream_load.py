@@ -0,0 +1,108 @@
+"""Concurrent SSE load test: threaded Flask vs async_server.py.
+
+Starts the mock provider, then each server in turn, opens --streams
+concurrent /api/chat/stream requests against it and reports how long they
+took. With the threaded server every stream holds a request thread while
+it relays its job, so streams beyond --threads wait for one. The asyncio
+server runs each job as a task on its loop and relays it there, so its
+only limit is the provider's job concurrency.
+
+That limit (PROVIDER_CONCURRENCY, 8 by default) caps both servers alike,
+so the mock provider is given --provider-concurrency, which defaults to
+--streams. With --streams 200 --threads 16 --tokens 30 --token-delay 0.02
+on a single-core machine:
+
+    server  wall    TTFB p50  total p50
+    sync    12.7s   6.2s      7.1s
+    async    2.7s   0.6s      2.4s
+
+With --provider-concurrency 8 both take about 22s (TTFB p50 about 11s),
+because 200 streams then run 8 at a time.
+
+    python bench/stream_load.py --streams 500 --threads 16
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+import aiohttp
+
+from common import (BENCH_DIR, REPO_DIR, free_port, start_process, stop_process, server_command,
+                    write_credentials, percentile)
+
+
+async def one_stream(session, url, body):
+    started = time.monotonic()
+    first_byte = None
+    try:
+        async with session.post(url, json=body) as response:
+            async for line in response.content:
+                if first_byte is None and line.startswith(b'data: '):
+                    first_byte = time.monotonic() - started
+                if line.startswith(b'data: {"type": "done"'):
+                    return first_byte, time.monotonic() - started, True
+    except aiohttp.ClientError:
+        pass
+    return first_byte, time.monotonic() - started, False
+
+
+async def run_load(base_url, streams):
+    body = {'message': 'benchmark', 'selected_models': [{'provider': 'coforge', 'model': 'mock'}]}
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=600)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        started = time.monotonic()
+        results = await asyncio.gather(*[one_stream(session, f'{base_url}/api/chat/stream', body)
+                                         for _ in range(streams)])
+        wall = time.monotonic() - started
+
+    ttfb = [r[0] for r in results if r[0] is not None]
+    totals = [r[1] for r in results if r[2]]
+    return {
+        'streams': streams,
+        'completed': len(totals),
+        'wall_s': round(wall, 3),
+        'ttfb_p50_s': percentile(ttfb, 50),
+        'ttfb_p99_s': percentile(ttfb, 99),
+        'total_p50_s': percentile(totals, 50),
+        'total_p99_s': percentile(totals, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16, help='worker threads for the Flask server')
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--provider-concurrency', type=int,
+                        help="jobs allowed on the mock provider at once (default: --streams)")
+    parser.add_argument('--servers', default='sync,async')
+    args = parser.parse_args()
+
+    mock_port = free_port()
+    mock = start_process([os.path.join(BENCH_DIR, 'mock_provider.py'), '--port', str(mock_port),
+                          '--latency', str(args.latency), '--tokens', str(args.tokens),
+                          '--token-delay', str(args.token_delay)], REPO_DIR, mock_port)
+    try:
+        for kind in args.servers.split(','):
+            workdir = tempfile.mkdtemp(prefix=f'qq-bench-{kind}-')
+            write_credentials(workdir, mock_port, args.provider_concurrency or args.streams)
+
+            port = free_port()
+            server = start_process(server_command(kind, port, args.threads), workdir, port)
+            try:
+                result = asyncio.run(run_load(f'http://127.0.0.1:{port}', args.streams))
+            finally:
+                stop_process(server)
+            print(json.dumps(dict(result, server=kind)))
+    finally:
+        stop_process(mock)
+
+
+if __name__ == '__main__':
+    main()
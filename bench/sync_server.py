@@ -0,0 +1,44 @@
+"""Serve the Flask app with a fixed number of worker threads.
+
+Stands in for a threaded WSGI deployment (e.g. gunicorn --threads N) so the
+benchmarks can show what happens when every open stream holds a thread.
+
+    python bench/sync_server.py --port 5001 --threads 16
+"""
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app  # noqa: E402
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server handling connections on a bounded thread pool"""
+
+    def __init__(self, host, port, wsgi_app, threads):
+        super().__init__(host, port, wsgi_app)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Flask app on a bounded thread pool')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+    PooledWSGIServer(args.host, args.port, app, args.threads).serve_forever()
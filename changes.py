@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Changes kept for delta requests; a client further behind reloads the whole list
+CHANGE_RETENTION = int(os.environ.get('QUERYQUEST_CHANGE_RETENTION', '10000'))
+# How often a waiting feed checks for changes made by other worker processes
+POLL_SECONDS = 1.0
+# Feed subscribers get a comment line this often while nothing changes
+KEEPALIVE_SECONDS = 15
+
+
+class ChangeLog:
+    """Versioned log of the changes to the chat and note lists.
+
+    Every change appends a row whose version is one more than the last, so
+    versions only ever grow. List endpoints use the latest version of their
+    kind as an ETag, delta requests get the latest change per item since a
+    version, and the SSE feed follows the log. It lives in SQLite, so the
+    changes made by any worker process reach every client.
+
+    A 'reset' change, or a version older than the CHANGE_RETENTION rows
+    kept, tells the client to reload the whole list instead.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS changes (
+                    version INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    item TEXT,
+                    op TEXT NOT NULL,
+                    data TEXT,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS changes_kind ON changes (kind, version)')
+
+    def _connect(self):
+        """Return this thread's connection to the change database"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Losing the last changes in a power cut only makes clients reload
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def record(self, kind, item, op, data=None):
+        """Append a change ('upsert', 'delete' or 'reset'); returns its version"""
+        with self._connect() as conn:
+            version = conn.execute('INSERT INTO changes (kind, item, op, data, created_at) VALUES (?, ?, ?, ?, ?)',
+                                   (kind, item, op, json.dumps(data), time.time())).lastrowid
+            if version % 1000 == 0:
+                conn.execute('DELETE FROM changes WHERE version <= ?', (version - CHANGE_RETENTION,))
+        with self._cond:
+            self._cond.notify_all()
+        return version
+
+    def reset(self, kind):
+        """Tell clients to reload the whole list of ``kind``"""
+        return self.record(kind, None, 'reset')
+
+    def version(self, kind=None):
+        """The latest version, of one kind or overall; 0 before any change"""
+        if kind is None:
+            row = self._connect().execute('SELECT MAX(version) FROM changes').fetchone()
+        else:
+            row = self._connect().execute('SELECT MAX(version) FROM changes WHERE kind = ?', (kind,)).fetchone()
+        return row[0] or 0
+
+    def since(self, version, kind=None, upto=None):
+        """The latest change per item after ``version`` (up to ``upto``), in version order.
+
+        Returns None when the client has to reload the list instead.
+        """
+        conn = self._connect()
+        oldest, latest = conn.execute('SELECT MIN(version), MAX(version) FROM changes').fetchone()
+        if oldest is not None and (version + 1 < oldest or version > latest):
+            return None
+        sql = 'SELECT * FROM changes WHERE version > ? AND version <= ?'
+        params = [version, latest if upto is None else upto]
+        if kind is not None:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        changes = {}
+        for row in conn.execute(sql + ' ORDER BY version', params):
+            if row['op'] == 'reset':
+                return None
+            key = (row['kind'], row['item'])
+            changes.pop(key, None)
+            changes[key] = {'version': row['version'], 'kind': row['kind'], 'id': row['item'], 'op': row['op'],
+                            'data': json.loads(row['data'])}
+        return list(changes.values())
+
+    def wait(self, version, timeout):
+        """Block until there is a change after ``version`` or ``timeout`` passes; returns the latest version"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                latest = self.version()
+                remaining = deadline - time.monotonic()
+                if latest > version or remaining <= 0:
+                    return latest
+                self._cond.wait(min(POLL_SECONDS, remaining))
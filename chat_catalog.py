@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+
+
+class ChatCatalog:
+    """Persistent index of chat metadata (id, title, folder, timestamps).
+
+    Listing chats is answered from this SQLite index instead of opening every
+    chat in the store. Each row remembers the mtime of the chat's files when
+    it was indexed, so repair() can find chats that changed behind the
+    catalog's back with a directory listing and a stat per file.
+
+    With a ChangeLog, every change to an entry is recorded there too, and
+    a repair that changed anything records a reset.
+    """
+
+    def __init__(self, store, db_path=None, changes=None):
+        self.store = store
+        self.changes = changes
+        self.db_path = db_path or os.path.join(store.history_dir, 'catalog.db')
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS chats (
+                    id TEXT PRIMARY KEY,
+                    title TEXT,
+                    folder_name TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    mtime REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS chats_updated ON chats (updated_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS chats_folder ON chats (folder_name, updated_at)')
+
+    def _connect(self):
+        """Return this thread's connection to the catalog database"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, chat_data, mtime=None):
+        """Insert a catalog entry, or update the fields present in chat_data"""
+        self._upsert(chat_data, mtime)
+        if self.changes is not None:
+            self.changes.record('chat', chat_data['id'], 'upsert', self.get(chat_data['id']))
+
+    def _upsert(self, chat_data, mtime=None):
+        if mtime is None:
+            mtime = self.store.mtime(chat_data['id'])
+        fields = {key: chat_data[key] for key in ('title', 'folder_name', 'created_at', 'updated_at')
+                  if key in chat_data}
+        fields['mtime'] = mtime
+        columns = ', '.join(['id'] + list(fields))
+        placeholders = ', '.join('?' * (len(fields) + 1))
+        updates = ', '.join(f'{key} = excluded.{key}' for key in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f'INSERT INTO chats ({columns}) VALUES ({placeholders}) '
+                f'ON CONFLICT(id) DO UPDATE SET {updates}',
+                (chat_data['id'], *fields.values())
+            )
+
+    def remove(self, chat_id):
+        """Drop a chat from the catalog"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
+        if self.changes is not None:
+            self.changes.record('chat', chat_id, 'delete')
+
+    def get(self, chat_id):
+        """Return the catalog entry for a chat, or None"""
+        row = self._connect().execute(
+            'SELECT id, title, folder_name, created_at, updated_at FROM chats WHERE id = ?', (chat_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _where(self, folder_name):
+        if folder_name is None:
+            return '', ()
+        if folder_name == '':
+            # Ungrouped chats have no folder or a blank one
+            return "WHERE folder_name IS NULL OR TRIM(folder_name) = ''", ()
+        return 'WHERE folder_name = ?', (folder_name,)
+
+    def list(self, limit=None, offset=0, folder_name=None, order='desc'):
+        """List chats sorted by updated_at.
+
+        folder_name=None lists every chat, '' lists chats without a folder.
+        """
+        where, params = self._where(folder_name)
+        direction = 'ASC' if order == 'asc' else 'DESC'
+        sql = f'SELECT id, title, folder_name, updated_at FROM chats {where} ORDER BY updated_at {direction}'
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params = params + (int(limit), int(offset))
+        elif offset:
+            sql += ' LIMIT -1 OFFSET ?'
+            params = params + (int(offset),)
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def count(self, folder_name=None):
+        """Number of chats, optionally within one folder"""
+        where, params = self._where(folder_name)
+        return self._connect().execute(f'SELECT COUNT(*) FROM chats {where}', params).fetchone()[0]
+
+    def repair(self):
+        """Bring the catalog back in line with the history directory.
+
+        Only chats that are missing from the catalog or whose files changed
+        are loaded; rows for chats that no longer exist are dropped.
+        """
+        on_disk = self.store.scan()
+        indexed = {row['id']: row['mtime'] for row in self._connect().execute('SELECT id, mtime FROM chats')}
+        report = {'added': 0, 'updated': 0, 'removed': 0}
+
+        for chat_id, mtime in on_disk.items():
+            if indexed.get(chat_id) == mtime:
+                continue
+            try:
+                chat = self.store.load(chat_id, restore=False)
+            except (OSError, ValueError):
+                continue
+            if chat is None:
+                continue
+            chat['id'] = chat_id
+            self._upsert(chat, mtime)
+            report['updated' if chat_id in indexed else 'added'] += 1
+
+        stale = [chat_id for chat_id in indexed if chat_id not in on_disk]
+        with self._connect() as conn:
+            conn.executemany('DELETE FROM chats WHERE id = ?', [(chat_id,) for chat_id in stale])
+        report['removed'] = len(stale)
+        report['total'] = self.count()
+        if self.changes is not None and (report['added'] or report['updated'] or report['removed']):
+            self.changes.reset('chat')
+        return report
+
+    def rebuild(self):
+        """Discard the catalog and re-index every chat file"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM chats')
+        return self.repair()
@@ -0,0 +1,871 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from locks import FileLock
+from archive import ChatArchive
+
+# A log is folded into the snapshot once it grows past either limit
+COMPACT_RECORDS = int(os.environ.get('QUERYQUEST_COMPACT_RECORDS', '100'))
+COMPACT_BYTES = int(os.environ.get('QUERYQUEST_COMPACT_BYTES', str(1024 * 1024)))
+FSYNC = os.environ.get('QUERYQUEST_FSYNC', '1') != '0'
+# 'files' (ChatStore) or 'sqlite' (SqliteChatStore, for several worker processes on one host)
+STORAGE = os.environ.get('QUERYQUEST_STORAGE', 'files')
+
+
+def _fsync(f):
+    f.flush()
+    if FSYNC:
+        os.fsync(f.fileno())
+
+
+class ChatStore:
+    """Append-only chat storage.
+
+    Each chat is a snapshot, ``<id>.json`` in the same format the app has
+    always written, plus an append log ``<id>.log`` holding one JSON record
+    per line for everything that happened since the snapshot. A turn appends
+    a single line instead of rewriting the whole conversation, and once the
+    log grows past COMPACT_RECORDS / COMPACT_BYTES it is folded into a fresh
+    snapshot. Snapshots are replaced atomically and every append record
+    carries the message index it starts at, so replaying a log over a
+    snapshot that already contains it is harmless.
+
+    Snapshots keep one message per line, and a sidecar ``<id>.idx`` records
+    the byte offset of each, so load_page can read a range of messages
+    without parsing the whole conversation. Snapshots written before the
+    sidecar existed are rewritten in that layout the first time a page of
+    them is read.
+
+    Conversations can branch. Every message has a node id chaining the hash
+    of its content onto its parent's, so identical prefixes get identical
+    ids. The snapshot and log hold only the active branch; messages of
+    inactive branches are kept once each in ``<id>.nodes`` (one
+    ``{id, parent, message}`` line per node), so storage grows with unique
+    content rather than with the number of branches, and loading the active
+    branch never reads them.
+
+    Several processes, or hosts sharing the directory, can use one store.
+    Every read and write of a chat holds a lock file in ``.locks`` as well
+    as the thread lock, cached message counts are checked against the
+    files' size and mtime before use, and save() appends after whatever is
+    stored at the time, so two workers answering in the same chat both
+    keep their turns. Network filesystems need working flock/byte-range
+    locks for this; the SQLite store is the simpler choice on one host.
+
+    Chats idle for a long time can be moved to a compressed ChatArchive in
+    ``archive/`` with archive_idle(). They stay listed by scan() and are
+    moved back the next time they are loaded.
+    """
+
+    SUFFIXES = ('.json', '.log')
+    # Message fields covered by a node id
+    NODE_FIELDS = ('role', 'content', 'attachments')
+
+    def __init__(self, history_dir='chat_history'):
+        self.history_dir = history_dir
+        # Guards _held only; chats are locked one by one so they do not queue behind each other
+        self._lock = threading.Lock()
+        # chat_id -> (message count, log records, file fingerprint) as of the last load/write
+        self._state = {}
+        # chat_id -> [thread lock, FileLock while held, threads holding or waiting]
+        self._held = {}
+        self.lock_dir = os.path.join(history_dir, '.locks')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.archive = ChatArchive(os.path.join(history_dir, 'archive'))
+
+    @contextmanager
+    def _locked(self, chat_id):
+        """Hold a chat against other threads and other processes; reentrant"""
+        with self._lock:
+            held = self._held.get(chat_id)
+            if held is None:
+                held = self._held[chat_id] = [threading.RLock(), None, 0]
+            held[2] += 1
+        try:
+            with held[0]:
+                if held[1] is not None:
+                    # Nested in this thread's own hold
+                    yield
+                    return
+                lock = FileLock(os.path.join(self.lock_dir, f'{chat_id}.lock'))
+                lock.acquire()
+                held[1] = lock
+                try:
+                    yield
+                finally:
+                    held[1] = None
+                    lock.release()
+        finally:
+            with self._lock:
+                held[2] -= 1
+                if not held[2]:
+                    del self._held[chat_id]
+
+    def _fingerprint(self, chat_id):
+        """Identity, size and mtime of the snapshot and log, which change on every write"""
+        stats = []
+        for path in (self._snapshot_path(chat_id), self._log_path(chat_id)):
+            try:
+                stat = os.stat(path)
+                stats.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stats.append(None)
+        return tuple(stats)
+
+    def version(self, chat_id):
+        """A value that changes whenever the chat is written, by any process"""
+        return self._fingerprint(chat_id)
+
+    def _remember(self, chat_id, count, records):
+        self._state[chat_id] = (count, records, self._fingerprint(chat_id))
+
+    def _current(self, chat_id):
+        """(message count, log records) as stored now, or None if the chat does not exist"""
+        state = self._state.get(chat_id)
+        if state is not None and state[2] == self._fingerprint(chat_id):
+            return state[:2]
+        # Another process wrote the chat since we last looked
+        if self._view(chat_id) is None:
+            self._state.pop(chat_id, None)
+            return None
+        return self._state[chat_id][:2]
+
+    def _snapshot_path(self, chat_id):
+        return os.path.join(self.history_dir, f'{chat_id}.json')
+
+    def _log_path(self, chat_id):
+        return os.path.join(self.history_dir, f'{chat_id}.log')
+
+    def _index_path(self, chat_id):
+        return os.path.join(self.history_dir, f'{chat_id}.idx')
+
+    def _nodes_path(self, chat_id):
+        return os.path.join(self.history_dir, f'{chat_id}.nodes')
+
+    def _read_snapshot(self, chat_id):
+        try:
+            with open(self._snapshot_path(chat_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _read_log(self, chat_id):
+        """Return the parsed log records, skipping a torn trailing line"""
+        records = []
+        try:
+            with open(self._log_path(chat_id), 'r') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
+    @staticmethod
+    def _apply(chat, record):
+        if record.get('op') == 'append':
+            at = record.get('at', len(chat['messages']))
+            chat['messages'][at:] = record['messages']
+        for key in ('title', 'folder_name', 'updated_at'):
+            if key in record:
+                chat[key] = record[key]
+
+    def _write_snapshot(self, chat):
+        """Write the snapshot, one message per line, and its offset sidecar"""
+        path = self._snapshot_path(chat['id'])
+        tmp_path = f'{path}.tmp'
+        meta = {key: value for key, value in chat.items() if key != 'messages'}
+        # Message i is bytes offsets[i]:offsets[i + 1], less the ',\n' between messages
+        offsets = []
+        with open(tmp_path, 'wb') as f:
+            f.write((json.dumps(meta)[:-1] + ', "messages": [\n').encode('utf-8'))
+            for index, message in enumerate(chat['messages']):
+                if index:
+                    f.write(b',\n')
+                offsets.append(f.tell())
+                f.write(json.dumps(message).encode('utf-8'))
+            offsets.append(f.tell())
+            f.write(b'\n]}\n')
+            _fsync(f)
+        os.replace(tmp_path, path)
+        stat = os.stat(path)
+        index = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'meta': meta, 'offsets': offsets}
+        index_path = self._index_path(chat['id'])
+        with open(f'{index_path}.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(f'{index_path}.tmp', index_path)
+        return index
+
+    def _read_index(self, chat_id):
+        """Return the snapshot's offset sidecar, rebuilding a missing or stale one.
+
+        Returns None when the chat has no snapshot.
+        """
+        try:
+            stat = os.stat(self._snapshot_path(chat_id))
+        except FileNotFoundError:
+            return None
+        try:
+            with open(self._index_path(chat_id), 'r') as f:
+                index = json.load(f)
+            if index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+                return index
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        chat = self._read_snapshot(chat_id)
+        return self._write_snapshot(chat) if chat is not None else None
+
+    def _read_messages(self, chat_id, offsets, start, end):
+        """Messages start:end of the snapshot, read by seeking to their offsets"""
+        if start >= end:
+            return []
+        with open(self._snapshot_path(chat_id), 'rb') as f:
+            f.seek(offsets[start])
+            block = f.read(offsets[end] - offsets[start])
+        return json.loads(b'[' + block.rstrip(b',\n') + b']')
+
+    def _append_record(self, chat_id, record):
+        path = self._log_path(chat_id)
+        line = json.dumps(record) + '\n'
+        with open(path, 'ab+') as f:
+            # Drop a torn line left by a crash mid-append before writing after it
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.seek(0)
+                    data = f.read()
+                    f.truncate(data.rfind(b'\n') + 1)
+                    f.seek(0, os.SEEK_END)
+            f.write(line.encode('utf-8'))
+            _fsync(f)
+            return f.tell()
+
+    @classmethod
+    def node_ids(cls, messages, parent=None):
+        """Chained content hashes of messages following node ``parent``"""
+        ids = []
+        for message in messages:
+            content = {key: message[key] for key in cls.NODE_FIELDS if key in message}
+            digest = hashlib.sha256((parent or '').encode('ascii'))
+            digest.update(json.dumps(content, sort_keys=True).encode('utf-8'))
+            parent = digest.hexdigest()[:24]
+            ids.append(parent)
+        return ids
+
+    def _read_nodes(self, chat_id):
+        """Map node id -> (parent id, message) for the stored inactive-branch messages"""
+        nodes = {}
+        try:
+            with open(self._nodes_path(chat_id), 'r') as f:
+                for line in f:
+                    try:
+                        node = json.loads(line)
+                    except ValueError:
+                        continue
+                    nodes[node['id']] = (node['parent'], node['message'])
+        except FileNotFoundError:
+            pass
+        return nodes
+
+    def _keep_nodes(self, chat_id, messages, ids, parent, nodes):
+        """Store a detached run of messages as nodes, skipping ones already stored"""
+        lines = []
+        for message, node_id in zip(messages, ids):
+            if node_id not in nodes:
+                nodes[node_id] = (parent, message)
+                lines.append(json.dumps({'id': node_id, 'parent': parent, 'message': message}) + '\n')
+            parent = node_id
+        if lines:
+            with open(self._nodes_path(chat_id), 'a') as f:
+                f.writelines(lines)
+                _fsync(f)
+
+    def _replace_from(self, chat_id, at, messages):
+        """Make the active branch its first ``at`` messages followed by ``messages``"""
+        now = datetime.now().isoformat()
+        log_size = self._append_record(chat_id, {'op': 'append', 'at': at, 'messages': messages,
+                                                 'updated_at': now})
+        _, records = self._current(chat_id)
+        self._remember(chat_id, at + len(messages), records + 1)
+        if records + 1 >= COMPACT_RECORDS or log_size >= COMPACT_BYTES:
+            self.compact(chat_id)
+        return now
+
+    def fork(self, chat_id, at):
+        """Start a new branch after the first ``at`` messages.
+
+        The messages from ``at`` on are kept as an inactive branch and the
+        active branch is cut back to the shared prefix, ready for a new
+        message. Returns the chat with ``appended_from`` set to ``at``, or
+        None if the chat does not exist.
+        """
+        with self._locked(chat_id):
+            chat = self.load(chat_id)
+            if chat is None:
+                return None
+            messages = chat['messages']
+            if not 0 <= at <= len(messages):
+                raise ValueError(f'Cannot fork at message {at} of {len(messages)}')
+            if at < len(messages):
+                ids = self.node_ids(messages)
+                self._keep_nodes(chat_id, messages[at:], ids[at:], ids[at - 1] if at else None,
+                                 self._read_nodes(chat_id))
+                chat['updated_at'] = self._replace_from(chat_id, at, [])
+                del messages[at:]
+            chat['appended_from'] = at
+            return chat
+
+    def switch(self, chat_id, node_id):
+        """Make the branch ending at node ``node_id`` the active one.
+
+        The part of the current branch it does not share is kept as an
+        inactive branch. Returns the chat with ``appended_from`` set to the
+        first message that changed, or None if the chat or node is unknown.
+        """
+        with self._locked(chat_id):
+            chat = self.load(chat_id)
+            if chat is None:
+                return None
+            messages = chat['messages']
+            ids = self.node_ids(messages)
+            positions = {node: index for index, node in enumerate(ids)}
+            if node_id in positions:
+                chat['appended_from'] = len(messages)
+                return chat
+            nodes = self._read_nodes(chat_id)
+            if node_id not in nodes:
+                return None
+            # Walk up from the node until the path meets the active branch
+            suffix = []
+            node = node_id
+            while node is not None and node not in positions:
+                node, message = nodes[node]
+                suffix.append(message)
+            suffix.reverse()
+            at = positions[node] + 1 if node is not None else 0
+            self._keep_nodes(chat_id, messages[at:], ids[at:], node, nodes)
+            chat['updated_at'] = self._replace_from(chat_id, at, suffix)
+            messages[at:] = suffix
+            chat['appended_from'] = at
+            return chat
+
+    def branches(self, chat_id):
+        """Describe the active branch and every inactive one.
+
+        Each entry has the ``id`` of its last node (what switch() takes),
+        ``fork_at`` (the index where it leaves the active branch),
+        ``length`` and a preview of its first unshared message. Returns
+        None if the chat does not exist.
+        """
+        with self._locked(chat_id):
+            chat = self.load(chat_id)
+            if chat is None:
+                return None
+            messages = chat['messages']
+            ids = self.node_ids(messages)
+            positions = {node: index for index, node in enumerate(ids)}
+            branches = [{'id': ids[-1] if ids else None, 'active': True, 'fork_at': None,
+                         'length': len(messages)}]
+            nodes = self._read_nodes(chat_id)
+            parents = {parent for parent, _ in nodes.values()}
+            for node_id in nodes:
+                if node_id in parents or node_id in positions:
+                    continue
+                depth = 0
+                node = node_id
+                while node is not None and node not in positions:
+                    first = nodes[node][1]
+                    node = nodes[node][0]
+                    depth += 1
+                fork_at = positions[node] + 1 if node is not None else 0
+                branches.append({'id': node_id, 'active': False, 'fork_at': fork_at,
+                                 'length': fork_at + depth, 'preview': (first.get('content') or '')[:100]})
+            return branches
+
+    def _on_disk(self, chat_id):
+        return os.path.exists(self._snapshot_path(chat_id)) or os.path.exists(self._log_path(chat_id))
+
+    def exists(self, chat_id):
+        return self._on_disk(chat_id) or self.archive.has(chat_id)
+
+    def _restore(self, chat_id):
+        """Move an archived chat back into the history directory"""
+        if self._on_disk(chat_id):
+            return
+        archived = self.archive.get(chat_id)
+        if archived is None:
+            return
+        chat, nodes = archived
+        self._write_snapshot(chat)
+        if nodes:
+            with open(self._nodes_path(chat_id), 'w') as f:
+                f.writelines(json.dumps(node) + '\n' for node in nodes)
+                _fsync(f)
+        self.archive.remove(chat_id)
+
+    def load(self, chat_id, restore=True):
+        """Return the chat as a dict (id, title, folder_name, created_at, updated_at, messages).
+
+        An archived chat is moved back to the history directory, or with
+        ``restore`` off only read from the archive.
+        """
+        with self._locked(chat_id):
+            if not restore and not self._on_disk(chat_id):
+                archived = self.archive.get(chat_id)
+                return archived[0] if archived else None
+            self._restore(chat_id)
+            chat = self._read_snapshot(chat_id)
+            records = self._read_log(chat_id)
+            if chat is None:
+                if not records:
+                    return None
+                chat = {'id': chat_id, 'title': 'New Chat', 'folder_name': None,
+                        'created_at': records[0].get('updated_at'), 'messages': []}
+            for record in records:
+                self._apply(chat, record)
+            self._remember(chat_id, len(chat['messages']), len(records))
+            return chat
+
+    def _view(self, chat_id):
+        """Replay the log over the snapshot's index without reading its messages.
+
+        Returns (meta, index, base, tail), where the chat is the first
+        ``base`` snapshot messages followed by ``tail``, or None if the chat
+        does not exist.
+        """
+        self._restore(chat_id)
+        index = self._read_index(chat_id)
+        if index is None:
+            chat = self.load(chat_id)
+            if chat is None:
+                return None
+            return chat, None, 0, chat.pop('messages')
+        records = self._read_log(chat_id)
+        chat = dict(index['meta'])
+        base = len(index['offsets']) - 1
+        tail = []
+        for record in records:
+            if record.get('op') == 'append':
+                at = record.get('at', base + len(tail))
+                if at >= base:
+                    tail[at - base:] = record['messages']
+                else:
+                    base, tail = at, list(record['messages'])
+            for key in ('title', 'folder_name', 'updated_at'):
+                if key in record:
+                    chat[key] = record[key]
+        self._remember(chat_id, base + len(tail), len(records))
+        return chat, index, base, tail
+
+    def load_page(self, chat_id, limit, before=None):
+        """Return the chat with only the ``limit`` messages preceding index ``before``.
+
+        ``before`` defaults to the end of the chat, so the first page is the
+        latest messages. The result carries ``offset`` (index of its first
+        message), ``total`` and ``next_cursor``, the ``before`` value for
+        the next older page or None once the start is reached.
+        """
+        with self._locked(chat_id):
+            view = self._view(chat_id)
+            if view is None:
+                return None
+            chat, index, base, tail = view
+            total = base + len(tail)
+            end = total if before is None else max(min(before, total), 0)
+            start = max(end - limit, 0)
+            messages = []
+            if start < base:
+                messages = self._read_messages(chat_id, index['offsets'], start, min(end, base))
+            messages += tail[max(start - base, 0):max(end - base, 0)]
+            chat.update(messages=messages, offset=start, total=total, next_cursor=start or None)
+            return chat
+
+    def save(self, chat_id, messages, title, folder_name, base=None):
+        """Persist a chat whose full message list is ``messages``.
+
+        ``base`` is how many of ``messages`` were stored when the caller
+        loaded the chat. The rest are appended after whatever is stored now,
+        so turns another worker saved in the meantime are kept. Without it,
+        only the messages past what is stored are written. Title and folder
+        are only written for a new chat; update() changes them. Returns the
+        chat's metadata, with ``appended_from`` set to the index of the first
+        message written and ``merged`` set if the stored chat had changed
+        since ``base``.
+        """
+        now = datetime.now().isoformat()
+        with self._locked(chat_id):
+            current = self._current(chat_id)
+            if current is None:
+                chat = {
+                    'id': chat_id,
+                    'title': title,
+                    'folder_name': folder_name,
+                    'created_at': now,
+                    'updated_at': now,
+                    'messages': messages
+                }
+                self._write_snapshot(chat)
+                self._remember(chat_id, len(messages), 0)
+                meta = {key: value for key, value in chat.items() if key != 'messages'}
+                meta.update(appended_from=0, merged=False, created=True, version=self._state[chat_id][2])
+                return meta
+
+            count, records = current
+            if base is None:
+                base = at = min(count, len(messages))
+            else:
+                at = count
+            record = {'op': 'append', 'at': at, 'messages': messages[base:], 'updated_at': now}
+            log_size = self._append_record(chat_id, record)
+            self._remember(chat_id, at + len(messages) - base, records + 1)
+            if records + 1 >= COMPACT_RECORDS or log_size >= COMPACT_BYTES:
+                self.compact(chat_id)
+            return {'id': chat_id, 'updated_at': now, 'appended_from': at, 'merged': at != base,
+                    'version': self._state[chat_id][2]}
+
+    def update(self, chat_id, **fields):
+        """Change chat metadata such as title or folder_name.
+
+        Returns the changed metadata, or None if the chat does not exist.
+        """
+        with self._locked(chat_id):
+            current = self._current(chat_id)
+            if current is None:
+                return None
+            fields['updated_at'] = datetime.now().isoformat()
+            self._append_record(chat_id, dict(fields, op='meta'))
+            self._remember(chat_id, current[0], current[1] + 1)
+            return dict(fields, id=chat_id)
+
+    def compact(self, chat_id):
+        """Fold the append log into a new snapshot"""
+        with self._locked(chat_id):
+            chat = self.load(chat_id)
+            if chat is None:
+                return
+            self._write_snapshot(chat)
+            try:
+                os.remove(self._log_path(chat_id))
+            except FileNotFoundError:
+                pass
+            self._remember(chat_id, len(chat['messages']), 0)
+
+    def delete(self, chat_id):
+        """Remove a chat; returns False if it did not exist"""
+        with self._locked(chat_id):
+            self._state.pop(chat_id, None)
+            found = False
+            for path in (self._snapshot_path(chat_id), self._log_path(chat_id)):
+                try:
+                    os.remove(path)
+                    found = True
+                except FileNotFoundError:
+                    pass
+            for path in (self._index_path(chat_id), self._nodes_path(chat_id)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return self.archive.remove(chat_id) or found
+
+    def mtime(self, chat_id):
+        """Latest modification time across a chat's files, or None"""
+        mtimes = []
+        for path in (self._snapshot_path(chat_id), self._log_path(chat_id)):
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                continue
+        return max(mtimes) if mtimes else self.archive.mtime(chat_id)
+
+    def scan(self):
+        """Map every stored chat id, archived ones included, to its latest modification time"""
+        found = self.archive.scan()
+        found.update(self._scan_files())
+        return found
+
+    def _scan_files(self):
+        found = {}
+        if os.path.exists(self.history_dir):
+            for entry in os.scandir(self.history_dir):
+                chat_id, ext = os.path.splitext(entry.name)
+                if ext not in self.SUFFIXES:
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                found[chat_id] = max(found.get(chat_id, mtime), mtime)
+        return found
+
+    def archive_idle(self, days):
+        """Move chats untouched for ``days`` days into the archive.
+
+        Returns how many chats moved, the bytes their files took and the
+        bytes they take in the archive.
+        """
+        cutoff = time.time() - days * 86400
+        report = {'chats': 0, 'bytes_before': 0, 'bytes_after': 0}
+        for chat_id, mtime in self._scan_files().items():
+            if mtime >= cutoff:
+                continue
+            with self._locked(chat_id):
+                # Someone may have written it since the scan
+                mtime = self.mtime(chat_id)
+                chat = self.load(chat_id) if self._on_disk(chat_id) and mtime < cutoff else None
+                if chat is None:
+                    continue
+                nodes = [{'id': node_id, 'parent': parent, 'message': message}
+                         for node_id, (parent, message) in self._read_nodes(chat_id).items()]
+                paths = [self._snapshot_path(chat_id), self._log_path(chat_id), self._index_path(chat_id),
+                         self._nodes_path(chat_id)]
+                size = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+                report['bytes_after'] += self.archive.put(chat_id, chat, nodes, mtime, size)
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self._state.pop(chat_id, None)
+            report['chats'] += 1
+            report['bytes_before'] += size
+        report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+        report['bytes_vacuumed'] = self.archive.vacuum()
+        return report
+
+
+class SqliteChatStore:
+    """Chat storage in one SQLite database, shared by worker processes on one host.
+
+    Messages are rows keyed by (chat, position), so a turn inserts only its
+    new rows and a page is a range query. Writes run in BEGIN IMMEDIATE
+    transactions, which serialize writers across processes, while WAL lets
+    readers carry on. WAL relies on shared memory, so the database has to be
+    on a local disk rather than a network share. Same interface as
+    ChatStore, including branches.
+    """
+
+    NODE_FIELDS = ChatStore.NODE_FIELDS
+
+    def __init__(self, history_dir='chat_history', db_path=None):
+        self.history_dir = history_dir
+        os.makedirs(history_dir, exist_ok=True)
+        self.db_path = db_path or os.path.join(history_dir, 'chats.db')
+        self._local = threading.local()
+        with self._locked() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS chats (
+                    id TEXT PRIMARY KEY,
+                    title TEXT,
+                    folder_name TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    mtime REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    chat_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, position)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS nodes (
+                    chat_id TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    parent TEXT,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, id)
+                ) WITHOUT ROWID
+            ''')
+
+    def _connect(self):
+        """Return this thread's connection; transactions are managed explicitly"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def _locked(self, chat_id=None):
+        """Run the block in one write transaction; reentrant within a thread"""
+        conn = self._connect()
+        depth = self._local.depth
+        if not depth:
+            conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = depth
+            if not depth:
+                conn.execute('ROLLBACK')
+            raise
+        self._local.depth = depth
+        if not depth:
+            conn.execute('COMMIT')
+
+    @contextmanager
+    def _reading(self):
+        """A consistent view across several queries"""
+        conn = self._connect()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    def _meta(self, conn, chat_id):
+        row = conn.execute('SELECT id, title, folder_name, created_at, updated_at FROM chats WHERE id = ?',
+                           (chat_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _insert_messages(self, conn, chat_id, at, messages):
+        conn.execute('DELETE FROM messages WHERE chat_id = ? AND position >= ?', (chat_id, at))
+        conn.executemany('INSERT INTO messages (chat_id, position, data) VALUES (?, ?, ?)',
+                         [(chat_id, at + offset, json.dumps(message)) for offset, message in enumerate(messages)])
+
+    def exists(self, chat_id):
+        return self._connect().execute('SELECT 1 FROM chats WHERE id = ?', (chat_id,)).fetchone() is not None
+
+    def load(self, chat_id, restore=True):
+        """Return the chat as a dict (id, title, folder_name, created_at, updated_at, messages).
+
+        ``restore`` is accepted for ChatStore compatibility; nothing is archived here.
+        """
+        with self._reading() as conn:
+            chat = self._meta(conn, chat_id)
+            if chat is None:
+                return None
+            rows = conn.execute('SELECT data FROM messages WHERE chat_id = ? ORDER BY position', (chat_id,))
+            chat['messages'] = [json.loads(row['data']) for row in rows]
+            return chat
+
+    def load_page(self, chat_id, limit, before=None):
+        """Return the chat with only the ``limit`` messages preceding index ``before`` (see ChatStore)"""
+        with self._reading() as conn:
+            chat = self._meta(conn, chat_id)
+            if chat is None:
+                return None
+            total = conn.execute('SELECT COUNT(*) FROM messages WHERE chat_id = ?', (chat_id,)).fetchone()[0]
+            end = total if before is None else max(min(before, total), 0)
+            start = max(end - limit, 0)
+            rows = conn.execute('SELECT data FROM messages WHERE chat_id = ? AND position >= ? AND position < ? '
+                                'ORDER BY position', (chat_id, start, end))
+            chat.update(messages=[json.loads(row['data']) for row in rows], offset=start, total=total,
+                        next_cursor=start or None)
+            return chat
+
+    def save(self, chat_id, messages, title, folder_name, base=None):
+        """Persist a chat whose full message list is ``messages`` (see ChatStore.save)"""
+        now = datetime.now().isoformat()
+        mtime = time.time()
+        with self._locked(chat_id) as conn:
+            if not self.exists(chat_id):
+                conn.execute('INSERT INTO chats (id, title, folder_name, created_at, updated_at, mtime) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', (chat_id, title, folder_name, now, now, mtime))
+                self._insert_messages(conn, chat_id, 0, messages)
+                return {'id': chat_id, 'title': title, 'folder_name': folder_name, 'created_at': now,
+                        'updated_at': now, 'appended_from': 0, 'merged': False, 'created': True,
+                        'version': mtime}
+
+            count = conn.execute('SELECT COUNT(*) FROM messages WHERE chat_id = ?', (chat_id,)).fetchone()[0]
+            if base is None:
+                base = at = min(count, len(messages))
+            else:
+                at = count
+            self._insert_messages(conn, chat_id, at, messages[base:])
+            conn.execute('UPDATE chats SET updated_at = ?, mtime = ? WHERE id = ?', (now, mtime, chat_id))
+            return {'id': chat_id, 'updated_at': now, 'appended_from': at, 'merged': at != base,
+                    'version': mtime}
+
+    def update(self, chat_id, **fields):
+        """Change chat metadata such as title or folder_name.
+
+        Returns the changed metadata, or None if the chat does not exist.
+        """
+        fields = {key: value for key, value in fields.items() if key in ('title', 'folder_name')}
+        fields['updated_at'] = datetime.now().isoformat()
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self._locked(chat_id) as conn:
+            cursor = conn.execute(f'UPDATE chats SET {assignments}, mtime = ? WHERE id = ?',
+                                  (*fields.values(), time.time(), chat_id))
+            if not cursor.rowcount:
+                return None
+        return dict(fields, id=chat_id)
+
+    def compact(self, chat_id):
+        """Nothing to fold: every write is already in place"""
+
+    def delete(self, chat_id):
+        """Remove a chat; returns False if it did not exist"""
+        with self._locked(chat_id) as conn:
+            found = conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,)).rowcount > 0
+            conn.execute('DELETE FROM messages WHERE chat_id = ?', (chat_id,))
+            conn.execute('DELETE FROM nodes WHERE chat_id = ?', (chat_id,))
+            return found
+
+    def mtime(self, chat_id):
+        """Time of the chat's last write, or None"""
+        row = self._connect().execute('SELECT mtime FROM chats WHERE id = ?', (chat_id,)).fetchone()
+        return row['mtime'] if row else None
+
+    def version(self, chat_id):
+        """A value that changes whenever the chat is written, by any process"""
+        return self.mtime(chat_id)
+
+    def scan(self):
+        """Map every stored chat id to the time of its last write"""
+        return {row['id']: row['mtime'] for row in self._connect().execute('SELECT id, mtime FROM chats')}
+
+    # Branching works as in ChatStore, over these storage primitives
+    node_ids = ChatStore.node_ids
+    fork = ChatStore.fork
+    switch = ChatStore.switch
+    branches = ChatStore.branches
+
+    def _read_nodes(self, chat_id):
+        rows = self._connect().execute('SELECT id, parent, data FROM nodes WHERE chat_id = ?', (chat_id,))
+        return {row['id']: (row['parent'], json.loads(row['data'])) for row in rows}
+
+    def _keep_nodes(self, chat_id, messages, ids, parent, nodes):
+        rows = []
+        for message, node_id in zip(messages, ids):
+            if node_id not in nodes:
+                nodes[node_id] = (parent, message)
+                rows.append((chat_id, node_id, parent, json.dumps(message)))
+            parent = node_id
+        self._connect().executemany('INSERT OR IGNORE INTO nodes (chat_id, id, parent, data) VALUES (?, ?, ?, ?)',
+                                    rows)
+
+    def _replace_from(self, chat_id, at, messages):
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        self._insert_messages(conn, chat_id, at, messages)
+        conn.execute('UPDATE chats SET updated_at = ?, mtime = ? WHERE id = ?', (now, time.time(), chat_id))
+        return now
+
+
+def open_store(history_dir='chat_history'):
+    """The chat store selected by QUERYQUEST_STORAGE"""
+    if STORAGE == 'sqlite':
+        return SqliteChatStore(history_dir)
+    return ChatStore(history_dir)
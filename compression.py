@@ -0,0 +1,103 @@
+import os
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses at least this large are compressed for clients that accept it; 0 turns it off
+COMPRESS_MIN_BYTES = int(os.environ.get('QUERYQUEST_COMPRESS_MIN_BYTES', '1024'))
+# Levels for responses compressed per request; static files are compressed once at the highest
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/x-ndjson', 'image/svg+xml',
+                      'text/css', 'text/html', 'text/javascript', 'text/plain'}
+# Static URLs carrying the file's current version are cached this long
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def encodings():
+    """Content codings this process can produce, preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """The best coding the client accepts (werkzeug's request.accept_encodings), or None"""
+    best = None
+    for encoding in encodings():
+        quality = accept_encodings[encoding]
+        if quality > 0 and (best is None or quality > best[1]):
+            best = encoding, quality
+    return best[0] if best else None
+
+
+def compress(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+def compressible(response):
+    """Whether a response's type is worth compressing; streams such as SSE never are"""
+    return response.mimetype in COMPRESSIBLE_TYPES and 'Content-Encoding' not in response.headers
+
+
+def variant_etag(etag, encoding):
+    """The strong ETag of one encoding of a representation"""
+    return f'{etag}-{encoding}' if encoding else etag
+
+
+def etag_matches(if_none_match, etag):
+    """Whether If-None-Match names ``etag`` in any encoding"""
+    return any(if_none_match.contains(variant_etag(etag, encoding)) for encoding in (None,) + encodings())
+
+
+class StaticVersions:
+    """Content hashes of static files, for URLs that can be cached forever.
+
+    A file's version is the start of its SHA-256, recomputed only when its
+    (mtime, size) signature changes. Compressed copies are kept per version,
+    so each static file is compressed once at the highest level.
+    """
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self._versions = {}
+        self._compressed = {}
+        self._lock = threading.Lock()
+
+    def version(self, filename):
+        """The file's version, or None when it does not exist"""
+        path = os.path.join(self.static_dir, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._versions.get(filename)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        version = digest.hexdigest()[:12]
+        with self._lock:
+            self._versions[filename] = (signature, version)
+        return version
+
+    def compressed(self, filename, etag, encoding, data):
+        """``data`` compressed with ``encoding``, cached under the file's ETag"""
+        key = (filename, encoding)
+        with self._lock:
+            cached = self._compressed.get(key)
+        if cached is not None and cached[0] == etag:
+            return cached[1]
+        body = compress(data, encoding, best=True)
+        with self._lock:
+            self._compressed[key] = (etag, body)
+        return body
@@ -0,0 +1,71 @@
+import os
+import time
+import threading
+
+# How long a cached file is trusted before its stat signature is checked again
+CHECK_INTERVAL = float(os.environ.get('QUERYQUEST_CONFIG_CHECK_INTERVAL', '1.0'))
+
+
+class CachedFile:
+    """Memoize the parsed contents of a small config file.
+
+    The file is re-read only when its (mtime, inode, size) signature changes,
+    and the signature itself is checked at most once per ``check_interval``
+    seconds. Writers inside the app call invalidate() so their change is
+    visible on the very next get().
+    """
+
+    def __init__(self, path, loader, default=None, check_interval=CHECK_INTERVAL):
+        self.path = path
+        self.loader = loader
+        self.default = default
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._signature = None
+        self._value = None
+        self._loaded = False
+        self._checked_at = 0.0
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def get(self):
+        """Return the file contents, loading them only if the file changed"""
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded and now - self._checked_at < self.check_interval:
+                self.hits += 1
+                return self._value
+
+            signature = self._stat_signature()
+            self._checked_at = now
+            if self._loaded and signature == self._signature:
+                self.hits += 1
+                return self._value
+
+            self.misses += 1
+            if signature is None:
+                value = self.default
+            else:
+                try:
+                    value = self.loader(self.path)
+                except FileNotFoundError:
+                    value = self.default
+            self._value = value
+            self._signature = signature
+            self._loaded = True
+            return value
+
+    def invalidate(self):
+        """Force the next get() to re-read the file"""
+        with self._lock:
+            self._loaded = False
+
+    def stats(self):
+        return {'path': self.path, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,127 @@
+import os
+
+# Token budget for conversation history sent with each request
+CONTEXT_TOKENS = int(os.environ.get('QUERYQUEST_CONTEXT_TOKENS', '6000'))
+# Summarize turns that fall outside the budget instead of dropping them silently
+CONTEXT_SUMMARY = os.environ.get('QUERYQUEST_CONTEXT_SUMMARY', '1') != '0'
+SUMMARY_TURNS = 20
+SUMMARY_LINE_CHARS = 160
+
+MESSAGE_OVERHEAD = 4
+# Message fields, besides role and content, that are expanded after selection
+REFERENCE_FIELDS = ('attachments', 'context')
+MULTI_SEPARATOR = '\n\n---\n\n'
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)"""
+    return (len(text) + 3) // 4 + MESSAGE_OVERHEAD
+
+
+def message_tokens(message):
+    """Token estimate for a stored message.
+
+    Attachment references carry the size of the text they expand to. The
+    estimate only needs the content's length, so it is worked out on every
+    call rather than stored with the message, where it could go stale.
+    """
+    tokens = estimate_tokens(message.get('content') or '')
+    return tokens + sum(ref.get('tokens', 0) for ref in message.get('attachments', ()))
+
+
+def context_budget(provider_config, model):
+    """History budget for a model: credentials.json 'context_tokens' (an int,
+    or a dict keyed by model name) overrides QUERYQUEST_CONTEXT_TOKENS"""
+    budget = provider_config.get('context_tokens')
+    if isinstance(budget, dict):
+        budget = budget.get(model, budget.get('default'))
+    return int(budget) if budget else CONTEXT_TOKENS
+
+
+def _model_section(content, provider, model):
+    """Pick this model's part of a combined multi-model answer.
+
+    Falls back to the first successful part when the model did not take part
+    in that turn. Returns None for ordinary single-model answers.
+    """
+    if MULTI_SEPARATOR not in content:
+        return None
+    header = f'**{provider} - {model}:**\n'
+    fallback = None
+    for part in content.split(MULTI_SEPARATOR):
+        if not part.startswith('**') or ':**\n' not in part:
+            return None
+        if part.startswith(header):
+            return part[len(header):]
+        body = part.split(':**\n', 1)[1]
+        if fallback is None and not body.startswith('Error:'):
+            fallback = body
+    return fallback
+
+
+def _summarize(messages, end):
+    """Summarize the user turns among the last few messages before ``end``"""
+    lines = []
+    for message in messages[max(end - SUMMARY_TURNS * 2, 0):end]:
+        if message['role'] != 'user':
+            continue
+        text = ' '.join(message['content'][:SUMMARY_LINE_CHARS * 2].split())
+        if len(text) > SUMMARY_LINE_CHARS:
+            text = text[:SUMMARY_LINE_CHARS] + '...'
+        lines.append(f'- {text}')
+    if not lines:
+        return None
+    return (f'Earlier in this conversation ({end} older messages omitted), the user asked about:\n'
+            + '\n'.join(lines))
+
+
+def build_context(messages, provider, model, budget=CONTEXT_TOKENS):
+    """Select the history to send to one model.
+
+    Walks back from the newest message, keeping whole messages until the
+    token budget is spent; the newest message is always kept. System
+    messages at the start (a batch item's system prompt) are always kept
+    and count against the budget. Combined multi-model answers are cut down
+    to the part written by this model. When older messages fall out of the
+    window a short extractive summary of them can be added as a system
+    message. Returns plain role/content dicts, keeping attachment references
+    and retrieved passages for the caller to expand.
+    """
+    pinned = 0
+    while pinned < len(messages) - 1 and messages[pinned]['role'] == 'system':
+        pinned += 1
+    selected = []
+    used = sum(message_tokens(message) for message in messages[:pinned])
+    start = len(messages)
+    for index in range(len(messages) - 1, pinned - 1, -1):
+        message = messages[index]
+        content = message['content']
+        tokens = message_tokens(message)
+        # Passages retrieved for this turn are sent with it but not stored
+        tokens += sum(estimate_tokens(passage['text']) for passage in message.get('context', ()))
+        if message['role'] == 'assistant':
+            section = _model_section(content, provider, model)
+            if section is not None:
+                content = section
+                tokens = estimate_tokens(content)
+        if selected and used + tokens > budget:
+            break
+        entry = {'role': message['role'], 'content': content}
+        for field in REFERENCE_FIELDS:
+            if message.get(field):
+                entry[field] = message[field]
+        selected.append(entry)
+        used += tokens
+        start = index
+
+    # Providers expect the history to open with a user turn
+    while len(selected) > 1 and selected[-1]['role'] != 'user':
+        selected.pop()
+        start += 1
+    selected.reverse()
+
+    if start > pinned and CONTEXT_SUMMARY:
+        summary = _summarize(messages[pinned:], start - pinned)
+        if summary:
+            selected.insert(0, {'role': 'system', 'content': summary})
+    return [{'role': 'system', 'content': message['content']} for message in messages[:pinned]] + selected
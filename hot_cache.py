@@ -0,0 +1,361 @@
+import os
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import datetime
+from metrics import CHAT_CACHE, CHAT_FLUSHES
+
+# Memory allowed for cached chats, counted in message bytes; 0 turns the cache off
+CHAT_CACHE_MB = float(os.environ.get('QUERYQUEST_CHAT_CACHE_MB', '64'))
+# By default (0) every save is written through to the store before it
+# returns, so an acknowledged turn survives a crash. Setting a delay turns on
+# write-behind: saves only change memory and reach the store this long after
+# a chat first changes. That saves a write per turn on busy chats, but a
+# crash or kill loses every turn saved within the window even though the
+# client was told it was saved.
+FLUSH_MS = float(os.environ.get('QUERYQUEST_CHAT_FLUSH_MS', '0'))
+# Rough per-message cost on top of its text
+MESSAGE_OVERHEAD = 200
+
+
+def message_bytes(messages):
+    return sum(MESSAGE_OVERHEAD + len(message.get('content') or '') for message in messages)
+
+
+class _Entry:
+    __slots__ = ('chat', 'stored', 'version', 'dirty', 'size')
+
+    def __init__(self, chat, stored, version, dirty=False):
+        self.chat = chat
+        # How many of the messages are in the store
+        self.stored = stored
+        self.version = version
+        self.dirty = dirty
+        self.size = 0
+
+
+class HotChatCache:
+    """In-memory LRU of recently active chats in front of a chat store.
+
+    Loading a cached chat costs a version check (a stat or two for
+    ChatStore) instead of reading and parsing it, and entries are evicted
+    least recently used first once their messages pass ``max_bytes``.
+
+    With ``flush_delay`` set (off by default, see FLUSH_MS), saves only
+    change memory. Dirty chats are written back by a background thread once
+    they have been dirty that long, and also on eviction and at exit. Each
+    write-back passes the stored message count as ``base``, so turns another
+    process saved meanwhile are kept; ``on_merged(chat_id, start)`` is then
+    called so indexes can be brought up to date from message ``start``.
+    Other operations (update, fork, delete, ...) write the chat back first
+    and go to the store. Same interface as the stores.
+
+    The cache-wide lock only guards the LRU in memory. Store writes happen
+    outside it under a lock per chat, so saves to different chats do not
+    wait on each other's I/O.
+    """
+
+    def __init__(self, store, max_bytes=int(CHAT_CACHE_MB * 1024 * 1024), flush_delay=FLUSH_MS / 1000.0,
+                 on_merged=None):
+        self.store = store
+        self.history_dir = store.history_dir
+        self.max_bytes = max_bytes
+        self.flush_delay = flush_delay
+        self.on_merged = on_merged
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # chat_id -> monotonic time it became dirty
+        self._dirty = {}
+        # Dirty chats eviction is waiting to write back
+        self._evicting = set()
+        # chat_id -> [RLock, users]
+        self._held = {}
+        self._closed = False
+        if flush_delay > 0:
+            threading.Thread(target=self._flush_loop, name='chat-flush', daemon=True).start()
+            atexit.register(self.close)
+
+    @staticmethod
+    def _copy(entry):
+        # Callers append to the list they get; the messages themselves are shared
+        return dict(entry.chat, messages=list(entry.chat['messages']))
+
+    def _fresh(self, chat_id):
+        """The cached entry if it is current, else None"""
+        entry = self._entries.get(chat_id)
+        if entry is not None and (entry.dirty or entry.version == self.store.version(chat_id)):
+            self._entries.move_to_end(chat_id)
+            return entry
+        return None
+
+    @contextmanager
+    def _chat_lock(self, chat_id):
+        """Hold one chat's store writes against other threads; reentrant"""
+        with self._lock:
+            held = self._held.get(chat_id)
+            if held is None:
+                held = self._held[chat_id] = [threading.RLock(), 0]
+            held[1] += 1
+        try:
+            with held[0]:
+                yield
+        finally:
+            with self._lock:
+                held[1] -= 1
+                if not held[1]:
+                    del self._held[chat_id]
+
+    def _put(self, chat_id, entry):
+        """Add an entry, or account for one that grew, and evict down to max_bytes"""
+        old = self._entries.pop(chat_id, None)
+        if old is not None:
+            self._bytes -= old.size
+        entry.size = message_bytes(entry.chat['messages'])
+        self._entries[chat_id] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used chats; dirty ones are left for _write_evicted"""
+        excess = self._bytes - self.max_bytes
+        left = len(self._entries)
+        for oldest in list(self._entries):
+            if excess <= 0 or left <= 1:
+                break
+            entry = self._entries[oldest]
+            if entry.dirty:
+                self._evicting.add(oldest)
+            else:
+                self._drop(oldest)
+            excess -= entry.size
+            left -= 1
+
+    def _write_evicted(self):
+        """Write back the dirty chats eviction is waiting on; called holding no lock"""
+        with self._lock:
+            pending = list(self._evicting)
+            self._evicting.clear()
+        for chat_id in pending:
+            with self._chat_lock(chat_id):
+                self._write(chat_id)
+
+    def _drop(self, chat_id):
+        entry = self._entries.pop(chat_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        self._dirty.pop(chat_id, None)
+        self._evicting.discard(chat_id)
+
+    def _write(self, chat_id):
+        """Write a dirty chat back to the store; called holding the chat's lock"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None or not entry.dirty:
+                return
+            chat = entry.chat
+            messages = list(chat['messages'])
+            title, folder_name, stored = chat['title'], chat['folder_name'], entry.stored
+        meta = self.store.save(chat_id, messages, title, folder_name, stored)
+        CHAT_FLUSHES.inc()
+        with self._lock:
+            entry.dirty = False
+            self._dirty.pop(chat_id, None)
+            if meta['merged']:
+                # Another process saved turns too; the combined chat is loaded on next use
+                self._drop(chat_id)
+            else:
+                entry.stored = len(messages)
+                entry.version = meta['version']
+                self._evict()
+        if meta['merged'] and self.on_merged is not None:
+            self.on_merged(chat_id, meta['appended_from'])
+
+    def flush(self, chat_id=None):
+        """Write back one dirty chat, or all of them"""
+        with self._lock:
+            dirty = [chat_id] if chat_id is not None else list(self._dirty)
+        for dirty_id in dirty:
+            with self._chat_lock(dirty_id):
+                self._write(dirty_id)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if not self._dirty:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = [chat_id for chat_id, since in self._dirty.items() if since + self.flush_delay <= now]
+                if not due:
+                    self._cond.wait(min(self._dirty.values()) + self.flush_delay - now)
+                    continue
+            for chat_id in due:
+                try:
+                    with self._chat_lock(chat_id):
+                        self._write(chat_id)
+                except OSError:
+                    # Keep it in memory and try again after another delay
+                    with self._lock:
+                        if chat_id in self._dirty:
+                            self._dirty[chat_id] = time.monotonic()
+
+    def close(self):
+        """Write back everything and stop deferring saves"""
+        with self._cond:
+            self.flush_delay = 0
+            self._closed = True
+            self._cond.notify_all()
+        self.flush()
+
+    def load(self, chat_id, restore=True):
+        with self._lock:
+            entry = self._fresh(chat_id)
+            if entry is not None:
+                CHAT_CACHE.inc(outcome='hit')
+                return self._copy(entry)
+            if not restore:
+                # Bulk readers such as index rebuilds pass through uncached
+                return self.store.load(chat_id, restore=False)
+            CHAT_CACHE.inc(outcome='stale' if chat_id in self._entries else 'miss')
+        # Read outside the lock; the version is taken first so a write racing
+        # the read only makes the entry look stale
+        version = self.store.version(chat_id)
+        chat = self.store.load(chat_id)
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None and entry.dirty:
+                return self._copy(entry)
+            if chat is None:
+                self._drop(chat_id)
+                return None
+            entry = _Entry(chat, len(chat['messages']), version)
+            self._put(chat_id, entry)
+            chat = self._copy(entry)
+        self._write_evicted()
+        return chat
+
+    def load_page(self, chat_id, limit, before=None):
+        """Return the chat with only the ``limit`` messages preceding index ``before`` (see ChatStore)"""
+        with self._lock:
+            entry = self._fresh(chat_id)
+            if entry is not None:
+                messages = entry.chat['messages']
+                total = len(messages)
+                end = total if before is None else max(min(before, total), 0)
+                start = max(end - limit, 0)
+                return dict(entry.chat, messages=messages[start:end], offset=start, total=total,
+                            next_cursor=start or None)
+        return self.store.load_page(chat_id, limit, before)
+
+    def save(self, chat_id, messages, title, folder_name, base=None):
+        """Persist a chat whose full message list is ``messages`` (see ChatStore.save).
+
+        Deferred when write-back is on and ``base`` is given; the result
+        then describes the chat as it is in memory.
+        """
+        with self._chat_lock(chat_id):
+            meta = self._save(chat_id, messages, title, folder_name, base)
+        self._write_evicted()
+        return meta
+
+    def _save(self, chat_id, messages, title, folder_name, base):
+        with self._lock:
+            entry = self._fresh(chat_id)
+            if entry is None and chat_id in self._entries:
+                self._drop(chat_id)
+            deferred = self.flush_delay > 0 and base is not None and (entry is not None
+                                                                      or not self.store.exists(chat_id))
+            if deferred:
+                now = datetime.now().isoformat()
+                if entry is None:
+                    chat = {'id': chat_id, 'title': title, 'folder_name': folder_name, 'created_at': now,
+                            'updated_at': now, 'messages': list(messages)}
+                    entry = _Entry(chat, 0, None, dirty=True)
+                    meta = {key: value for key, value in chat.items() if key != 'messages'}
+                    meta.update(appended_from=0, merged=False, created=True)
+                else:
+                    at = len(entry.chat['messages'])
+                    entry.chat['messages'].extend(messages[base:])
+                    entry.chat['updated_at'] = now
+                    entry.dirty = True
+                    meta = {'id': chat_id, 'updated_at': now, 'appended_from': at, 'merged': at != base}
+                self._put(chat_id, entry)
+                self._dirty.setdefault(chat_id, time.monotonic())
+                self._cond.notify()
+                return meta
+
+        self._write(chat_id)
+        meta = self.store.save(chat_id, messages, title, folder_name, base)
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if meta['merged'] or (entry is None and not meta.get('created')):
+                self._drop(chat_id)
+            elif entry is None:
+                chat = {key: value for key, value in meta.items()
+                        if key in ('id', 'title', 'folder_name', 'created_at', 'updated_at')}
+                chat['messages'] = list(messages)
+                self._put(chat_id, _Entry(chat, len(messages), meta['version']))
+            else:
+                entry.chat.update(messages=list(messages), updated_at=meta['updated_at'])
+                entry.stored = len(messages)
+                entry.version = meta['version']
+                self._put(chat_id, entry)
+        return meta
+
+    def _through(self, method, chat_id, *args, **kwargs):
+        """Write the chat back, then run a store method on it and forget the cached copy"""
+        with self._chat_lock(chat_id):
+            self._write(chat_id)
+            result = getattr(self.store, method)(chat_id, *args, **kwargs)
+            with self._lock:
+                self._drop(chat_id)
+        return result
+
+    def update(self, chat_id, **fields):
+        return self._through('update', chat_id, **fields)
+
+    def fork(self, chat_id, at):
+        return self._through('fork', chat_id, at)
+
+    def switch(self, chat_id, node_id):
+        return self._through('switch', chat_id, node_id)
+
+    def compact(self, chat_id):
+        return self._through('compact', chat_id)
+
+    def branches(self, chat_id):
+        with self._chat_lock(chat_id):
+            self._write(chat_id)
+            return self.store.branches(chat_id)
+
+    def delete(self, chat_id):
+        """Remove a chat, including one not written back yet"""
+        with self._chat_lock(chat_id):
+            with self._lock:
+                entry = self._entries.get(chat_id)
+                pending = entry is not None and entry.dirty and not entry.stored
+                self._drop(chat_id)
+            return self.store.delete(chat_id) or pending
+
+    def exists(self, chat_id):
+        with self._lock:
+            if chat_id in self._entries:
+                return True
+        return self.store.exists(chat_id)
+
+    def version(self, chat_id):
+        return self.store.version(chat_id)
+
+    def mtime(self, chat_id):
+        return self.store.mtime(chat_id)
+
+    def scan(self):
+        # Chats not written back yet are listed too
+        self.flush()
+        return self.store.scan()
@@ -0,0 +1,582 @@
+import os
+import json
+import time
+import asyncio
+import uuid
+import socket
+import sqlite3
+import threading
+from locks import FileLock
+
+# Worker threads running generations (with an event loop attached they only
+# start them), and how many may use one provider at once (credentials.json
+# 'max_concurrency' overrides it per provider)
+JOB_WORKERS = int(os.environ.get('QUERYQUEST_JOB_WORKERS', '16'))
+PROVIDER_CONCURRENCY = int(os.environ.get('QUERYQUEST_PROVIDER_CONCURRENCY', '8'))
+# How long finished jobs and their events stay available for resuming
+JOB_RETENTION = float(os.environ.get('QUERYQUEST_JOB_RETENTION', str(24 * 3600)))
+# Subscribers get a comment line this often while a job is quiet
+KEEPALIVE_SECONDS = 15
+PRUNE_INTERVAL = 600
+# How often to look for jobs left by a worker process that has exited, and
+# to check on a job another process is running for a subscriber
+RECOVER_INTERVAL = 30
+POLL_SECONDS = 1.0
+# How often a running job's new frames are written to the database
+PERSIST_SECONDS = 0.5
+
+FINISHED = ('done', 'failed', 'cancelled')
+
+
+class Job:
+    """A queued or running generation and the SSE frames it has produced"""
+
+    def __init__(self, job_id, user, request, providers, created_at, attempt=1):
+        self.id = job_id
+        self.user = user
+        self.request = request
+        self.providers = providers
+        self.created_at = created_at
+        self.attempt = attempt
+        self.status = 'queued'
+        self.frames = []
+        # How many of ``frames`` are in the database
+        self.persisted = 0
+        self.changed = threading.Condition()
+        self.cancelled = threading.Event()
+        # Callbacks waking asyncio subscribers, which cannot wait on ``changed``
+        self.listeners = []
+
+    def _notify(self):
+        """Wake every subscriber; called with ``changed`` held"""
+        self.changed.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def emit(self, frame):
+        """Publish one SSE frame ('data: ...\\n\\n') to every subscriber"""
+        with self.changed:
+            self.frames.append(frame)
+            self._notify()
+
+
+class JobQueue:
+    """Persistent queue of generations run by a local worker pool.
+
+    Jobs are recorded in SQLite when submitted, so they outlive the request
+    that created them. A client that disconnects only stops listening, and
+    jobs still queued or running when the process stops are run again on
+    the next start. A running job's frames are kept in memory and written
+    to the database in batches as they come, so a subscriber can resume
+    from any event id during the run, from any process, and for
+    JOB_RETENTION seconds after.
+
+    Runners are called on a worker thread. Once ``attach`` has given the
+    queue an event loop and a coroutine runner, workers only pick jobs and
+    start them as tasks on that loop, so a running job holds no thread.
+
+    Event ids are ``<attempt>.<seq>``. When a job has to be re-run after a
+    restart, a subscriber resuming from an earlier attempt is sent a
+    'reset' event and then the new run from the start. A re-run keeps its
+    job id, so the runner can tell whether the earlier attempt got as far as
+    saving its result.
+
+    Workers pick the next job fairly. Users with fewer running jobs go
+    first, and ties go to the user served least recently. A job waits while
+    any of its providers is at its concurrency limit, so a burst on one
+    provider does not hold up jobs for the others.
+
+    Several worker processes can share the database. Each job belongs to
+    the process that runs it, and every process holds a lock file named
+    after itself for as long as it lives, so the jobs of a process that has
+    exited are taken over by whichever process next finds its lock free.
+    A subscriber connected to another process than the job's reads the
+    frames from the database as they are written; fairness and provider
+    limits apply per process.
+    """
+
+    def __init__(self, db_path, runner, limit=None, workers=JOB_WORKERS):
+        self.db_path = db_path
+        self.runner = runner
+        self.limit = limit or (lambda provider: PROVIDER_CONCURRENCY)
+        self.workers = workers
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._queued = []
+        self._running_users = {}
+        self._running_providers = {}
+        self._served = {}
+        self._threads = []
+        self._pruned = None
+        self._persisting = threading.Lock()
+        # (loop, coroutine runner) once attached
+        self._async = None
+        self.owner = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.lock_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), '.locks')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._owner_lock = FileLock(self._owner_lock_path(self.owner))
+        self._owner_lock.acquire()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user TEXT,
+                    request TEXT NOT NULL,
+                    providers TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempt INTEGER NOT NULL DEFAULT 1,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            if 'owner' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    frame TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            ''')
+        self._recover()
+
+    def _connect(self):
+        """Return this thread's connection to the job database"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _owner_lock_path(self, owner):
+        return os.path.join(self.lock_dir, f'jobs-{owner}.lock')
+
+    def _orphaned(self, owner, checked):
+        """Whether ``owner``'s process has exited, judged by its lock file being free"""
+        if owner is None:
+            return True
+        if owner not in checked:
+            lock = FileLock(self._owner_lock_path(owner))
+            checked[owner] = lock.acquire(blocking=False)
+            if checked[owner]:
+                lock.release()
+        return checked[owner]
+
+    def _recover(self):
+        """Requeue unfinished jobs whose process has exited and drop expired ones"""
+        self.prune()
+        checked = {}
+        claimed = []
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status IN ('queued', 'running') AND owner IS NOT ? "
+                                'ORDER BY created_at', (self.owner,)).fetchall()
+            for row in rows:
+                if not self._orphaned(row['owner'], checked):
+                    continue
+                attempt = row['attempt'] + (row['status'] == 'running')
+                # Another process may be claiming the same job; the owner check settles it
+                cursor = conn.execute("UPDATE jobs SET status = 'queued', attempt = ?, owner = ? "
+                                      'WHERE id = ? AND owner IS ?', (attempt, self.owner, row['id'], row['owner']))
+                if cursor.rowcount:
+                    # The re-run starts its frames over
+                    conn.execute('DELETE FROM job_events WHERE job_id = ?', (row['id'],))
+                    claimed.append(Job(row['id'], row['user'], json.loads(row['request']),
+                                       json.loads(row['providers']), row['created_at'], attempt))
+        with self._cond:
+            for job in claimed:
+                self._jobs[job.id] = job
+                self._queued.append(job)
+            self._cond.notify_all()
+        for owner, exited in checked.items():
+            if exited and owner is not None:
+                try:
+                    os.remove(self._owner_lock_path(owner))
+                except OSError:
+                    pass
+        return len(claimed)
+
+    def prune(self):
+        """Delete jobs that finished more than JOB_RETENTION seconds ago"""
+        if self._pruned is not None and time.monotonic() - self._pruned < PRUNE_INTERVAL:
+            return
+        self._pruned = time.monotonic()
+        cutoff = time.time() - JOB_RETENTION
+        with self._connect() as conn:
+            conn.execute('DELETE FROM job_events WHERE job_id IN '
+                         '(SELECT id FROM jobs WHERE finished_at < ?)', (cutoff,))
+            conn.execute('DELETE FROM jobs WHERE finished_at < ?', (cutoff,))
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._maintain, name='job-maintenance', daemon=True).start()
+        threading.Thread(target=self._write_events, name='job-events', daemon=True).start()
+
+    def attach(self, loop, runner):
+        """Run jobs started from now on as tasks on ``loop`` with the coroutine function ``runner``"""
+        self._async = (loop, runner)
+
+    def detach(self):
+        """Go back to running jobs on worker threads"""
+        self._async = None
+
+    def _maintain(self):
+        while True:
+            time.sleep(RECOVER_INTERVAL)
+            try:
+                self._recover()
+            except sqlite3.Error:
+                continue
+
+    def _write_events(self):
+        while True:
+            time.sleep(PERSIST_SECONDS)
+            with self._cond:
+                running = [job for job in self._jobs.values() if job.status == 'running']
+            for job in running:
+                try:
+                    with self._connect() as conn:
+                        self._persist(conn, job)
+                except sqlite3.Error:
+                    continue
+
+    def _persist(self, conn, job):
+        """Write the frames of ``job`` that are not in the database yet"""
+        with self._persisting:
+            with job.changed:
+                start = job.persisted
+                frames = job.frames[start:]
+            conn.executemany('INSERT OR REPLACE INTO job_events (job_id, seq, frame) VALUES (?, ?, ?)',
+                             [(job.id, seq, frame) for seq, frame in enumerate(frames, start + 1)])
+            job.persisted = start + len(frames)
+
+    def submit(self, user, request, providers):
+        """Queue a generation; ``providers`` are the provider names it will call"""
+        providers = sorted(set(providers))
+        job = Job(uuid.uuid4().hex, user, request, providers, time.time())
+        with self._connect() as conn:
+            conn.execute('INSERT INTO jobs (id, user, request, providers, status, created_at, owner) '
+                         "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                         (job.id, user, json.dumps(request), json.dumps(providers), job.created_at, self.owner))
+        with self._cond:
+            self._jobs[job.id] = job
+            self._queued.append(job)
+            self._cond.notify()
+        return job
+
+    def _pick(self):
+        """The next job a worker may start, or None"""
+        by_user = {}
+        for job in self._queued:
+            if any(self._running_providers.get(provider, 0) >= self.limit(provider) for provider in job.providers):
+                continue
+            by_user.setdefault(job.user, job)
+        if not by_user:
+            return None
+        user = min(by_user, key=lambda user: (self._running_users.get(user, 0), self._served.get(user, 0)))
+        return by_user[user]
+
+    def _take(self):
+        with self._cond:
+            while True:
+                job = self._pick()
+                if job is not None:
+                    break
+                self._cond.wait()
+            self._queued.remove(job)
+            job.status = 'running'
+            self._served[job.user] = time.monotonic()
+            self._running_users[job.user] = self._running_users.get(job.user, 0) + 1
+            for provider in job.providers:
+                self._running_providers[provider] = self._running_providers.get(provider, 0) + 1
+            return job
+
+    def _release(self, job):
+        with self._cond:
+            self._running_users[job.user] -= 1
+            if not self._running_users[job.user]:
+                del self._running_users[job.user]
+            for provider in job.providers:
+                self._running_providers[provider] -= 1
+            self._cond.notify_all()
+
+    def _started(self, job):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                         (time.time(), job.id))
+
+    def _work(self):
+        while True:
+            job = self._take()
+            attached = self._async
+            if attached is not None:
+                loop, runner = attached
+                try:
+                    asyncio.run_coroutine_threadsafe(self._arun(job, runner), loop)
+                    continue
+                except RuntimeError:
+                    # The loop has closed without detaching
+                    self._async = None
+            self._started(job)
+            error = None
+            try:
+                self.runner(job)
+                status = 'cancelled' if job.cancelled.is_set() else 'done'
+            except Exception as e:
+                status = 'failed'
+                error = str(e) or type(e).__name__
+            finally:
+                self._release(job)
+            self._finish(job, status, error)
+
+    async def _arun(self, job, runner):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._started, job)
+        error = None
+        try:
+            await runner(job)
+            status = 'cancelled' if job.cancelled.is_set() else 'done'
+        except asyncio.CancelledError:
+            # The loop is shutting down
+            status = 'failed'
+            error = 'Interrupted'
+        except Exception as e:
+            status = 'failed'
+            error = str(e) or type(e).__name__
+        finally:
+            self._release(job)
+        await loop.run_in_executor(None, self._finish, job, status, error)
+
+    def _finish(self, job, status, error=None):
+        with self._connect() as conn:
+            self._persist(conn, job)
+            conn.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                         (status, error, time.time(), job.id))
+        # Frames are in the database now, so later subscribers read them there
+        with self._cond:
+            self._jobs.pop(job.id, None)
+        with job.changed:
+            job.status = status
+            job._notify()
+
+    def cancel(self, job_id):
+        """Stop a job; returns False if it is unknown or already finished"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancelled.set()
+            if job in self._queued:
+                self._queued.remove(job)
+            else:
+                # The runner stops at its next chance
+                return True
+        error = {'type': 'error', 'error': 'Cancelled', 'code': 'cancelled', 'retryable': False}
+        job.emit(f'data: {json.dumps(error)}\n\n')
+        self._finish(job, 'cancelled')
+        return True
+
+    def status(self, job_id):
+        """Job state as a dict, or None if unknown"""
+        row = self._connect().execute(
+            'SELECT id, status, attempt, error, created_at, started_at, finished_at FROM jobs WHERE id = ?',
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        info = dict(row)
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                info['status'] = job.status
+                info['events'] = len(job.frames)
+                if job.status == 'queued':
+                    info['position'] = self._queued.index(job) + 1
+        return info
+
+    @staticmethod
+    def _parse_event_id(event_id):
+        try:
+            attempt, seq = event_id.split('.')
+            return int(attempt), int(seq)
+        except (AttributeError, ValueError):
+            return None, 0
+
+    def _row(self, job_id):
+        return self._connect().execute('SELECT status, attempt FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+    def _stored_events(self, job_id, seq):
+        return self._connect().execute('SELECT seq, frame FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq',
+                                       (job_id, seq)).fetchall()
+
+    def subscribe(self, job_id, last_event_id=None):
+        """Iterate (event id, frame) pairs after ``last_event_id``.
+
+        Keepalive comments come with an event id of None. Returns None if
+        the job is unknown.
+        """
+        attempt, seq = self._parse_event_id(last_event_id)
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return self._follow(job, attempt, seq)
+        if self._row(job_id) is None:
+            return None
+        return self._replay(job_id, attempt, seq)
+
+    async def asubscribe(self, job_id, last_event_id=None):
+        """Async counterpart of subscribe for servers running on an event loop.
+
+        Returns an async iterator of the same pairs, or None if the job is
+        unknown. A subscriber waits on the loop rather than in a thread.
+        """
+        attempt, seq = self._parse_event_id(last_event_id)
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return self._afollow(job, attempt, seq)
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self._row, job_id) is None:
+            return None
+        return self._areplay(job_id, attempt, seq)
+
+    @staticmethod
+    def _reset_frame(current, attempt, seq):
+        """Frames a resuming subscriber needs first when the job has been re-run"""
+        if attempt is not None and attempt != current:
+            return [(None, 'data: {"type": "reset"}\n\n')], 0
+        return [], seq
+
+    def _follow(self, job, attempt, seq):
+        first, seq = self._reset_frame(job.attempt, attempt, seq)
+        yield from first
+        while True:
+            with job.changed:
+                if seq >= len(job.frames) and job.status not in FINISHED:
+                    job.changed.wait(KEEPALIVE_SECONDS)
+                frames = job.frames[seq:]
+                finished = job.status in FINISHED
+            if not frames and not finished:
+                yield None, ': keepalive\n\n'
+            for frame in frames:
+                seq += 1
+                yield f'{job.attempt}.{seq}', frame
+            if finished and seq >= len(job.frames):
+                return
+
+    async def _afollow(self, job, attempt, seq):
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(woken.set)
+            except RuntimeError:
+                # The subscriber's loop has closed
+                pass
+
+        first, seq = self._reset_frame(job.attempt, attempt, seq)
+        for item in first:
+            yield item
+        with job.changed:
+            job.listeners.append(wake)
+        try:
+            while True:
+                woken.clear()
+                with job.changed:
+                    frames = job.frames[seq:]
+                    finished = job.status in FINISHED
+                if not frames and not finished:
+                    try:
+                        await asyncio.wait_for(woken.wait(), KEEPALIVE_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield None, ': keepalive\n\n'
+                    continue
+                for frame in frames:
+                    seq += 1
+                    yield f'{job.attempt}.{seq}', frame
+                if finished and seq >= len(job.frames):
+                    return
+        finally:
+            with job.changed:
+                job.listeners.remove(wake)
+
+    def _replay(self, job_id, attempt, seq):
+        # A job another process is running is read back as its frames are written
+        current = None
+        quiet = 0.0
+        while True:
+            row = self._row(job_id)
+            if row is None:
+                return
+            with self._cond:
+                job = self._jobs.get(job_id)
+            if job is not None:
+                # Taken over by this process meanwhile
+                yield from self._follow(job, attempt, seq)
+                return
+            if row['attempt'] != current:
+                current = row['attempt']
+                first, seq = self._reset_frame(current, attempt, seq)
+                yield from first
+                attempt = current
+            # The final frames are written with the status, so none are missed
+            rows = self._stored_events(job_id, seq)
+            for event in rows:
+                seq = event['seq']
+                yield f'{current}.{seq}', event['frame']
+            if row['status'] in FINISHED:
+                return
+            if rows:
+                quiet = 0.0
+                continue
+            time.sleep(POLL_SECONDS)
+            quiet += POLL_SECONDS
+            if quiet >= KEEPALIVE_SECONDS:
+                quiet = 0.0
+                yield None, ': keepalive\n\n'
+
+    async def _areplay(self, job_id, attempt, seq):
+        loop = asyncio.get_running_loop()
+        current = None
+        quiet = 0.0
+        while True:
+            row = await loop.run_in_executor(None, self._row, job_id)
+            if row is None:
+                return
+            with self._cond:
+                job = self._jobs.get(job_id)
+            if job is not None:
+                async for item in self._afollow(job, attempt, seq):
+                    yield item
+                return
+            if row['attempt'] != current:
+                current = row['attempt']
+                first, seq = self._reset_frame(current, attempt, seq)
+                for item in first:
+                    yield item
+                attempt = current
+            rows = await loop.run_in_executor(None, self._stored_events, job_id, seq)
+            for event in rows:
+                seq = event['seq']
+                yield f'{current}.{seq}', event['frame']
+            if row['status'] in FINISHED:
+                return
+            if rows:
+                quiet = 0.0
+                continue
+            await asyncio.sleep(POLL_SECONDS)
+            quiet += POLL_SECONDS
+            if quiet >= KEEPALIVE_SECONDS:
+                quiet = 0.0
+                yield None, ': keepalive\n\n'
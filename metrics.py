@@ -0,0 +1,214 @@
+import time
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REGISTRY = []
+# Called as observer(provider, model, outcome, ttft, elapsed, chars) when a model call ends
+CALL_OBSERVERS = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of series, one per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            series = sorted(self._series.items())
+            for key, value in series:
+                lines.extend(self._render_series(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with-block takes"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labels, key, [('le', _format_value(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Provider calls
+PROVIDER_REQUESTS = Counter('queryquest_provider_requests_total',
+                            'Model calls by outcome (ok or an error code)', ('provider', 'model', 'outcome'))
+PROVIDER_TTFT = Histogram('queryquest_provider_ttft_seconds',
+                          'Time from sending a streamed request to its first text delta', ('provider', 'model'))
+PROVIDER_GENERATION = Histogram('queryquest_provider_generation_seconds',
+                                'Time from sending a request to the end of the answer', ('provider', 'model'))
+OUTPUT_TOKENS = Counter('queryquest_output_tokens_total',
+                        'Estimated tokens received from providers', ('provider', 'model'))
+OUTPUT_BYTES = Counter('queryquest_output_bytes_total',
+                       'UTF-8 bytes of text received from providers', ('provider', 'model'))
+PROMPT_TOKENS = Counter('queryquest_prompt_tokens_total',
+                        'Estimated tokens sent to providers', ('provider', 'model'))
+CACHED_RESPONSES = Counter('queryquest_cached_responses_total',
+                           'Answers served from the response cache', ('provider', 'model'))
+ROUTED_CALLS = Counter('queryquest_routed_calls_total',
+                       'Routed selections by the candidate that answered and whether a backup was sent',
+                       ('group', 'provider', 'model', 'hedged'))
+
+# Chat storage
+CHAT_LOAD = Histogram('queryquest_chat_load_seconds', 'Time to load a chat from the store')
+CHAT_SAVE = Histogram('queryquest_chat_save_seconds', 'Time to save a chat, including index updates')
+CHAT_LIST = Histogram('queryquest_chat_list_seconds', 'Time to list chats from the catalog')
+CHAT_CACHE = Counter('queryquest_chat_cache_total', 'Chat loads by cache outcome (hit, miss or stale)',
+                     ('outcome',))
+CHAT_FLUSHES = Counter('queryquest_chat_flushes_total', 'Cached chats written back to the store')
+
+# HTTP
+HTTP_REQUESTS = Histogram('queryquest_http_request_seconds',
+                          'Time until the response headers are ready (streams keep running after)',
+                          ('method', 'endpoint', 'status'))
+
+
+class CallTimer:
+    """Timing and size accounting for one model call"""
+
+    def __init__(self, provider, model, prompt_chars=0):
+        self.provider = provider
+        self.model = model
+        self.started = time.perf_counter()
+        self.ttft = None
+        self.chars = 0
+        self.bytes = 0
+        if prompt_chars:
+            PROMPT_TOKENS.inc((prompt_chars + 3) // 4, provider=provider, model=model)
+
+    def chunk(self, text, first=True):
+        """Account for received text; ``first`` records time to first token"""
+        if self.ttft is None and first:
+            self.ttft = time.perf_counter() - self.started
+            PROVIDER_TTFT.observe(self.ttft, provider=self.provider, model=self.model)
+        self.chars += len(text)
+        self.bytes += len(text.encode('utf-8'))
+
+    def finish(self, outcome='ok'):
+        elapsed = time.perf_counter() - self.started
+        labels = {'provider': self.provider, 'model': self.model}
+        PROVIDER_REQUESTS.inc(outcome=outcome, **labels)
+        if outcome == 'ok':
+            PROVIDER_GENERATION.observe(elapsed, **labels)
+        if self.chars:
+            OUTPUT_TOKENS.inc((self.chars + 3) // 4, **labels)
+            OUTPUT_BYTES.inc(self.bytes, **labels)
+        for observer in CALL_OBSERVERS:
+            observer(self.provider, self.model, outcome, self.ttft, elapsed, self.chars)
+        return elapsed
+
+
+class RequestTimings:
+    """Per-request timing breakdown, sent to clients that ask for it"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.models = {}
+        self.models_started = None
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def start_models(self):
+        self.models_started = time.perf_counter()
+
+    def chunk(self, index):
+        if index not in self.models:
+            self.models[index] = {'ttft_ms': round((time.perf_counter() - self.models_started) * 1000, 1)}
+
+    def model_done(self, index):
+        self.models.setdefault(index, {})['total_ms'] = round((time.perf_counter() - self.models_started) * 1000, 1)
+
+    def as_dict(self, selected_models):
+        timings = {f'{name}_ms': round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+        timings['models'] = [dict(self.models.get(index, {}), provider=model_info['provider'], model=model_info['model'])
+                             for index, model_info in enumerate(selected_models)]
+        timings['total_ms'] = round((time.perf_counter() - self.started) * 1000, 1)
+        return timings
@@ -0,0 +1,370 @@
+import os
+import re
+import json
+import asyncio
+import requests
+from abc import ABC, abstractmethod
+from requests.adapters import HTTPAdapter
+
+from resilience import Resilience, ProviderError
+from metrics import CallTimer
+
+try:
+    import aiohttp
+except ImportError:  # only needed by async_server.py
+    aiohttp = None
+
+# Connection pool sizing and timeouts shared by every provider session
+POOL_CONNECTIONS = int(os.environ.get('QUERYQUEST_POOL_CONNECTIONS', '4'))
+POOL_MAXSIZE = int(os.environ.get('QUERYQUEST_POOL_MAXSIZE', '32'))
+CONNECT_TIMEOUT = float(os.environ.get('QUERYQUEST_CONNECT_TIMEOUT', '10'))
+READ_TIMEOUT = float(os.environ.get('QUERYQUEST_READ_TIMEOUT', '120'))
+# Connection limit for the aiohttp sessions used by the async server
+ASYNC_POOL_LIMIT = int(os.environ.get('QUERYQUEST_ASYNC_POOL_LIMIT', '1000'))
+# Mark prompt prefixes cacheable for providers that need it spelled out
+# (Anthropic); OpenAI caches shared prefixes on its own
+PROMPT_CACHE = os.environ.get('QUERYQUEST_PROMPT_CACHE', '1') != '0'
+
+PROVIDERS = {}
+
+
+def register_provider(cls):
+    """Class decorator adding a provider adapter to the registry"""
+    PROVIDERS[cls.name] = cls()
+    return cls
+
+
+def get_provider(name):
+    """Return the adapter registered under name, or None"""
+    return PROVIDERS.get(name)
+
+
+async def close_async_sessions():
+    """Close the aiohttp sessions opened by astream()"""
+    for adapter in PROVIDERS.values():
+        if adapter._async_session is not None:
+            await adapter._async_session.close()
+            adapter._async_session = None
+
+
+class Provider(ABC):
+    """A chat completion backend.
+
+    Each adapter owns a long-lived requests session so consecutive calls
+    reuse pooled keep-alive connections instead of paying a new TCP and TLS
+    handshake per turn. ``config`` is the provider's entry from
+    credentials.json; ``api_key`` is required and ``base_url`` optionally
+    points the adapter at a different endpoint. Requests go through the
+    adapter's Resilience (rate limit, retries, circuit breaker) and every
+    failure is raised as a ProviderError.
+    """
+
+    name = None
+    base_url = None
+    temperature = 0.7
+    max_tokens = 2000
+    # Fast path for parse_line: ``delta_pattern`` captures the escaped text of
+    # a plain text delta so it can be read without decoding the whole event,
+    # and stream lines containing none of ``event_markers`` carry no text and
+    # are skipped unparsed. Anything else goes through parse_event.
+    delta_pattern = None
+    event_markers = None
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._async_session = None
+        self.resilience = Resilience(self.name)
+
+    def url(self, config):
+        return config.get('base_url') or self.base_url
+
+    @abstractmethod
+    def headers(self, config):
+        """HTTP headers for a request, carrying the API key from ``config``"""
+
+    @abstractmethod
+    def payload(self, messages, model, stream):
+        """The JSON request body for ``messages``"""
+
+    @abstractmethod
+    def parse_response(self, data):
+        """Return the response text of a complete (non-streamed) answer"""
+
+    @abstractmethod
+    def parse_event(self, data):
+        """Return the text delta carried by one streamed event, if any"""
+
+    def _send(self, url, headers, payload, stream, timeout):
+        """One HTTP attempt; returns the response or raises ProviderError"""
+        try:
+            response = self.session.post(url, headers=headers, json=payload, stream=stream,
+                                         timeout=(CONNECT_TIMEOUT, timeout))
+        except requests.exceptions.ConnectTimeout as e:
+            raise ProviderError(self.name, 'connection', f'Could not connect to {self.name}: {e}',
+                                retryable=True) from e
+        except requests.exceptions.Timeout as e:
+            raise ProviderError(self.name, 'timeout', f'{self.name} did not answer within {timeout:g}s') from e
+        except requests.exceptions.ConnectionError as e:
+            raise ProviderError(self.name, 'connection', f'Could not connect to {self.name}: {e}',
+                                retryable=True) from e
+        if not response.ok:
+            error = ProviderError.from_status(self.name, response.status_code, response.headers, response.text)
+            response.close()
+            raise error
+        return response
+
+    def post(self, messages, model, config, stream=False, timeout=None):
+        self.resilience.configure(config)
+        url = self.url(config)
+        headers = self.headers(config)
+        payload = self.payload(messages, model, stream)
+        timeout = timeout or config.get('timeout') or READ_TIMEOUT
+        return self.resilience.call(lambda: self._send(url, headers, payload, stream, timeout))
+
+    def _timer(self, messages, model):
+        return CallTimer(self.name, model, sum(len(msg.get('content') or '') for msg in messages))
+
+    def complete(self, messages, model, config, timeout=None):
+        """Return the full response text"""
+        timer = self._timer(messages, model)
+        outcome = 'internal'
+        try:
+            response = self.post(messages, model, config, timeout=timeout)
+            try:
+                text = self.parse_response(response.json())
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                raise ProviderError(self.name, 'bad_response', f'Unexpected response from {self.name}: {e}') from e
+            timer.chunk(text, first=False)
+            outcome = 'ok'
+            return text
+        except ProviderError as e:
+            outcome = e.code
+            raise
+        finally:
+            timer.finish(outcome)
+
+    def parse_line(self, line):
+        """Return the text delta carried by one line of an SSE stream, if any"""
+        if not line.startswith(b'data: '):
+            return None
+        if self.delta_pattern is not None:
+            match = self.delta_pattern.search(line)
+            if match:
+                text = match.group(1)
+                if b'\\' not in text:
+                    return text.decode('utf-8')
+                return json.loads(b'"' + text + b'"')
+        if self.event_markers is not None and not any(marker in line for marker in self.event_markers):
+            return None
+        try:
+            data = json.loads(line[6:])
+        except ValueError:
+            return None
+        return self.parse_event(data)
+
+    def stream(self, messages, model, config, timeout=None):
+        """Yield response text deltas as they arrive"""
+        timer = self._timer(messages, model)
+        # Stays 'cancelled' when the consumer stops reading early
+        outcome = 'cancelled'
+        try:
+            for content in self._stream(messages, model, config, timeout):
+                timer.chunk(content)
+                yield content
+            outcome = 'ok'
+        except ProviderError as e:
+            outcome = e.code
+            raise
+        except Exception:
+            outcome = 'internal'
+            raise
+        finally:
+            timer.finish(outcome)
+
+    def _stream(self, messages, model, config, timeout=None):
+        response = self.post(messages, model, config, stream=True, timeout=timeout)
+        try:
+            for line in response.iter_lines():
+                content = self.parse_line(line)
+                if content:
+                    yield content
+        except requests.exceptions.RequestException as e:
+            raise ProviderError(self.name, 'stream_interrupted', f'{self.name} stream broke off: {e}') from e
+        finally:
+            response.close()
+
+    def async_session(self):
+        """Return this adapter's aiohttp session, created inside the running loop"""
+        if self._async_session is None or self._async_session.closed:
+            connector = aiohttp.TCPConnector(limit=ASYNC_POOL_LIMIT, keepalive_timeout=30)
+            self._async_session = aiohttp.ClientSession(connector=connector)
+        return self._async_session
+
+    async def astream(self, messages, model, config, timeout=None):
+        """Async version of stream() for the asyncio server"""
+        timer = self._timer(messages, model)
+        outcome = 'cancelled'
+        try:
+            async for content in self._astream(messages, model, config, timeout):
+                timer.chunk(content)
+                yield content
+            outcome = 'ok'
+        except ProviderError as e:
+            outcome = e.code
+            raise
+        except Exception:
+            outcome = 'internal'
+            raise
+        finally:
+            timer.finish(outcome)
+
+    async def _astream(self, messages, model, config, timeout=None):
+        self.resilience.configure(config)
+        read_timeout = timeout or config.get('timeout') or READ_TIMEOUT
+        client_timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=read_timeout)
+        url = self.url(config)
+        headers = self.headers(config)
+        payload = self.payload(messages, model, True)
+
+        async def send():
+            try:
+                response = await self.async_session().post(url, headers=headers, json=payload,
+                                                           timeout=client_timeout)
+            except asyncio.TimeoutError as e:
+                if isinstance(e, getattr(aiohttp, 'ConnectionTimeoutError', ())):
+                    raise ProviderError(self.name, 'connection', f'Could not connect to {self.name}',
+                                        retryable=True) from e
+                raise ProviderError(self.name, 'timeout',
+                                    f'{self.name} did not answer within {read_timeout:g}s') from e
+            except aiohttp.ClientConnectionError as e:
+                raise ProviderError(self.name, 'connection', f'Could not connect to {self.name}: {e}',
+                                    retryable=True) from e
+            if response.status >= 400:
+                body = await response.text()
+                response.release()
+                raise ProviderError.from_status(self.name, response.status, response.headers, body)
+            return response
+
+        response = await self.resilience.acall(send)
+        try:
+            async for line in response.content:
+                content = self.parse_line(line)
+                if content:
+                    yield content
+        except asyncio.TimeoutError as e:
+            raise ProviderError(self.name, 'timeout', f'{self.name} did not answer within {read_timeout:g}s') from e
+        except aiohttp.ClientError as e:
+            raise ProviderError(self.name, 'stream_interrupted', f'{self.name} stream broke off: {e}') from e
+        finally:
+            response.release()
+
+
+class OpenAICompatibleProvider(Provider):
+    """Backends speaking the OpenAI chat-completions format"""
+
+    delta_pattern = re.compile(rb'"delta":\s*\{\s*"content":\s*"((?:[^"\\]|\\.)*)"\s*\}')
+    event_markers = (b'"content"',)
+
+    def payload(self, messages, model, stream):
+        return {
+            'model': model,
+            'messages': messages,
+            'temperature': self.temperature,
+            'max_tokens': self.max_tokens,
+            'stream': stream
+        }
+
+    def parse_response(self, data):
+        return data['choices'][0]['message']['content']
+
+    def parse_event(self, data):
+        if data.get('choices'):
+            return data['choices'][0].get('delta', {}).get('content')
+        return None
+
+
+@register_provider
+class OpenAIProvider(OpenAICompatibleProvider):
+    name = 'openai'
+    base_url = 'https://api.openai.com/v1/chat/completions'
+
+    def headers(self, config):
+        return {
+            'Content-Type': 'application/json',
+            'Authorization': f"Bearer {config['api_key']}"
+        }
+
+
+@register_provider
+class CoforgeProvider(OpenAICompatibleProvider):
+    name = 'coforge'
+    base_url = 'https://quasarmarket.coforge.com/qag/llmrouter-api/v2/chat/completions'
+
+    def headers(self, config):
+        return {
+            'Content-Type': 'application/json',
+            'X-API-KEY': config['api_key']
+        }
+
+
+@register_provider
+class AnthropicProvider(Provider):
+    name = 'anthropic'
+    base_url = 'https://api.anthropic.com/v1/messages'
+    delta_pattern = re.compile(rb'"delta":\s*\{\s*"type":\s*"text_delta",\s*"text":\s*"((?:[^"\\]|\\.)*)"\s*\}')
+    # Only text deltas and errors matter; pings, message_start and the rest are skipped
+    event_markers = (b'content_block_delta', b'"error"')
+
+    def headers(self, config):
+        return {
+            'Content-Type': 'application/json',
+            'x-api-key': config['api_key'],
+            'anthropic-version': '2023-06-01'
+        }
+
+    def payload(self, messages, model, stream):
+        # Anthropic takes system prompts as a separate field
+        system_parts = [msg['content'] for msg in messages if msg['role'] == 'system']
+        data = {
+            'model': model,
+            'max_tokens': self.max_tokens,
+            'messages': [msg for msg in messages if msg['role'] != 'system'],
+            'stream': stream
+        }
+        if system_parts:
+            data['system'] = '\n\n'.join(system_parts)
+        if PROMPT_CACHE:
+            self._mark_cacheable(data)
+        return data
+
+    @staticmethod
+    def _mark_cacheable(data):
+        """Add cache breakpoints after the system prompt and the newest message.
+
+        Every branch and every later turn of a conversation starts with the
+        prefix ending at an earlier breakpoint, so it is read from the
+        provider's prompt cache instead of being processed again.
+        """
+        cache = {'type': 'ephemeral'}
+        if data.get('system'):
+            data['system'] = [{'type': 'text', 'text': data['system'], 'cache_control': cache}]
+        if data['messages'] and isinstance(data['messages'][-1].get('content'), str):
+            last = data['messages'][-1]
+            data['messages'][-1] = dict(last, content=[{'type': 'text', 'text': last['content'],
+                                                        'cache_control': cache}])
+
+    def parse_response(self, data):
+        return data['content'][0]['text']
+
+    def parse_event(self, data):
+        if data.get('type') == 'content_block_delta':
+            return data.get('delta', {}).get('text')
+        if data.get('type') == 'error':
+            # e.g. overloaded_error sent after the stream has started
+            error = data.get('error', {})
+            raise ProviderError(self.name, 'stream_interrupted',
+                                f"{self.name} stream failed: {error.get('message') or error.get('type')}")
+        return None
@@ -0,0 +1,73 @@
+import os
+import json
+
+# Text deltas arriving within this window are sent to the client as one SSE
+# frame; 0 relays every delta as its own frame
+COALESCE_MS = float(os.environ.get('QUERYQUEST_SSE_COALESCE_MS', '20'))
+# A frame is sent early once this much text is waiting
+COALESCE_CHARS = int(os.environ.get('QUERYQUEST_SSE_COALESCE_CHARS', '2048'))
+
+
+def content_framer(event):
+    """Return a function framing a text delta as ``event`` plus its 'content'.
+
+    The constant fields are encoded once, so each delta costs one string
+    encode instead of dumping a fresh dict; the output is the same as
+    ``sse_event(dict(event, content=text))``.
+    """
+    prefix = 'data: ' + json.dumps(event)[:-1] + ', "content": '
+    return lambda text: prefix + json.dumps(text) + '}\n\n'
+
+
+class Coalescer:
+    """Holds back text deltas so several can be relayed in one frame.
+
+    Deltas are grouped per model index. A model's first delta is due at once
+    so time to first token is unaffected; after that, text waits at most
+    ``window`` seconds or until ``max_chars`` have gathered. Callers pass
+    the current monotonic time in, which keeps this usable from both the
+    threaded and the asyncio relay loops.
+    """
+
+    def __init__(self, window=COALESCE_MS / 1000.0, max_chars=COALESCE_CHARS):
+        self.window = window
+        self.max_chars = max_chars
+        self.pending = {}
+        self.chars = 0
+        self.flush_at = None
+        self.started = set()
+
+    def add(self, index, text, now):
+        self.pending.setdefault(index, []).append(text)
+        self.chars += len(text)
+        if index not in self.started:
+            self.started.add(index)
+            self.flush_at = now
+        elif self.flush_at is None:
+            self.flush_at = now + self.window
+
+    def due(self, now):
+        return self.flush_at is not None and (now >= self.flush_at or self.chars >= self.max_chars)
+
+    def wait(self, now, limit):
+        """Seconds to block for the next delta before a flush falls due"""
+        if self.flush_at is None:
+            return limit
+        return min(limit, max(self.flush_at - now, 0))
+
+    def flush(self, index=None):
+        """Take the held-back text, for one model or all, as (index, text) pairs"""
+        if index is not None:
+            parts = self.pending.pop(index, None)
+            if not parts:
+                return []
+            text = ''.join(parts)
+            self.chars -= len(text)
+            if not self.pending:
+                self.flush_at = None
+            return [(index, text)]
+        batch = [(index, ''.join(parts)) for index, parts in self.pending.items()]
+        self.pending = {}
+        self.chars = 0
+        self.flush_at = None
+        return batch
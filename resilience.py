@@ -0,0 +1,259 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+# Retries for failures that are worth repeating (429, 5xx, connection errors)
+MAX_RETRIES = int(os.environ.get('QUERYQUEST_MAX_RETRIES', '2'))
+RETRY_BASE = float(os.environ.get('QUERYQUEST_RETRY_BASE', '0.5'))
+RETRY_CAP = float(os.environ.get('QUERYQUEST_RETRY_CAP', '8'))
+# Requests per minute allowed per provider; 0 means unlimited. credentials.json
+# 'rate_limit' (and optionally 'burst') overrides it per provider
+RATE_LIMIT = float(os.environ.get('QUERYQUEST_RATE_LIMIT', '0'))
+RATE_LIMIT_WAIT = float(os.environ.get('QUERYQUEST_RATE_LIMIT_WAIT', '30'))
+# Consecutive failures that open a provider's circuit, and how long it stays open
+BREAKER_FAILURES = int(os.environ.get('QUERYQUEST_BREAKER_FAILURES', '5'))
+BREAKER_RESET = float(os.environ.get('QUERYQUEST_BREAKER_RESET', '30'))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504, 529}
+
+
+class ProviderError(Exception):
+    """A failed provider call, described well enough to report to the client.
+
+    ``code`` is one of rate_limited, unavailable, auth, bad_request,
+    http_error, bad_response, connection, timeout, circuit_open or
+    stream_interrupted.
+    """
+
+    def __init__(self, provider, code, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.provider = provider
+        self.code = code
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_status(cls, provider, status, headers, body=''):
+        if status == 429:
+            code = 'rate_limited'
+        elif status in (401, 403):
+            code = 'auth'
+        elif status in (400, 404, 413, 422):
+            code = 'bad_request'
+        elif status >= 500:
+            code = 'unavailable'
+        else:
+            code = 'http_error'
+        message = f'{provider} returned HTTP {status}'
+        body = ' '.join(body.split())[:300]
+        if body:
+            message += f': {body}'
+        return cls(provider, code, message, status=status, retryable=status in RETRYABLE_STATUS,
+                   retry_after=retry_after(headers))
+
+    def to_dict(self):
+        info = {'error': str(self), 'code': self.code, 'retryable': self.retryable}
+        if self.status:
+            info['status'] = self.status
+        if self.retry_after:
+            info['retry_after'] = round(self.retry_after, 1)
+        return info
+
+
+def retry_after(headers):
+    """Seconds to wait according to a Retry-After header, if it has one"""
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def error_info(error):
+    """Structured description of any error raised while calling a model"""
+    if isinstance(error, ProviderError):
+        return error.to_dict()
+    if isinstance(error, ValueError):
+        return {'error': str(error), 'code': 'bad_request', 'retryable': False}
+    return {'error': str(error) or type(error).__name__, 'code': 'internal', 'retryable': False}
+
+
+class TokenBucket:
+    """Requests-per-minute limiter that callers reserve a slot from"""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or max(per_minute / 60.0, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a slot and return how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds):
+        """Hold every caller back, e.g. after the provider answered 429"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """Fails calls fast while a provider keeps failing.
+
+    After ``failures`` consecutive failures the circuit opens and calls are
+    refused for ``reset`` seconds; then a single trial call is let through,
+    closing the circuit again if it succeeds.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self, provider):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset - time.monotonic()
+            if remaining > 0 or self.trial:
+                raise ProviderError(provider, 'circuit_open',
+                                    f'{provider} is failing; calls are paused for {max(remaining, 1):.0f}s',
+                                    retryable=True, retry_after=max(remaining, 1))
+            self.trial = True
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive += 1
+            self.trial = False
+            if self.consecutive >= self.failures:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() >= self.opened_at + self.reset else 'open'
+
+
+class Resilience:
+    """Rate limit, retry and circuit breaker state for one provider.
+
+    ``send`` performs one attempt and either returns the response or raises
+    ProviderError; retryable errors are repeated with full-jitter
+    exponential backoff, honouring Retry-After.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.breaker = CircuitBreaker()
+        self.bucket = None
+        self._limit = None
+
+    def configure(self, config):
+        limit = (float(config.get('rate_limit') or RATE_LIMIT), config.get('burst'))
+        if limit != self._limit:
+            self._limit = limit
+            self.bucket = TokenBucket(*limit) if limit[0] > 0 else None
+
+    def _slot(self):
+        """Seconds to wait for a rate limit slot; fails fast while the circuit is open"""
+        if self.bucket is None:
+            self.breaker.before_call(self.provider)
+            return 0
+        wait = self.bucket.reserve()
+        if wait > RATE_LIMIT_WAIT:
+            self.bucket.refund()
+            raise ProviderError(self.provider, 'rate_limited',
+                                f'{self.provider} rate limit reached; try again in {wait:.0f}s',
+                                retryable=True, retry_after=wait)
+        try:
+            self.breaker.before_call(self.provider)
+        except ProviderError:
+            self.bucket.refund()
+            raise
+        return wait
+
+    def _backoff(self, error, attempt):
+        """Record a failed attempt; return the delay before the next one or re-raise"""
+        if error.retryable or not error.status:
+            self.breaker.record_failure()
+        elif error.status:
+            # The provider answered, it just did not like the request
+            self.breaker.record_success()
+        if not error.retryable or attempt >= MAX_RETRIES:
+            raise error
+        delay = random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** attempt))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+            if self.bucket is not None:
+                self.bucket.pause(delay)
+        return delay
+
+    def call(self, send):
+        attempt = 0
+        while True:
+            time.sleep(self._slot())
+            try:
+                response = send()
+            except ProviderError as error:
+                delay = self._backoff(error, attempt)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, send):
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._slot())
+            try:
+                response = await send()
+            except ProviderError as error:
+                delay = self._backoff(error, attempt)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        return {'circuit': self.breaker.state, 'consecutive_failures': self.breaker.consecutive,
+                'rate_limit': self._limit[0] if self._limit else None}
@@ -0,0 +1,141 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# The cache is opt-in: enabled globally here, or per request with 'use_cache'
+RESPONSE_CACHE = os.environ.get('QUERYQUEST_RESPONSE_CACHE', '0') == '1'
+RESPONSE_CACHE_TTL = float(os.environ.get('QUERYQUEST_RESPONSE_CACHE_TTL', str(7 * 24 * 3600)))
+RESPONSE_CACHE_BYTES = int(os.environ.get('QUERYQUEST_RESPONSE_CACHE_BYTES', str(256 * 1024 * 1024)))
+
+REPLAY_CHUNK_CHARS = 24
+
+
+class ResponseCache:
+    """Disk-backed LRU + TTL cache of complete model responses.
+
+    Entries are keyed on a hash of everything that determines the answer:
+    provider, model, the exact messages sent (behavior instructions and
+    trimmed history included), temperature and max_tokens. Each entry is a
+    small JSON file; recency and sizes are tracked in memory so lookups
+    never scan the directory, and the least recently used entries are
+    evicted once the total size passes ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir='response_cache', ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> (size, created); ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name[:-5], st.st_size))
+        for mtime, key, size in sorted(found):
+            self._entries[key] = (size, mtime)
+            self._bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    @staticmethod
+    def key(provider, model, messages, temperature, max_tokens):
+        """Hash of the request parameters that determine a response"""
+        material = json.dumps([provider, model, messages, temperature, max_tokens],
+                              sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _drop(self, key):
+        size, _ = self._entries.pop(key)
+        self._bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """Return the cached response text, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    response = json.load(f)['response']
+            except (OSError, ValueError, KeyError):
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key, response, **info):
+        """Store a response, evicting least recently used entries past the size cap"""
+        data = json.dumps(dict(info, response=response, created_at=time.time())).encode('utf-8')
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            path = self._path(key)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._entries[key] = (len(data), time.time())
+            self._bytes += len(data)
+            self.stores += 1
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled_by_default': RESPONSE_CACHE,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl
+            }
+
+
+def replay(response):
+    """Yield a cached response in small pieces, the way a live stream would arrive"""
+    chunk = ''
+    for piece in re.findall(r'\s*\S+|\s+', response):
+        chunk += piece
+        if len(chunk) >= REPLAY_CHUNK_CHARS:
+            yield chunk
+            chunk = ''
+    if chunk:
+        yield chunk
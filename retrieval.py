@@ -0,0 +1,238 @@
+import os
+import re
+import glob
+import zlib
+import sqlite3
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # retrieval is switched off without NumPy
+    np = None
+
+# Retrieve relevant note/attachment passages for each message
+RETRIEVAL = os.environ.get('QUERYQUEST_RETRIEVAL', '1') != '0'
+RETRIEVAL_TOP_K = int(os.environ.get('QUERYQUEST_RETRIEVAL_TOP_K', '4'))
+RETRIEVAL_MIN_SCORE = float(os.environ.get('QUERYQUEST_RETRIEVAL_MIN_SCORE', '0.1'))
+
+DIMENSIONS = 1024
+SEGMENT_ROWS = 8192
+PASSAGE_CHARS = 1200
+
+
+def split_passages(text, size=PASSAGE_CHARS):
+    """Split text into passages of about ``size`` characters, at line ends where possible"""
+    passages = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            newline = text.rfind('\n', start + size // 2, end)
+            if newline > 0:
+                end = newline + 1
+        passage = text[start:end].strip()
+        if passage:
+            passages.append(passage)
+        start = end
+    return passages
+
+
+def _term_counts(text):
+    """Hashed term frequencies of text, one bucket per DIMENSIONS"""
+    buckets = [zlib.crc32(word.encode('utf-8')) % DIMENSIONS for word in re.findall(r'\w+', text.lower())]
+    return np.bincount(np.array(buckets, dtype=np.int64), minlength=DIMENSIONS).astype(np.float32)
+
+
+class Retriever:
+    """Local passage index over notes and uploaded attachments.
+
+    Each passage is embedded as a hashed bag of words (log term frequency in
+    DIMENSIONS buckets, L2-normalised) and stored as one float32 row in
+    memory-mapped ``.npy`` segments of SEGMENT_ROWS rows, so startup maps
+    the files instead of reading them and new segments are added without
+    rewriting old ones. Passage text and ownership live in SQLite. Queries
+    are weighted by bucket idf and scored against every row with one matrix
+    product per segment. Rows freed by removing a source are reused.
+    """
+
+    def __init__(self, index_dir='retrieval_index'):
+        self.index_dir = index_dir
+        self.available = np is not None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if not self.available:
+            return
+        os.makedirs(index_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS passages (
+                    row INTEGER PRIMARY KEY,
+                    source TEXT,
+                    position INTEGER,
+                    text TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS passages_source ON passages (source)')
+
+        self._segments = []
+        for path in sorted(glob.glob(os.path.join(index_dir, 'vectors-*.npy'))):
+            self._segments.append(np.load(path, mmap_mode='r+'))
+        capacity = len(self._segments) * SEGMENT_ROWS
+        # Source of every row as a small integer, -1 for free rows
+        self._codes = np.full(capacity, -1, dtype=np.int32)
+        self._source_codes = {}
+        self._document_frequency = np.zeros(DIMENSIONS, dtype=np.float64)
+        self._rows = 0
+        self._free = []
+        for row, source in self._connect().execute('SELECT row, source FROM passages ORDER BY row'):
+            self._rows = row + 1
+            if source is None:
+                self._free.append(row)
+            else:
+                self._codes[row] = self._code(source)
+        for index, segment in enumerate(self._segments):
+            live = self._codes[index * SEGMENT_ROWS:(index + 1) * SEGMENT_ROWS] >= 0
+            self._document_frequency += (segment[live] > 0).sum(axis=0)
+
+    def _connect(self):
+        """Return this thread's connection to the passage database"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.index_dir, 'passages.db'), timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _code(self, source):
+        code = self._source_codes.get(source)
+        if code is None:
+            code = self._source_codes[source] = len(self._source_codes)
+        return code
+
+    def _vector_at(self, row):
+        return self._segments[row // SEGMENT_ROWS][row % SEGMENT_ROWS]
+
+    def _add_segment(self):
+        path = os.path.join(self.index_dir, f'vectors-{len(self._segments):04d}.npy')
+        segment = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(SEGMENT_ROWS, DIMENSIONS))
+        self._segments.append(segment)
+        self._codes = np.concatenate([self._codes, np.full(SEGMENT_ROWS, -1, dtype=np.int32)])
+
+    def _take_row(self):
+        if self._free:
+            return self._free.pop()
+        if self._rows == len(self._segments) * SEGMENT_ROWS:
+            self._add_segment()
+        self._rows += 1
+        return self._rows - 1
+
+    def _remove(self, conn, source):
+        rows = [row for (row,) in conn.execute('SELECT row FROM passages WHERE source = ?', (source,))]
+        for row in rows:
+            vector = self._vector_at(row)
+            self._document_frequency -= vector > 0
+            vector[:] = 0
+            self._codes[row] = -1
+            self._free.append(row)
+        conn.execute('UPDATE passages SET source = NULL, position = NULL, text = NULL WHERE source = ?', (source,))
+
+    def index(self, source, text):
+        """Replace the passages of a source (``note:<file>`` or ``attachment:<id>``)"""
+        if not self.available:
+            return 0
+        passages = split_passages(text)
+        with self._lock, self._connect() as conn:
+            self._remove(conn, source)
+            touched = set()
+            for position, passage in enumerate(passages):
+                vector = np.log1p(_term_counts(passage))
+                norm = np.linalg.norm(vector)
+                if norm == 0:
+                    continue
+                row = self._take_row()
+                self._vector_at(row)[:] = vector / norm
+                self._codes[row] = self._code(source)
+                self._document_frequency += vector > 0
+                touched.add(row // SEGMENT_ROWS)
+                conn.execute('INSERT OR REPLACE INTO passages (row, source, position, text) VALUES (?, ?, ?, ?)',
+                             (row, source, position, passage))
+            for segment in touched:
+                self._segments[segment].flush()
+        return len(passages)
+
+    def remove(self, source):
+        if not self.available:
+            return
+        with self._lock, self._connect() as conn:
+            self._remove(conn, source)
+
+    def has(self, source):
+        if not self.available:
+            return False
+        return source in self._source_codes and bool((self._codes == self._source_codes[source]).any())
+
+    def sources(self, prefix):
+        """Indexed sources whose name starts with prefix"""
+        if not self.available:
+            return []
+        with self._lock:
+            return [source for source, code in self._source_codes.items()
+                    if source.startswith(prefix) and (self._codes == code).any()]
+
+    def is_empty(self):
+        return not self.available or not (self._codes >= 0).any()
+
+    def search(self, query, sources, k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """Return the k passages from ``sources`` most similar to the query"""
+        if not self.available or not sources:
+            return []
+        with self._lock:
+            rows = self._rows
+            codes = self._codes[:rows].copy()
+            live = max(int((codes >= 0).sum()), 1)
+            idf = np.log((live + 1) / (self._document_frequency + 1)) + 1
+            wanted = [self._source_codes[source] for source in sources if source in self._source_codes]
+        if not wanted or rows == 0:
+            return []
+
+        query_vector = (np.log1p(_term_counts(query)) * idf).astype(np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return []
+        query_vector /= norm
+
+        scores = np.empty(rows, dtype=np.float32)
+        for index, segment in enumerate(self._segments):
+            start = index * SEGMENT_ROWS
+            if start >= rows:
+                break
+            end = min(start + SEGMENT_ROWS, rows)
+            scores[start:end] = segment[:end - start] @ query_vector
+        scores[~np.isin(codes, wanted)] = -1
+
+        k = min(k, rows)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = [int(row) for row in top if scores[row] >= min_score]
+        if not top:
+            return []
+        placeholders = ', '.join('?' * len(top))
+        found = {row: (source, position, text) for row, source, position, text in self._connect().execute(
+            f'SELECT row, source, position, text FROM passages WHERE row IN ({placeholders})', top)}
+        return [{'source': found[row][0], 'position': found[row][1], 'text': found[row][2],
+                 'score': round(float(scores[row]), 4)}
+                for row in top if row in found and found[row][0] is not None]
+
+
+def insert_passages(messages):
+    """Put the passages retrieved for a message in a system message just before it"""
+    result = []
+    for message in messages:
+        passages = message.get('context')
+        if passages:
+            excerpts = '\n\n'.join(f"[{passage['label']}]\n{passage['text']}" for passage in passages)
+            result.append({'role': 'system',
+                           'content': f"Relevant excerpts from the user's notes and files:\n\n{excerpts}"})
+            message = {key: value for key, value in message.items() if key != 'context'}
+        result.append(message)
+    return result
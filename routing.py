@@ -0,0 +1,258 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from resilience import ProviderError
+
+# A selection with this provider routes within the model group named by its model
+ROUTE_PROVIDER = 'auto'
+# Recent calls per model kept for percentiles
+ROUTING_WINDOW = int(os.environ.get('QUERYQUEST_ROUTING_WINDOW', '100'))
+# Weight of the newest call in the rolling averages
+ROUTING_ALPHA = float(os.environ.get('QUERYQUEST_ROUTING_ALPHA', '0.2'))
+# Answer length assumed when weighing time to first token against throughput
+ROUTING_TOKENS = int(os.environ.get('QUERYQUEST_ROUTING_TOKENS', '300'))
+# Share of routed calls sent to another candidate so its estimate stays current
+ROUTING_EXPLORE = float(os.environ.get('QUERYQUEST_ROUTING_EXPLORE', '0.05'))
+# Whether routed selections send a backup request by default ('hedge' per selection)
+HEDGE = os.environ.get('QUERYQUEST_HEDGE', '0') != '0'
+# The backup goes out once the first candidate is slower than this percentile of its calls
+HEDGE_PERCENTILE = float(os.environ.get('QUERYQUEST_HEDGE_PERCENTILE', '95'))
+# Delay used until a model has HEDGE_MIN_SAMPLES calls to take the percentile of
+HEDGE_DELAY = float(os.environ.get('QUERYQUEST_HEDGE_DELAY', '2'))
+HEDGE_MIN_SAMPLES = 10
+HEDGE_MIN_DELAY = 0.05
+# Answers shorter than this say little about throughput and are not counted for it
+THROUGHPUT_MIN_CHARS = 400
+
+
+def parse_candidate(candidate):
+    """A {'provider', 'model'} selection from a dict or a 'provider/model' string, or None"""
+    if isinstance(candidate, str):
+        provider, _, model = candidate.partition('/')
+        candidate = {'provider': provider, 'model': model}
+    if not isinstance(candidate, dict) or not candidate.get('provider') or not candidate.get('model'):
+        return None
+    return candidate
+
+
+def routed_selection(model_info, groups):
+    """Resolve a routed model selection, or return None for a plain one.
+
+    A selection is routed when it names a group from model_groups.json, as
+    {'group': name} or {'provider': 'auto', 'model': name}, or lists its own
+    {'candidates': [...]}. The result keeps provider 'auto' and the group
+    name as model, so responses can be matched to the selection.
+    """
+    if 'candidates' in model_info:
+        name = model_info.get('group') or model_info.get('model') or 'custom'
+        candidates = model_info['candidates']
+    elif model_info.get('group') or model_info.get('provider') == ROUTE_PROVIDER:
+        name = model_info.get('group') or model_info.get('model')
+        candidates = groups.get(name) or []
+    else:
+        return None
+    candidates = [candidate for candidate in map(parse_candidate, candidates) if candidate is not None]
+    return dict(model_info, provider=ROUTE_PROVIDER, model=name, group=name, candidates=candidates,
+                hedge=bool(model_info.get('hedge', HEDGE)))
+
+
+def selection_providers(selected_models):
+    """Every provider a list of selections may call"""
+    providers = []
+    for model_info in selected_models:
+        for candidate in model_info.get('candidates') or [model_info]:
+            if candidate['provider'] not in providers:
+                providers.append(candidate['provider'])
+    return providers
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * percent / 100.0), len(ordered) - 1)]
+
+
+class _ModelStats:
+    __slots__ = ('calls', 'ttft', 'total', 'tokens_per_s', 'errors', 'ttfts', 'totals')
+
+    def __init__(self, window):
+        self.calls = 0
+        # Rolling averages; None until a call of that kind has been seen
+        self.ttft = None
+        self.total = None
+        self.tokens_per_s = None
+        self.errors = 0.0
+        self.ttfts = deque(maxlen=window)
+        self.totals = deque(maxlen=window)
+
+
+class LatencyTracker:
+    """Rolling latency estimates per (provider, model), fed by every model call.
+
+    Streamed calls give time to first token and throughput after it;
+    complete() calls give the time to the whole answer. Each is kept as an
+    exponentially weighted average plus the last ``window`` samples for
+    percentiles, with a rolling error rate. A stream cancelled before its
+    first token only shows that its first token would have taken longer
+    than it ran. That bound is counted when it is above the current
+    average, so a candidate that keeps losing hedges late comes to look as
+    slow as it is. A backup cancelled soon after it started tells nothing
+    and is not counted. Estimates are per process and start empty.
+    """
+
+    def __init__(self, window=ROUTING_WINDOW, alpha=ROUTING_ALPHA, explore=ROUTING_EXPLORE):
+        self.window = window
+        self.alpha = alpha
+        self.explore = explore
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _average(self, current, value):
+        return value if current is None else current + self.alpha * (value - current)
+
+    def observe(self, provider, model, outcome, ttft, elapsed, chars):
+        """metrics.CALL_OBSERVERS hook"""
+        with self._lock:
+            stats = self._stats.get((provider, model))
+            if stats is None:
+                stats = self._stats[(provider, model)] = _ModelStats(self.window)
+            if outcome == 'cancelled':
+                # A hedge that lost or a client that left; before its first
+                # token it had taken at least this long
+                if ttft is None and (stats.ttft is None or elapsed <= stats.ttft):
+                    return
+                sample = elapsed if ttft is None else ttft
+                stats.ttfts.append(sample)
+                stats.ttft = self._average(stats.ttft, sample)
+                return
+            stats.calls += 1
+            stats.errors = self._average(stats.errors, 0.0 if outcome == 'ok' else 1.0)
+            if outcome != 'ok':
+                return
+            if ttft is None:
+                stats.totals.append(elapsed)
+                stats.total = self._average(stats.total, elapsed)
+                return
+            stats.ttfts.append(ttft)
+            stats.ttft = self._average(stats.ttft, ttft)
+            if chars >= THROUGHPUT_MIN_CHARS and elapsed > ttft:
+                stats.tokens_per_s = self._average(stats.tokens_per_s, (chars / 4.0) / (elapsed - ttft))
+
+    def estimate(self, provider, model):
+        """Expected seconds for an answer, None for an untried model"""
+        stats = self._stats.get((provider, model))
+        if stats is None or not stats.calls and stats.ttft is None:
+            return None
+        if stats.ttft is not None:
+            seconds = stats.ttft + (ROUTING_TOKENS / stats.tokens_per_s if stats.tokens_per_s else 0.0)
+        elif stats.total is not None:
+            seconds = stats.total
+        else:
+            # Only failures so far
+            return float('inf')
+        return seconds / (1.0 - min(stats.errors, 0.9))
+
+    def rank(self, candidates, available=None):
+        """Candidates best first: untried ones, then by estimate; unavailable ones last"""
+        def key(candidate):
+            estimate = self.estimate(candidate['provider'], candidate['model'])
+            down = available is not None and not available(candidate['provider'])
+            return down, estimate is not None, estimate or 0.0
+
+        with self._lock:
+            ranked = sorted(candidates, key=key)
+        if len(ranked) > 1 and random.random() < self.explore:
+            pick = random.randrange(1, len(ranked))
+            if available is None or available(ranked[pick]['provider']):
+                ranked.insert(0, ranked.pop(pick))
+        return ranked
+
+    def hedge_delay(self, provider, model, stream=True):
+        """Seconds to wait for a model before sending a backup: its HEDGE_PERCENTILE latency"""
+        with self._lock:
+            stats = self._stats.get((provider, model))
+            samples = list((stats.ttfts if stream else stats.totals) if stats else ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DELAY
+        return max(percentile(samples, HEDGE_PERCENTILE), HEDGE_MIN_DELAY)
+
+    def stats(self):
+        """Current estimates for every model seen, for /api/routing"""
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 1)
+
+        report = {}
+        with self._lock:
+            items = list(self._stats.items())
+        for (provider, model), stats in items:
+            estimate = self.estimate(provider, model)
+            report[f'{provider}/{model}'] = {
+                'calls': stats.calls,
+                'ttft_ms': ms(stats.ttft),
+                f'ttft_p{HEDGE_PERCENTILE:g}_ms': ms(percentile(stats.ttfts, HEDGE_PERCENTILE)) if stats.ttfts else None,
+                'total_ms': ms(stats.total),
+                f'total_p{HEDGE_PERCENTILE:g}_ms': ms(percentile(stats.totals, HEDGE_PERCENTILE)) if stats.totals else None,
+                'tokens_per_s': None if stats.tokens_per_s is None else round(stats.tokens_per_s, 1),
+                'error_rate': round(stats.errors, 3),
+                'estimate_ms': None if estimate is None or estimate == float('inf') else ms(estimate),
+            }
+        return report
+
+
+def _stop(pending, cancel):
+    """Drop queued calls and tell running ones to stop"""
+    for other in pending:
+        other.cancel()
+    cancel.set()
+
+
+def hedged_call(ranked, call, executor, timeout, delay=None):
+    """Answer with the first of ``ranked`` candidates to succeed.
+
+    ``call(candidate, cancel)`` runs on ``executor``, starting with the
+    first candidate. The next one is sent as soon as every call sent so far
+    has failed, and also, once, when ``delay`` seconds pass without an
+    answer. Returns (candidate, result, hedged); raises the last error when
+    every candidate fails or ``timeout`` passes. ``cancel`` is a
+    threading.Event set for every call that loses or is still running when
+    hedged_call returns; the call should stop soon after, freeing its
+    thread and its provider request.
+    """
+    started = time.monotonic()
+    hedge_at = started + delay if delay is not None else None
+    cancel = threading.Event()
+    pending = {}
+    sent = 0
+    error = None
+    while sent < len(ranked) or pending:
+        now = time.monotonic()
+        hedge = hedge_at is not None and now >= hedge_at
+        if hedge:
+            hedge_at = None
+        if (not pending or hedge) and sent < len(ranked):
+            pending[executor.submit(call, ranked[sent], cancel)] = ranked[sent]
+            sent += 1
+            continue
+        if not pending:
+            break
+        remaining = started + timeout - now
+        if remaining <= 0:
+            break
+        done, _ = wait(pending, timeout=min(remaining, hedge_at - now) if hedge_at is not None else remaining,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            candidate = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            _stop(pending, cancel)
+            return candidate, result, sent > 1
+    _stop(pending, cancel)
+    if pending or error is None:
+        candidate = ranked[0] if ranked else {'provider': ROUTE_PROVIDER}
+        raise ProviderError(candidate['provider'], 'timeout', f'Timed out after {timeout:g}s')
+    raise error
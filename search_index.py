@@ -0,0 +1,148 @@
+import os
+import re
+import html
+import sqlite3
+import threading
+
+# Marks around matched terms in FTS snippets, replaced by <mark> once the text is escaped
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+
+class SearchIndex:
+    """Full-text index over chat messages, chat titles and text notes.
+
+    Backed by SQLite FTS5. ``entries`` records what each indexed row is
+    (a message of a chat at a given position, a chat title or a note) and
+    ``docs`` holds the text under the same rowid, so rows can be replaced or
+    dropped by position without scanning the full-text table. Results are
+    ranked with bm25 and come with highlighted snippets.
+    """
+
+    def __init__(self, db_path='search.db'):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    role TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_doc ON entries (kind, doc_id, position)')
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(content, tokenize='unicode61')")
+
+    def _connect(self):
+        """Return this thread's connection to the index database"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _delete(conn, where, params):
+        ids = [(row[0],) for row in conn.execute(f'SELECT id FROM entries WHERE {where}', params)]
+        conn.executemany('DELETE FROM docs WHERE rowid = ?', ids)
+        conn.executemany('DELETE FROM entries WHERE id = ?', ids)
+
+    @staticmethod
+    def _insert(conn, kind, doc_id, position, role, content):
+        cursor = conn.execute('INSERT INTO entries (kind, doc_id, position, role) VALUES (?, ?, ?, ?)',
+                              (kind, doc_id, position, role))
+        conn.execute('INSERT INTO docs (rowid, content) VALUES (?, ?)', (cursor.lastrowid, content))
+
+    def index_messages(self, chat_id, messages, start=0):
+        """Index messages[start:] of a chat, replacing anything stored from start on"""
+        with self._connect() as conn:
+            self._delete(conn, "kind = 'message' AND doc_id = ? AND position >= ?", (chat_id, start))
+            for position in range(start, len(messages)):
+                message = messages[position]
+                self._insert(conn, 'message', chat_id, position, message['role'], message['content'])
+
+    def index_title(self, chat_id, title):
+        """Replace the indexed title of a chat"""
+        with self._connect() as conn:
+            self._delete(conn, "kind = 'title' AND doc_id = ?", (chat_id,))
+            if title:
+                self._insert(conn, 'title', chat_id, 0, None, title)
+
+    def index_note(self, filename, content):
+        """Replace the indexed content of a note"""
+        with self._connect() as conn:
+            self._delete(conn, "kind = 'note' AND doc_id = ?", (filename,))
+            self._insert(conn, 'note', filename, 0, None, content)
+
+    def remove_chat(self, chat_id):
+        with self._connect() as conn:
+            self._delete(conn, "kind IN ('message', 'title') AND doc_id = ?", (chat_id,))
+
+    def remove_note(self, filename):
+        with self._connect() as conn:
+            self._delete(conn, "kind = 'note' AND doc_id = ?", (filename,))
+
+    def is_empty(self):
+        return self._connect().execute('SELECT 1 FROM entries LIMIT 1').fetchone() is None
+
+    def rebuild(self, store, notes_dir):
+        """Re-index every chat in the store and every note in notes_dir"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM docs')
+        chats = 0
+        for chat_id in store.scan():
+            chat = store.load(chat_id, restore=False)
+            if chat is None:
+                continue
+            self.index_title(chat_id, chat.get('title'))
+            self.index_messages(chat_id, chat['messages'])
+            chats += 1
+        notes = 0
+        if os.path.exists(notes_dir):
+            for filename in os.listdir(notes_dir):
+                if filename.endswith('.txt'):
+                    with open(os.path.join(notes_dir, filename), 'r', encoding='utf-8', errors='replace') as f:
+                        self.index_note(filename, f.read())
+                    notes += 1
+        return {'chats': chats, 'notes': notes}
+
+    @staticmethod
+    def _match_query(query):
+        """Turn free text into an FTS5 query: every word must match, the last as a prefix"""
+        words = re.findall(r'\w+', query)
+        if not words:
+            return None
+        terms = [f'"{word}"' for word in words]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    @staticmethod
+    def _highlight(snippet):
+        """HTML for a snippet: the indexed text escaped, matches wrapped in <mark>"""
+        return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+    def search(self, query, limit=20, offset=0, kind=None):
+        """Return ranked matches with snippets, as HTML safe to insert into a page"""
+        match = self._match_query(query)
+        if match is None:
+            return []
+        sql = '''
+            SELECT entries.kind, entries.doc_id, entries.position, entries.role,
+                   snippet(docs, 0, ?, ?, '...', 24) AS snippet,
+                   bm25(docs) AS score
+            FROM docs JOIN entries ON entries.id = docs.rowid
+            WHERE docs MATCH ?
+        '''
+        params = [MATCH_START, MATCH_END, match]
+        if kind == 'chat':
+            sql += " AND entries.kind IN ('message', 'title')"
+        elif kind == 'note':
+            sql += " AND entries.kind = 'note'"
+        sql += ' ORDER BY score LIMIT ? OFFSET ?'
+        params += [int(limit), int(offset)]
+        return [dict(row, snippet=self._highlight(row['snippet'])) for row in self._connect().execute(sql, params)]
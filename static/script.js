@@ -1,18 +1,29 @@
+// Messages fetched per request when opening a chat or scrolling back
+const MESSAGE_PAGE_SIZE = 50;
+
 class ChatInterface {
     constructor() {
         this.currentChatId = null;
+        // Cursor for the next page of older messages in the open chat
+        this.olderCursor = null;
+        this.loadingOlder = false;
         this.credentials = {};
         this.isLoading = false;
         this.isMultiMode = false;
         this.selectedModels = [];
         this.uploadedFiles = [];
         this.currentNoteFilename = null;
+        // Sidebar lists keyed by id, and the change version each is current to
+        this.chats = new Map();
+        this.notes = new Map();
+        this.chatVersion = 0;
+        this.noteVersion = 0;
+        this.sidebarRenderPending = false;
         
         this.initializeElements();
         this.bindEvents();
         this.loadCredentials();
-        this.loadChatHistory();
-        this.loadNotes();
+        Promise.all([this.loadChatHistory(), this.loadNotes()]).then(() => this.subscribeChanges());
         this.initializeFromURL();
     }
     
@@ -289,14 +300,97 @@ class ChatInterface {
     
     async loadChatHistory() {
         try {
+            // Unchanged lists are revalidated with a 304 via the ETag
             const response = await fetch('/api/chats');
             const chats = await response.json();
+            this.chatVersion = Number(response.headers.get('X-Change-Version')) || 0;
+            this.chats = new Map(chats.map(chat => [chat.id, chat]));
             this.renderChatList(chats);
         } catch (error) {
             console.error('Error loading chat history:', error);
         }
     }
     
+    // Fetch only what changed in the chat list since it was loaded
+    async syncChats() {
+        try {
+            const response = await fetch(`/api/chats?since=${this.chatVersion}`);
+            this.applyDelta('chat', await response.json());
+        } catch (error) {
+            console.error('Error syncing chat history:', error);
+        }
+    }
+    
+    async syncNotes() {
+        try {
+            const response = await fetch(`/api/notes?since=${this.noteVersion}`);
+            this.applyDelta('note', await response.json());
+        } catch (error) {
+            console.error('Error syncing notes:', error);
+        }
+    }
+    
+    applyDelta(kind, delta) {
+        if (delta.reset) {
+            return kind === 'chat' ? this.loadChatHistory() : this.loadNotes();
+        }
+        delta.changes.forEach(change => this.applyChange(change));
+        if (kind === 'chat') {
+            this.chatVersion = Math.max(this.chatVersion, delta.version);
+        } else {
+            this.noteVersion = Math.max(this.noteVersion, delta.version);
+        }
+    }
+    
+    applyChange(change) {
+        const items = change.kind === 'chat' ? this.chats : this.notes;
+        const version = change.kind === 'chat' ? this.chatVersion : this.noteVersion;
+        if (change.version <= version) return;
+        if (change.op === 'delete' || !change.data) {
+            items.delete(change.id);
+        } else {
+            items.set(change.id, change.data);
+        }
+        if (change.kind === 'chat') {
+            this.chatVersion = change.version;
+        } else {
+            this.noteVersion = change.version;
+        }
+        this.scheduleSidebarRender();
+    }
+    
+    // Changes often arrive in bursts; redraw the lists once per frame
+    scheduleSidebarRender() {
+        if (this.sidebarRenderPending) return;
+        this.sidebarRenderPending = true;
+        requestAnimationFrame(() => {
+            this.sidebarRenderPending = false;
+            const chats = [...this.chats.values()]
+                .sort((a, b) => (b.updated_at || '').localeCompare(a.updated_at || ''));
+            this.renderChatList(chats);
+            const notes = [...this.notes.values()]
+                .sort((a, b) => (b.modified || '').localeCompare(a.modified || ''));
+            this.renderNotesList(notes);
+        });
+    }
+    
+    // Follow changes made in other tabs and by other clients. EventSource
+    // reconnects by itself and resumes from the last event id it saw.
+    subscribeChanges() {
+        if (!window.EventSource) return;
+        const since = Math.min(this.chatVersion, this.noteVersion);
+        const source = new EventSource(`/api/changes?since=${since}`);
+        source.onmessage = (event) => {
+            const change = JSON.parse(event.data);
+            if (change.op === 'reset') {
+                this.loadChatHistory();
+                this.loadNotes();
+                return;
+            }
+            this.applyChange(change);
+        };
+    }
+    
     renderChatList(chats) {
         this.chatList.innerHTML = '';
         
@@ -427,10 +521,11 @@ class ChatInterface {
     
     async loadChat(chatId) {
         try {
-            const response = await fetch(`/api/chat/${chatId}`);
+            const response = await fetch(`/api/chat/${chatId}?limit=${MESSAGE_PAGE_SIZE}`);
             const chat = await response.json();
             
             this.currentChatId = chatId;
+            this.olderCursor = chat.next_cursor;
             this.chatTitleInput.value = chat.title;
             this.folderInput.value = chat.folder_name || '';
             this.deleteChatBtn.style.display = 'block';
@@ -440,43 +535,88 @@ class ChatInterface {
             this.updateURL(chatId);
             this.showChatInterface();
             
+            // The latest messages come first; older ones load on scrolling up
+            this.messagesContainer.scrollTop = this.messagesContainer.scrollHeight;
+            this.fillWithOlderMessages();
+            
         } catch (error) {
             console.error('Error loading chat:', error);
         }
     }
     
+    async loadOlderMessages() {
+        if (!this.olderCursor || this.loadingOlder) {
+            return;
+        }
+        const chatId = this.currentChatId;
+        this.loadingOlder = true;
+        try {
+            const response = await fetch(`/api/chat/${chatId}?limit=${MESSAGE_PAGE_SIZE}&before=${this.olderCursor}`);
+            const chat = await response.json();
+            if (chatId !== this.currentChatId) {
+                return;
+            }
+            this.olderCursor = chat.next_cursor;
+            
+            // Render at the end, then move the new elements above the current
+            // first message, keeping what the user is looking at in place
+            const container = this.messagesContainer;
+            const firstMessage = container.firstChild;
+            const previousHeight = container.scrollHeight;
+            const elements = chat.messages.map(message => this.renderMessage(message));
+            elements.forEach(element => container.insertBefore(element, firstMessage));
+            container.scrollTop += container.scrollHeight - previousHeight;
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+        } finally {
+            this.loadingOlder = false;
+        }
+    }
+    
+    async fillWithOlderMessages() {
+        // Without a scrollbar there is no scroll event to trigger loading
+        const container = this.messagesContainer;
+        while (this.olderCursor && container.scrollHeight <= container.clientHeight) {
+            const cursor = this.olderCursor;
+            await this.loadOlderMessages();
+            if (this.olderCursor === cursor) {
+                break;
+            }
+        }
+    }
+    
     renderMessages(messages) {
         this.messagesContainer.innerHTML = '';
-        
-        messages.forEach(message => {
-            // Check if this is a multi-model response by looking for the separator
-            if (message.role === 'assistant' && message.content.includes('---')) {
-                // Try to parse as multi-model response
-                const parts = message.content.split('\n\n---\n\n');
-                if (parts.length > 1) {
-                    const responses = parts.map(part => {
-                        const match = part.match(/\*\*(.+?)\s-\s(.+?):\*\*\n([\s\S]+)/);
-                        if (match) {
-                            return {
-                                provider: match[1],
-                                model: match[2],
-                                response: match[3].trim(),
-                                success: !match[3].includes('Error:')
-                            };
-                        }
-                        return null;
-                    }).filter(r => r !== null);
-                    
-                    if (responses.length > 0) {
-                        this.addMessageToUI(message.role, null, true, responses);
-                        return;
+        messages.forEach(message => this.renderMessage(message));
+    }
+    
+    renderMessage(message) {
+        // Check if this is a multi-model response by looking for the separator
+        if (message.role === 'assistant' && message.content.includes('---')) {
+            // Try to parse as multi-model response
+            const parts = message.content.split('\n\n---\n\n');
+            if (parts.length > 1) {
+                const responses = parts.map(part => {
+                    const match = part.match(/\*\*(.+?)\s-\s(.+?):\*\*\n([\s\S]+)/);
+                    if (match) {
+                        return {
+                            provider: match[1],
+                            model: match[2],
+                            response: match[3].trim(),
+                            success: !match[3].includes('Error:')
+                        };
                     }
+                    return null;
+                }).filter(r => r !== null);
+                
+                if (responses.length > 0) {
+                    return this.addMessageToUI(message.role, null, true, responses);
                 }
             }
-            
-            // Regular single response
-            this.addMessageToUI(message.role, message.content);
-        });
+        }
+        
+        // Regular single response
+        return this.addMessageToUI(message.role, this.withAttachmentNames(message.content, message.attachments));
     }
     
     addMessageToUI(role, content, isMulti = false, responses = null) {
@@ -545,6 +685,7 @@ class ChatInterface {
         }
         
         this.messagesContainer.appendChild(messageDiv);
+        return messageDiv;
     }
     
     updateActiveChatItem(chatId) {
@@ -560,6 +701,7 @@ class ChatInterface {
     
     startNewChat() {
         this.currentChatId = null;
+        this.olderCursor = null;
         this.chatTitleInput.value = 'New Chat';
         this.folderInput.value = '';
         this.deleteChatBtn.style.display = 'none';
@@ -587,7 +729,7 @@ class ChatInterface {
                 });
                 
                 this.startNewChat();
-                this.loadChatHistory();
+                this.syncChats();
                 
             } catch (error) {
                 console.error('Error deleting chat:', error);
@@ -600,7 +742,7 @@ class ChatInterface {
         
         if (!message || this.isLoading) return;
         
-        const messageWithFiles = this.getMessageWithFiles(message);
+        const attachments = this.uploadedFiles.map(file => ({ id: file.id, name: file.name }));
         
         // Check if we have selected models
         let selectedModels = [];
@@ -624,20 +766,21 @@ class ChatInterface {
         }
         
         // Add user message to UI
-        this.addMessageToUI('user', message);
+        this.addMessageToUI('user', this.withAttachmentNames(message, attachments));
         this.messageInput.value = '';
         this.uploadedFiles = [];
         this.renderUploadedFiles();
         this.adjustTextareaHeight();
         
         // Start streaming response
-        this.streamResponse(messageWithFiles, selectedModels);
+        this.streamResponse(message, selectedModels, attachments);
     }
     
-    streamResponse(message, selectedModels) {
+    streamResponse(message, selectedModels, attachments = []) {
         const folderName = this.folderInput.value.trim() || null;
         const requestBody = {
             message: message,
+            attachments: attachments,
             chat_id: this.currentChatId,
             folder_name: folderName,
             selected_models: selectedModels
@@ -707,47 +850,70 @@ class ChatInterface {
             }
         }
         
-        // Start EventSource for streaming
-        fetch('/api/chat/stream', {
+        // The turn runs as a server-side job; if the connection drops, the
+        // stream is resumed from the last event received
+        const stream = { jobId: null, lastEventId: null, finished: false, retries: 0 };
+        const request = fetch('/api/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify(requestBody)
-        })
-        .then(response => {
+        });
+        this.readEventStream(request, stream, responseDiv, selectedModels);
+    }
+    
+    readEventStream(request, stream, responseDiv, selectedModels) {
+        request.then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
+            stream.jobId = response.headers.get('X-Job-Id') || stream.jobId;
             
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
+            let buffer = '';
             
             const readStream = () => {
                 reader.read().then(({ done, value }) => {
                     if (done) {
-                        this.finishStreaming(responseDiv, selectedModels);
+                        this.resumeEventStream(stream, null, responseDiv, selectedModels);
                         return;
                     }
                     
-                    const chunk = decoder.decode(value);
-                    const lines = chunk.split('\n');
+                    // Events can be split across chunks; keep the incomplete tail
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split('\n\n');
+                    buffer = events.pop();
                     
-                    lines.forEach(line => {
-                        if (line.startsWith('data: ')) {
-                            try {
-                                const data = JSON.parse(line.slice(6));
-                                this.handleStreamData(data, responseDiv, selectedModels);
-                            } catch (e) {
-                                console.error('Error parsing stream data:', e);
+                    events.forEach(block => {
+                        let payload = null;
+                        block.split('\n').forEach(line => {
+                            if (line.startsWith('id: ')) {
+                                stream.lastEventId = line.slice(4);
+                            } else if (line.startsWith('data: ')) {
+                                payload = line.slice(6);
+                            }
+                        });
+                        if (payload === null) {
+                            return;
+                        }
+                        try {
+                            const data = JSON.parse(payload);
+                            if (data.type === 'done' || data.type === 'error') {
+                                stream.finished = true;
                             }
+                            this.handleStreamData(data, responseDiv, selectedModels);
+                        } catch (e) {
+                            console.error('Error parsing stream data:', e);
                         }
                     });
+                    stream.retries = 0;
                     
                     readStream();
                 }).catch(error => {
                     console.error('Stream reading error:', error);
-                    this.handleStreamError(error, responseDiv);
+                    this.resumeEventStream(stream, error, responseDiv, selectedModels);
                 });
             };
             
@@ -755,10 +921,30 @@ class ChatInterface {
         })
         .catch(error => {
             console.error('Streaming error:', error);
-            this.handleStreamError(error, responseDiv);
+            this.resumeEventStream(stream, error, responseDiv, selectedModels);
         });
     }
     
+    resumeEventStream(stream, error, responseDiv, selectedModels) {
+        if (stream.finished) {
+            return;
+        }
+        if (stream.jobId && stream.retries < 5) {
+            stream.retries++;
+            const headers = stream.lastEventId ? { 'Last-Event-ID': stream.lastEventId } : {};
+            setTimeout(() => {
+                const request = fetch(`/api/jobs/${stream.jobId}/events`, { headers });
+                this.readEventStream(request, stream, responseDiv, selectedModels);
+            }, 1000 * stream.retries);
+            return;
+        }
+        if (error) {
+            this.handleStreamError(error, responseDiv);
+        } else {
+            this.finishStreaming(responseDiv, selectedModels);
+        }
+    }
+    
     handleStreamData(data, responseDiv, selectedModels) {
         switch (data.type) {
             case 'chat_id':
@@ -770,6 +956,13 @@ class ChatInterface {
                 }
                 break;
                 
+            case 'reset':
+                // The server restarted and is running the turn again from the start
+                responseDiv.querySelectorAll('.message-content, .model-response-content').forEach(div => {
+                    div.textContent = '';
+                });
+                break;
+                
             case 'content':
                 // Single model content
                 const contentDiv = responseDiv.querySelector('.message-content');
@@ -787,6 +980,14 @@ class ChatInterface {
                 }
                 break;
                 
+            case 'routed':
+                // A model group selection is being answered by one of its models
+                const routedModelDiv = responseDiv.querySelector(`[data-provider="${data.provider}"][data-model="${data.model}"]`);
+                if (routedModelDiv) {
+                    routedModelDiv.querySelector('.model-name').textContent = `${data.routed_provider} - ${data.routed_model}`;
+                }
+                break;
+
             case 'model_content':
                 const targetModelDiv = responseDiv.querySelector(`[data-provider="${data.provider}"][data-model="${data.model}"]`);
                 if (targetModelDiv) {
@@ -826,7 +1027,9 @@ class ChatInterface {
                 break;
                 
             case 'error':
-                this.handleStreamError(new Error(data.error), responseDiv);
+                // Failed turns are not saved, so a retryable error can simply be sent again
+                const errorText = data.retryable ? `${data.error} (temporary, please try again)` : data.error;
+                this.handleStreamError(new Error(errorText), responseDiv);
                 break;
         }
     }
@@ -869,7 +1072,7 @@ class ChatInterface {
         
         // Refresh chat list if this was a new chat
         if (this.currentChatId) {
-            this.loadChatHistory();
+            this.syncChats();
         }
     }
     
@@ -932,6 +1135,9 @@ class ChatInterface {
     
     handleScroll() {
         const container = this.messagesContainer;
+        if (container.scrollTop < 200 && this.olderCursor) {
+            this.loadOlderMessages();
+        }
         const isAtBottom = container.scrollTop + container.clientHeight >= container.scrollHeight - 50;
         
         if (isAtBottom) {
@@ -1022,14 +1228,12 @@ class ChatInterface {
         });
     }
     
-    getMessageWithFiles(message) {
-        if (this.uploadedFiles.length === 0) return message;
-        
-        const fileContents = this.uploadedFiles.map(file => 
-            `\n\n--- File: ${file.name} ---\n${file.content}`
-        ).join('');
+    withAttachmentNames(message, attachments) {
+        // Attachments are stored server-side; the chat only shows their names
+        if (!attachments || attachments.length === 0) return message;
         
-        return message + fileContents;
+        const names = attachments.map(file => `📎 ${file.name}`).join('\n');
+        return `${message}\n\n${names}`;
     }
     
 
@@ -1101,7 +1305,7 @@ class ChatInterface {
                 body: JSON.stringify({ folder_name: folderName })
             });
             
-            this.loadChatHistory();
+            this.syncChats();
         } catch (error) {
             console.error('Error updating chat folder:', error);
         }
@@ -1121,7 +1325,7 @@ class ChatInterface {
                 body: JSON.stringify({ title: title })
             });
             
-            this.loadChatHistory();
+            this.syncChats();
         } catch (error) {
             console.error('Error updating chat title:', error);
         }
@@ -1186,6 +1390,8 @@ class ChatInterface {
         try {
             const response = await fetch('/api/notes');
             const notes = await response.json();
+            this.noteVersion = Number(response.headers.get('X-Change-Version')) || 0;
+            this.notes = new Map(notes.map(note => [note.filename, note]));
             this.renderNotesList(notes);
         } catch (error) {
             console.error('Error loading notes:', error);
@@ -1253,7 +1459,7 @@ class ChatInterface {
             const result = await response.json();
             if (result.success) {
                 this.currentNoteFilename = result.filename;
-                this.loadNotes();
+                this.syncNotes();
             } else {
                 alert('Error saving note: ' + result.error);
             }
@@ -1276,7 +1482,7 @@ class ChatInterface {
         if (confirm('Are you sure you want to delete this note?')) {
             try {
                 await fetch(`/api/notes/${this.currentNoteFilename}`, { method: 'DELETE' });
-                this.loadNotes();
+                this.syncNotes();
                 this.createNewNote();
             } catch (error) {
                 console.error('Error deleting note:', error);
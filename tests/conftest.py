@@ -0,0 +1,73 @@
+"""Shared fixtures: a mock provider on a local port and the app running in a scratch directory"""
+import os
+import sys
+import asyncio
+import threading
+
+import pytest
+from aiohttp import web
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+
+from common import free_port, write_credentials
+from mock_provider import MockProvider
+
+# Settings the app reads at import time
+os.environ.setdefault('QUERYQUEST_ARCHIVE_DAYS', '0')
+os.environ.setdefault('QUERYQUEST_RETRIEVAL', '0')
+os.environ.setdefault('QUERYQUEST_RETRY_BASE', '0.01')
+
+MOCK_DEFAULTS = {'latency': 0.01, 'tokens': 5, 'token_delay': 0.0, 'fail_rate': 0.0, 'fail_status': 503,
+                 'break_rate': 0.0}
+
+
+@pytest.fixture(scope='session')
+def mock_server():
+    """A MockProvider serving on its own event loop thread; yields (mock, port)"""
+    mock = MockProvider(**MOCK_DEFAULTS)
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(mock.create_app())
+
+    async def start():
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+
+    loop.run_until_complete(start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield mock, port
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+
+
+@pytest.fixture
+def mock(mock_server):
+    """The mock provider, reset to fast defaults for each test"""
+    provider, _ = mock_server
+    for name, value in MOCK_DEFAULTS.items():
+        setattr(provider, name, value)
+    provider.last_body = None
+    return provider
+
+
+@pytest.fixture(scope='session')
+def app_module(mock_server, tmp_path_factory):
+    """The app module, imported with a scratch directory as its working directory"""
+    workdir = tmp_path_factory.mktemp('app')
+    write_credentials(str(workdir), mock_server[1])
+    previous = os.getcwd()
+    os.chdir(workdir)
+    import app
+    yield app
+    if isinstance(app.store, app.HotChatCache):
+        app.store.flush()
+    os.chdir(previous)
+
+
+@pytest.fixture
+def client(app_module, mock):
+    return app_module.app.test_client()
@@ -0,0 +1,77 @@
+import os
+import time
+
+import archive
+from archive import ChatArchive, FILE_MARKER
+from chat_store import ChatStore
+
+
+def age(store, chat_id, days):
+    """Make a chat's files look untouched for ``days`` days"""
+    old = time.time() - days * 86400
+    for suffix in ChatStore.SUFFIXES:
+        path = os.path.join(store.history_dir, chat_id + suffix)
+        if os.path.exists(path):
+            os.utime(path, (old, old))
+
+
+def pasted(text):
+    return 'see this' + FILE_MARKER + 'notes.txt ---\n' + text
+
+
+def test_idle_chats_are_archived_and_restored_on_load(tmp_path):
+    store = ChatStore(str(tmp_path))
+    messages = [{'role': 'user', 'content': pasted('x' * 5000)}, {'role': 'assistant', 'content': 'ok'}]
+    store.save('old', messages, 'Old', None)
+    store.save('new', messages, 'New', None)
+    age(store, 'old', 40)
+
+    report = store.archive_idle(30)
+    assert report['chats'] == 1
+    assert report['bytes_after'] < report['bytes_before']
+    assert not os.path.exists(tmp_path / 'old.json')
+    assert store.exists('old') and 'old' in store.scan()
+    # Reading without restoring leaves it archived
+    assert store.load('old', restore=False)['messages'] == messages
+    assert store.archive.has('old')
+
+    assert store.load('old')['messages'] == messages
+    assert os.path.exists(tmp_path / 'old.json')
+    assert not store.archive.has('old')
+
+
+def test_archived_branches_come_back(tmp_path):
+    store = ChatStore(str(tmp_path))
+    store.save('c', [{'role': 'user', 'content': 'q1'}, {'role': 'assistant', 'content': 'a1'}], 'C', None)
+    forked = store.fork('c', 0)
+    store.save('c', forked['messages'] + [{'role': 'user', 'content': 'other'}], 'C', None, base=0)
+    age(store, 'c', 40)
+    store.archive_idle(30)
+    assert [branch['preview'] for branch in store.branches('c') if not branch['active']] == ['q1']
+
+
+def test_repeated_blocks_are_stored_once(tmp_path):
+    chats = ChatArchive(str(tmp_path))
+    block = 'y' * 5000
+    for chat_id in 'ab':
+        chat = {'id': chat_id, 'messages': [{'role': 'user', 'content': pasted(block)}]}
+        chats.put(chat_id, chat, [], 0, 10000)
+    assert chats.stats()['blobs'] == 1
+    assert chats.get('b')[0]['messages'][0]['content'] == pasted(block)
+
+
+def test_vacuum_reclaims_removed_chats(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, 'BLOB_MIN_CHARS', 100)
+    chats = ChatArchive(str(tmp_path))
+    for n in range(4):
+        chats.put(f'c{n}', {'id': f'c{n}', 'messages': [{'role': 'user', 'content': pasted(str(n) * 3000)}]},
+                  [], 0, 10000)
+    assert chats.vacuum() == 0
+    for n in range(3):
+        chats.remove(f'c{n}')
+    before = chats.stats()['stored_bytes']
+    reclaimed = chats.vacuum()
+    assert reclaimed > 0 and chats.stats()['stored_bytes'] == before - reclaimed
+    assert chats.stats()['blobs'] == 1
+    assert chats.get('c3')[0]['messages'][0]['content'] == pasted('3' * 3000)
+    assert chats.get('c0') is None
@@ -0,0 +1,137 @@
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+
+@pytest.fixture
+def serve(app_module, mock):
+    """Run ``scenario(client)`` against the asyncio server; returns its result"""
+    import async_server
+
+    def run(scenario):
+        async def main():
+            async with TestClient(TestServer(async_server.create_app())) as client:
+                return await scenario(client)
+        return asyncio.run(main())
+    return run
+
+
+def events(body):
+    return [json.loads(line[6:]) for line in body.splitlines() if line.startswith('data: ')]
+
+
+async def next_event(response):
+    """The next data line of an open SSE response"""
+    line = await response.content.readline()
+    while not line.startswith(b'data: '):
+        line = await response.content.readline()
+    return json.loads(line[6:])
+
+
+def test_stream_and_bridged_routes(serve):
+    async def scenario(client):
+        response = await client.post('/api/chat/stream', json={'message': 'hello', 'provider': 'openai',
+                                                                'model': 'm'})
+        body = await response.text()
+        chat_id = events(body)[0]['chat_id']
+        chat = await client.get(f'/api/chat/{chat_id}')
+        return body, await chat.json()
+
+    body, chat = serve(scenario)
+    kinds = [event['type'] for event in events(body)]
+    assert kinds[0] == 'chat_id' and kinds[-1] == 'done'
+    assert ''.join(event['content'] for event in events(body) if event['type'] == 'content').startswith('m-token0')
+    assert [message['role'] for message in chat['messages']] == ['user', 'assistant']
+
+
+def test_blocking_model_setup_runs_off_the_event_loop(serve, monkeypatch):
+    import async_server
+    threads = []
+    resolve = async_server.resolve_model_call
+    put = async_server.response_cache.put
+
+    def record(func):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return func(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(async_server, 'resolve_model_call', record(resolve))
+    monkeypatch.setattr(async_server.response_cache, 'put', record(put))
+
+    async def scenario(client):
+        loop_thread = threading.current_thread()
+        response = await client.post('/api/chat/stream', json={'message': 'off loop', 'provider': 'openai',
+                                                                'model': 'm', 'use_cache': True})
+        await response.text()
+        return loop_thread
+
+    loop_thread = serve(scenario)
+    assert len(threads) == 2
+    assert loop_thread not in threads
+
+
+def test_turn_is_saved_after_the_client_disconnects(serve, mock):
+    mock.tokens = 20
+    mock.token_delay = 0.02
+
+    async def scenario(client):
+        response = await client.post('/api/chat/stream', json={'message': 'keep going', 'provider': 'openai',
+                                                                'model': 'm'})
+        job_id = response.headers['X-Job-Id']
+        chat_id = (await next_event(response))['chat_id']
+        response.close()
+        for _ in range(100):
+            chat = await (await client.get(f'/api/chat/{chat_id}')).json()
+            if len(chat.get('messages', ())) == 2:
+                break
+            await asyncio.sleep(0.05)
+        resumed = await client.get(f'/api/jobs/{job_id}/events', headers={'Last-Event-ID': '1.1'})
+        return chat, resumed.headers['X-Job-Id'] == job_id, await resumed.text()
+
+    chat, same_job, body = serve(scenario)
+    assert [message['role'] for message in chat['messages']] == ['user', 'assistant']
+    assert chat['messages'][1]['content'].startswith('m-token0')
+    assert same_job
+    assert 'chat_id' not in body and body.startswith('id: 1.2\n')
+    assert events(body)[-1]['type'] == 'done'
+
+
+def test_change_feeds_do_not_hold_bridge_threads(serve, monkeypatch):
+    import async_server
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(async_server, 'wsgi_executor', executor)
+
+    async def scenario(client):
+        feeds = [await client.get('/api/changes') for _ in range(4)]
+        version = int((await client.get('/api/chats')).headers['X-Change-Version'])
+        created = await asyncio.wait_for(client.post('/api/chat', json={'message': 'fed', 'provider': 'openai',
+                                                                        'model': 'm'}), 5)
+        chat_id = (await created.json())['chat_id']
+        seen = [await asyncio.wait_for(next_event(feed), 5) for feed in feeds]
+        for feed in feeds:
+            feed.close()
+        resumed = await client.get('/api/changes', headers={'Last-Event-ID': str(version)})
+        replayed = await asyncio.wait_for(next_event(resumed), 5)
+        resumed.close()
+        return chat_id, seen, replayed
+
+    try:
+        chat_id, seen, replayed = serve(scenario)
+    finally:
+        executor.shutdown(wait=False)
+    assert {(change['id'], change['op']) for change in seen} == {(chat_id, 'upsert')}
+    assert (replayed['id'], replayed['op']) == (chat_id, 'upsert')
+
+
+def test_unknown_job_and_invalid_version(serve):
+    async def scenario(client):
+        job = await client.get('/api/jobs/missing/events')
+        feed = await client.get('/api/changes?since=soon')
+        return job.status, await job.json(), feed.status
+
+    assert serve(scenario) == (404, {'error': 'Job not found'}, 400)
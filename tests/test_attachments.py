@@ -0,0 +1,60 @@
+import io
+
+import pytest
+
+import attachments as attachments_module
+from attachments import AttachmentStore, AttachmentTooLarge
+
+
+def test_files_are_stored_once_in_line_aligned_chunks(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    data = ''.join(f'line {n} ' + 'x' * 50 + '\n' for n in range(1000)).encode('utf-8')
+    first = store.ingest(io.BytesIO(data), 'a.txt')
+    second = store.ingest(io.BytesIO(data), 'b.txt')
+    assert first['id'] == second['id'] and second['name'] == 'b.txt'
+    assert sorted(p.name for p in tmp_path.iterdir()) == [first['id'], first['id'] + '.json']
+    assert first['encoding'] == 'utf-8' and len(first['chunks']) > 1
+    texts = [store.read_chunk(first['id'], index) for index in range(len(first['chunks']))]
+    assert all(text.endswith('\n') for text in texts)
+    assert ''.join(texts).encode('utf-8') == data
+
+
+def test_undecodable_files_fall_back_to_latin1(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    handle = store.ingest(io.BytesIO('café'.encode('latin-1')), 'old.txt')
+    assert handle['encoding'] == 'latin-1'
+    assert store.read_text(handle['id']) == 'café'
+
+
+def test_oversized_upload_is_rejected_and_cleaned_up(tmp_path):
+    store = AttachmentStore(str(tmp_path), max_bytes=100)
+    with pytest.raises(AttachmentTooLarge):
+        store.ingest(io.BytesIO(b'x' * 1000), 'big.txt')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_expand_inlines_referenced_text_within_the_budget(tmp_path, monkeypatch):
+    store = AttachmentStore(str(tmp_path))
+    data = ('y' * 99 + '\n') * 2000
+    info = store.ingest(io.BytesIO(data.encode('utf-8')), 'big.txt')
+    ref = store.reference(info, 'big.txt')
+    assert ref['tokens'] == attachments_module.ATTACHMENT_TOKENS
+    expanded = store.expand([{'role': 'user', 'content': 'see file', 'attachments': [ref]}])
+    content = expanded[0]['content']
+    assert content.startswith('see file\n\n--- File: big.txt ---\n')
+    assert 'more part(s) of this file omitted' in content
+    assert len(content) < len(data)
+    skipped = store.reference(info, 'big.txt', inline=False)
+    assert store.expand([{'role': 'user', 'content': 'q', 'attachments': [skipped]}])[0]['content'] == 'q'
+
+
+def test_upload_and_send_with_attachment(client, mock):
+    upload = client.post('/api/upload', data={'files': (io.BytesIO(b'attached words\n'), 'notes.txt')},
+                         content_type='multipart/form-data').get_json()['files'][0]
+    assert client.get(f"/api/attachments/{upload['id']}?chunk=0").get_json()['content'] == 'attached words\n'
+    data = client.post('/api/chat', json={'message': 'read this', 'provider': 'openai', 'model': 'm',
+                                          'attachments': [{'id': upload['id'], 'name': 'notes.txt'}]}).get_json()
+    assert 'attached words' in mock.last_body['messages'][-1]['content']
+    chat = client.get(f"/api/chat/{data['chat_id']}").get_json()
+    assert chat['messages'][0]['attachments'][0]['id'] == upload['id']
+    assert 'attached words' not in chat['messages'][0]['content']
@@ -0,0 +1,94 @@
+import json
+import time
+import threading
+
+import pytest
+
+from batch import BatchRun, read_items, parse_models
+
+
+def test_items_are_read_with_defaults():
+    lines = ['{"message": "hi"}', '', '{"id": "x", "messages": [{"role": "user", "content": "q"}], '
+             '"system": "Be brief", "provider": "anthropic", "model": "b"}']
+    items = read_items(lines, parse_models('openai/a, bad'))
+    assert items[0] == {'id': '1', 'messages': [{'role': 'user', 'content': 'hi'}],
+                        'models': [{'provider': 'openai', 'model': 'a'}]}
+    assert items[1]['messages'][0] == {'role': 'system', 'content': 'Be brief'}
+    assert items[1]['models'] == [{'provider': 'anthropic', 'model': 'b'}]
+    for bad in (['{"message": "a", "id": 1}', '{"message": "b", "id": 1}'], ['{"message": "a"}'], ['[]'], ['{']):
+        with pytest.raises(ValueError, match='Line'):
+            read_items(bad)
+    models = parse_models('openai/a')
+    for bad in ({'messages': 'hi'}, {'messages': []}, {'messages': [{'role': 'user', 'content': 3}]},
+                {'message': 'hi', 'system': ['x']}, {'message': 'hi', 'models': ['openai/a']},
+                {'message': 'hi', 'models': [{'provider': 'openai'}]}, {'message': 'hi', 'models': {'a': 1}}):
+        with pytest.raises(ValueError, match='Line 1'):
+            read_items([json.dumps(bad)], models)
+
+
+def test_an_item_that_cannot_be_sent_is_recorded_as_failed(tmp_path):
+    output = str(tmp_path / 'out.jsonl')
+    items = [{'id': 'bad', 'messages': [{'role': 'user', 'content': 5}], 'models': parse_models('openai/a')}]
+    report = BatchRun(items, output, lambda *args: 'never').run()
+    assert (report['status'], report['failed']) == ('done', 1)
+    with open(output, encoding='utf-8') as f:
+        assert json.loads(f.read())['success'] is False
+
+
+def test_app_batch_rejects_malformed_lines(client):
+    body = json.dumps({'messages': [{'role': 'user', 'content': None}]})
+    response = client.post('/api/batch?models=openai/m', data=body)
+    assert response.status_code == 400
+    assert 'messages' in response.get_json()['error']
+    response = client.post('/api/batch', data=json.dumps({'message': 'hi', 'models': [{'model': 'm'}]}))
+    assert response.status_code == 400
+
+
+def test_run_writes_answers_and_resumes(tmp_path):
+    output = str(tmp_path / 'out.jsonl')
+    items = read_items([json.dumps({'id': str(n), 'message': f'q{n}'}) for n in range(6)],
+                       parse_models('openai/a,anthropic/b'))
+    active = {'openai': 0, 'anthropic': 0}
+    peak = {'openai': 0, 'anthropic': 0}
+    lock = threading.Lock()
+    fail = {'3'}
+
+    def call(provider, model, messages, timeout):
+        with lock:
+            active[provider] += 1
+            peak[provider] = max(peak[provider], active[provider])
+        time.sleep(0.02)
+        with lock:
+            active[provider] -= 1
+        if provider == 'openai' and messages[0]['content'] == 'q3' and fail:
+            raise RuntimeError('boom')
+        return f"{model}: {messages[0]['content']}"
+
+    report = BatchRun(items, output, call, limit=lambda provider: 2).run()
+    assert (report['status'], report['succeeded'], report['failed'], report['remaining']) == ('done', 11, 1, 0)
+    assert peak == {'openai': 2, 'anthropic': 2}
+
+    fail.clear()
+    report = BatchRun(items, output, call).run()
+    assert (report['skipped'], report['succeeded'], report['failed']) == (11, 1, 0)
+    with open(output, encoding='utf-8') as f:
+        answers = {(r['id'], r['provider']): r['response'] for r in map(json.loads, f) if r['success']}
+    assert len(answers) == 12 and answers[('3', 'openai')] == 'a: q3'
+
+
+def test_app_batch_keeps_the_system_prompt(client, mock):
+    body = '\n'.join([json.dumps({'id': 'sys', 'system': 'Answer in French', 'message': 'hello'})])
+    created = client.post('/api/batch?models=openai/m', data=body)
+    assert created.status_code == 202
+    batch_id = created.get_json()['id']
+    for _ in range(100):
+        report = client.get(f'/api/batch/{batch_id}').get_json()
+        if report['status'] == 'done':
+            break
+        time.sleep(0.02)
+    assert report['succeeded'] == 1
+    sent = mock.last_body['messages']
+    assert {'role': 'system', 'content': 'Answer in French'} in sent
+    assert sent[-1] == {'role': 'user', 'content': 'hello'}
+    result = json.loads(client.get(f'/api/batch/{batch_id}/results').get_data(as_text=True))
+    assert result['id'] == 'sys' and result['response'].startswith('m-token0')
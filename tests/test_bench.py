@@ -0,0 +1,47 @@
+import pytest
+
+from compare import compare
+from harness import seed_chats
+from chat_store import ChatStore
+from providers import OpenAIProvider, AnthropicProvider
+from resilience import ProviderError
+
+
+def run(results):
+    return {'meta': {'label': 'x'}, 'results': results}
+
+
+def test_compare_flags_regressions_past_the_threshold():
+    baseline = run({'chat': {'throughput_rps': 100.0, 'latency_p99_ms': 50.0, 'errors': 0},
+                    'chats': {'throughput_rps': 10.0}})
+    candidate = run({'chat': {'throughput_rps': 95.0, 'latency_p99_ms': 60.0, 'errors': 0}})
+    rows, regressions = compare(baseline, candidate, threshold=10.0)
+    assert regressions == [('chat', 'latency_p99_ms')]
+    assert len(rows) == 3
+
+
+def test_seeded_chats_load(tmp_path):
+    chat_ids = seed_chats(str(tmp_path), 3, 4)
+    store = ChatStore(str(tmp_path / 'chat_history'))
+    assert sorted(store.scan()) == chat_ids
+    assert len(store.load(chat_ids[0])['messages']) == 4
+
+
+def test_mock_injects_failures_and_broken_streams(mock, mock_server):
+    base = f'http://127.0.0.1:{mock_server[1]}'
+    openai = {'api_key': 'k', 'base_url': f'{base}/v1/chat/completions'}
+    anthropic = {'api_key': 'k', 'base_url': f'{base}/v1/messages'}
+    messages = [{'role': 'user', 'content': 'hi'}]
+    mock.tokens = 10
+    mock.break_rate = 1.0
+    for adapter, config in ((AnthropicProvider(), anthropic), (OpenAIProvider(), openai)):
+        with pytest.raises(ProviderError) as raised:
+            list(adapter.stream(messages, 'm', config))
+        assert raised.value.code == 'stream_interrupted'
+
+    mock.break_rate = 0.0
+    mock.fail_rate = 1.0
+    mock.fail_status = 400
+    with pytest.raises(ProviderError) as raised:
+        OpenAIProvider().complete(messages, 'm', openai)
+    assert raised.value.status == 400
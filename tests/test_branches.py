@@ -0,0 +1,78 @@
+import pytest
+
+from chat_store import ChatStore, SqliteChatStore
+
+
+def turn(question, answer):
+    return [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+
+
+@pytest.fixture(params=['files', 'sqlite'])
+def store(request, tmp_path):
+    return ChatStore(str(tmp_path)) if request.param == 'files' else SqliteChatStore(str(tmp_path))
+
+
+def test_fork_keeps_the_old_branch_and_switch_brings_it_back(store):
+    original = turn('q1', 'a1') + turn('q2', 'a2')
+    store.save('c', original, 'Title', None)
+    forked = store.fork('c', 2)
+    assert forked['messages'] == original[:2] and forked['appended_from'] == 2
+    store.save('c', forked['messages'] + turn('q2 again', 'b2'), 'Title', None, base=2)
+
+    branches = store.branches('c')
+    assert [branch['active'] for branch in branches] == [True, False]
+    inactive = branches[1]
+    assert (inactive['fork_at'], inactive['length'], inactive['preview']) == (2, 4, 'q2')
+
+    switched = store.switch('c', inactive['id'])
+    assert switched['appended_from'] == 2
+    assert store.load('c')['messages'] == original
+    back = [branch for branch in store.branches('c') if not branch['active']][0]
+    assert back['preview'] == 'q2 again'
+
+
+
+def test_branch_preview_of_a_message_without_text(store):
+    store.save('c', turn('q1', 'a1') + [{'role': 'user', 'content': None}, {'role': 'assistant'}], 'Title', None)
+    forked = store.fork('c', 2)
+    store.save('c', forked['messages'] + turn('q2', 'a2'), 'Title', None, base=2)
+    assert store.branches('c')[1]['preview'] == ''
+
+def test_node_ids_depend_on_the_whole_prefix(store):
+    a = store.node_ids(turn('q', 'a') + turn('same', 'same'))
+    b = store.node_ids(turn('q', 'other') + turn('same', 'same'))
+    assert a[0] == b[0] and a[1] != b[1] and a[3] != b[3]
+    assert store.node_ids([{'role': 'user', 'content': 'x', 'tokens': 3}]) == store.node_ids(
+        [{'role': 'user', 'content': 'x'}])
+
+
+def test_repeated_forks_store_each_message_once(tmp_path):
+    store = ChatStore(str(tmp_path))
+    store.save('c', turn('q1', 'a1') + turn('q2', 'a2'), 'Title', None)
+    for _ in range(3):
+        store.fork('c', 2)
+        store.switch('c', [branch for branch in store.branches('c') if not branch['active']][0]['id'])
+    assert len((tmp_path / 'c.nodes').read_text().splitlines()) == 2
+
+
+def test_bad_fork_points_and_unknown_branches(store):
+    store.save('c', turn('q1', 'a1'), 'Title', None)
+    with pytest.raises(ValueError):
+        store.fork('c', 5)
+    assert store.switch('c', 'nope') is None
+    assert store.fork('missing', 0) is None
+    assert store.branches('missing') is None
+
+
+def test_branch_routes(client):
+    chat_id = client.post('/api/chat', json={'message': 'first', 'provider': 'openai',
+                                             'model': 'm'}).get_json()['chat_id']
+    for at in ('x', True, False):
+        assert client.post(f'/api/chat/{chat_id}/fork', json={'at': at}).status_code == 400
+    branches = client.post(f'/api/chat/{chat_id}/fork', json={'at': 0}).get_json()['branches']
+    assert branches[1]['preview'] == 'first'
+    client.post('/api/chat', json={'message': 'second', 'provider': 'openai', 'model': 'm', 'chat_id': chat_id})
+    assert [hit['role'] for hit in client.get('/api/search?q=second').get_json()] == ['user']
+    client.post(f'/api/chat/{chat_id}/switch', json={'branch_id': branches[1]['id']})
+    assert client.get(f'/api/chat/{chat_id}').get_json()['messages'][0]['content'] == 'first'
+    assert client.get('/api/search?q=second').get_json() == []
@@ -0,0 +1,69 @@
+import threading
+
+import changes as changes_module
+from changes import ChangeLog
+
+
+def test_delta_has_the_latest_change_per_item(tmp_path):
+    log = ChangeLog(str(tmp_path / 'changes.db'))
+    assert log.version() == 0
+    start = log.record('chat', 'a', 'upsert', {'title': 'one'})
+    log.record('note', 'n', 'upsert')
+    log.record('chat', 'b', 'upsert', {'title': 'b'})
+    last = log.record('chat', 'a', 'upsert', {'title': 'two'})
+    assert log.version('chat') == last and log.version('note') == start + 1
+
+    delta = log.since(start, 'chat')
+    assert [(change['id'], change['data']) for change in delta] == [('b', {'title': 'b'}), ('a', {'title': 'two'})]
+    assert [change['id'] for change in log.since(0)] == ['n', 'b', 'a']
+    assert log.since(last) == []
+    assert log.since(start, upto=start + 1)[0]['id'] == 'n'
+
+
+def test_clients_too_far_behind_or_ahead_must_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(changes_module, 'CHANGE_RETENTION', 2)
+    log = ChangeLog(str(tmp_path / 'changes.db'))
+    for n in range(1000):
+        log.record('chat', str(n), 'upsert')
+    # Only the last two changes are kept
+    assert log.since(997) is None
+    assert [change['id'] for change in log.since(998)] == ['998', '999']
+    assert log.since(2000) is None
+    reset = log.reset('chat')
+    assert log.since(reset - 1) is None
+
+
+def test_wait_returns_when_another_thread_records(tmp_path):
+    log = ChangeLog(str(tmp_path / 'changes.db'))
+    assert log.wait(0, 0.05) == 0
+    timer = threading.Timer(0.05, log.record, ('chat', 'a', 'delete'))
+    timer.start()
+    assert log.wait(0, 5) == 1
+    timer.join()
+
+
+def test_list_etags_and_deltas(client):
+    first = client.get('/api/chats')
+    etag = first.headers['ETag']
+    assert client.get('/api/chats', headers={'If-None-Match': etag}).status_code == 304
+    version = int(first.headers['X-Change-Version'])
+
+    chat_id = client.post('/api/chat', json={'message': 'listed', 'provider': 'openai',
+                                             'model': 'm'}).get_json()['chat_id']
+    assert client.get('/api/chats', headers={'If-None-Match': etag}).status_code == 200
+    delta = client.get(f'/api/chats?since={version}').get_json()
+    assert [(change['id'], change['op']) for change in delta['changes']] == [(chat_id, 'upsert')]
+    assert delta['changes'][0]['data']['title'] == 'listed'
+    assert client.get('/api/chats?since=999999999').get_json()['reset']
+
+
+def test_threaded_change_feed_ends_with_its_position(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'CHANGE_FEED_SECONDS', 0.3)
+    since = client.get('/api/notes').headers['X-Change-Version']
+    assert client.post('/api/notes', json={'filename': 'feed', 'content': 'x'}).status_code == 200
+    listed = client.get('/api/notes').get_json()
+    assert [note['name'] for note in listed] == ['feed']
+    body = client.get(f'/api/changes?since={since}').get_data(as_text=True)
+    assert '"op": "upsert"' in body
+    latest = app_module.changes.version()
+    assert body.endswith(f'id: {latest}\n\n')
@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MODELS = [{'provider': 'openai', 'model': 'a'}, {'provider': 'anthropic', 'model': 'b'}]
+
+
+def test_models_are_queried_concurrently(client, mock):
+    mock.latency = 0.3
+    started = time.monotonic()
+    response = client.post('/api/chat', json={'message': 'hello', 'selected_models': MODELS})
+    elapsed = time.monotonic() - started
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['is_multi']
+    assert [(r['provider'], r['model'], r['success']) for r in data['responses']] == [
+        ('openai', 'a', True), ('anthropic', 'b', True)]
+    assert data['responses'][0]['response'].startswith('a-token0')
+    assert elapsed < 0.55
+
+
+def test_failed_model_is_reported_but_not_saved(client):
+    models = MODELS[:1] + [{'provider': 'missing', 'model': 'x'}]
+    data = client.post('/api/chat', json={'message': 'hello', 'selected_models': models}).get_json()
+    assert [r['success'] for r in data['responses']] == [True, False]
+    chat = client.get(f"/api/chat/{data['chat_id']}").get_json()
+    assert [m['role'] for m in chat['messages']] == ['user', 'assistant']
+    assert 'missing' not in chat['messages'][1]['content']
+
+
+def test_model_timeout_is_reported_per_model(client, mock):
+    mock.latency = 1.0
+    models = [dict(MODELS[0], timeout=0.2), MODELS[1]]
+    data = client.post('/api/chat', json={'message': 'hello', 'selected_models': models}).get_json()
+    assert data['responses'][0]['success'] is False
+    assert data['responses'][0]['code'] == 'timeout'
+    assert data['responses'][1]['success'] is True
+
+
+def test_time_queued_for_a_worker_does_not_count_against_the_timeout(client, app_module, mock, monkeypatch):
+    mock.latency = 0.3
+    monkeypatch.setattr(app_module, 'model_executor', ThreadPoolExecutor(max_workers=1))
+    models = [dict(model, timeout=0.5) for model in MODELS]
+    data = client.post('/api/chat', json={'message': 'hello', 'selected_models': models}).get_json()
+    assert [r['success'] for r in data['responses']] == [True, True]
+    body = client.post('/api/chat/stream', json={'message': 'hello', 'selected_models': models}).get_data(as_text=True)
+    assert body.count('"type": "model_done"') == 2
+    assert 'timeout' not in body
+
+
+def test_stream_relays_every_model(client):
+    response = client.post('/api/chat/stream', json={'message': 'hello', 'selected_models': MODELS})
+    body = response.get_data(as_text=True)
+    assert response.headers['X-Job-Id']
+    assert body.count('"type": "model_done"') == 2
+    assert '"type": "done"' in body
+
+
+def test_chat_pages_load_older_messages_by_cursor(client):
+    chat_id = None
+    for n in range(3):
+        request = {'message': f'turn {n}', 'provider': 'openai', 'model': 'm'}
+        if chat_id:
+            request['chat_id'] = chat_id
+        chat_id = client.post('/api/chat', json=request).get_json()['chat_id']
+    page = client.get(f'/api/chat/{chat_id}?limit=2').get_json()
+    assert (page['offset'], page['total'], page['next_cursor']) == (4, 6, 4)
+    assert page['messages'][0]['content'] == 'turn 2'
+    older = client.get(f"/api/chat/{chat_id}?limit=4&before={page['next_cursor']}").get_json()
+    assert [m['content'] for m in older['messages'] if m['role'] == 'user'] == ['turn 0', 'turn 1']
+    assert older['next_cursor'] is None
+    assert len(client.get(f'/api/chat/{chat_id}').get_json()['messages']) == 6
@@ -0,0 +1,44 @@
+import os
+
+from chat_store import ChatStore
+from chat_catalog import ChatCatalog
+
+
+def save(store, chat_id, title, folder=None):
+    meta = store.save(chat_id, [{'role': 'user', 'content': title}], title, folder)
+    return dict(meta, id=chat_id)
+
+
+def test_list_and_count_by_folder(tmp_path):
+    store = ChatStore(str(tmp_path))
+    catalog = ChatCatalog(store)
+    catalog.upsert(save(store, 'a', 'First', 'work'))
+    catalog.upsert(save(store, 'b', 'Second'))
+    catalog.upsert(save(store, 'c', 'Third', ' '))
+
+    assert [chat['id'] for chat in catalog.list()] == ['c', 'b', 'a']
+    assert [chat['id'] for chat in catalog.list(order='asc', limit=2)] == ['a', 'b']
+    assert [chat['id'] for chat in catalog.list(folder_name='work')] == ['a']
+    assert {chat['id'] for chat in catalog.list(folder_name='')} == {'b', 'c'}
+    assert catalog.count() == 3
+    assert catalog.count('work') == 1
+
+    catalog.upsert({'id': 'a', 'title': 'Renamed'})
+    assert catalog.get('a')['title'] == 'Renamed'
+    assert catalog.get('a')['folder_name'] == 'work'
+
+
+def test_repair_picks_up_changes_made_behind_its_back(tmp_path):
+    store = ChatStore(str(tmp_path))
+    catalog = ChatCatalog(store)
+    catalog.upsert(save(store, 'a', 'Kept'))
+    catalog.upsert(save(store, 'gone', 'Deleted'))
+    save(store, 'new', 'Unindexed')
+    os.remove(os.path.join(str(tmp_path), 'gone.json'))
+
+    report = catalog.repair()
+    assert report == {'added': 1, 'updated': 0, 'removed': 1, 'total': 2}
+    assert catalog.get('new')['title'] == 'Unindexed'
+    assert catalog.get('gone') is None
+    # Nothing changed since, so nothing is loaded again
+    assert catalog.repair()['added'] == catalog.repair()['updated'] == 0
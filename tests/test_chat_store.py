@@ -0,0 +1,150 @@
+import os
+import json
+import threading
+
+import pytest
+
+import chat_store
+from chat_store import ChatStore, SqliteChatStore
+
+
+def turn(n):
+    return [{'role': 'user', 'content': f'question {n}'}, {'role': 'assistant', 'content': f'answer {n}'}]
+
+
+@pytest.fixture(params=['files', 'sqlite'])
+def store(request, tmp_path):
+    return ChatStore(str(tmp_path)) if request.param == 'files' else SqliteChatStore(str(tmp_path))
+
+
+def test_turns_are_appended_to_the_log(tmp_path):
+    store = ChatStore(str(tmp_path))
+    messages = turn(1)
+    meta = store.save('c', messages, 'Title', None)
+    assert meta['created'] and meta['appended_from'] == 0
+    snapshot = tmp_path / 'c.json'
+    before = snapshot.read_bytes()
+
+    messages += turn(2)
+    meta = store.save('c', messages, 'Title', None, base=2)
+    assert meta['appended_from'] == 2 and not meta['merged']
+    assert snapshot.read_bytes() == before
+    records = [json.loads(line) for line in (tmp_path / 'c.log').read_text().splitlines()]
+    assert records[0]['at'] == 2 and records[0]['messages'] == turn(2)
+    assert ChatStore(str(tmp_path)).load('c')['messages'] == turn(1) + turn(2)
+
+
+def test_torn_log_line_is_skipped_and_dropped(tmp_path):
+    store = ChatStore(str(tmp_path))
+    store.save('c', turn(1), 'Title', None)
+    store.save('c', turn(1) + turn(2), 'Title', None, base=2)
+    with open(tmp_path / 'c.log', 'a') as f:
+        f.write('{"op": "append", "at": 4, "mess')
+    reopened = ChatStore(str(tmp_path))
+    assert reopened.load('c')['messages'] == turn(1) + turn(2)
+    reopened.save('c', turn(1) + turn(2) + turn(3), 'Title', None, base=4)
+    assert ChatStore(str(tmp_path)).load('c')['messages'] == turn(1) + turn(2) + turn(3)
+
+
+def test_log_is_compacted_into_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_store, 'COMPACT_RECORDS', 3)
+    store = ChatStore(str(tmp_path))
+    messages = turn(0)
+    store.save('c', messages, 'Title', None)
+    for n in range(1, 4):
+        base = len(messages)
+        messages = messages + turn(n)
+        store.save('c', messages, 'Title', None, base=base)
+    assert not (tmp_path / 'c.log').exists()
+    assert len(json.loads((tmp_path / 'c.json').read_text())['messages']) == 8
+    assert ChatStore(str(tmp_path)).load('c')['messages'] == messages
+
+
+def test_concurrent_turns_are_both_kept(store):
+    store.save('c', turn(1), 'Title', None)
+    first = store.load('c')['messages']
+    second = store.load('c')['messages']
+    store.save('c', first + turn(2), 'Title', None, base=2)
+    meta = store.save('c', second + turn(3), 'Title', None, base=2)
+    assert meta['merged'] and meta['appended_from'] == 4
+    assert store.load('c')['messages'] == turn(1) + turn(2) + turn(3)
+
+
+def test_pages_are_read_from_the_offset_index(store):
+    messages = turn(0)
+    store.save('c', messages, 'Title', None)
+    for n in range(1, 5):
+        store.save('c', messages + turn(n), 'Title', None, base=len(messages))
+        messages = messages + turn(n)
+    if isinstance(store, ChatStore):
+        store.compact('c')
+        store.save('c', messages + turn(5), 'Title', None, base=len(messages))
+        messages = messages + turn(5)
+
+    page = store.load_page('c', 3)
+    assert page['messages'] == messages[-3:]
+    assert page['total'] == len(messages)
+    older = store.load_page('c', 3, page['next_cursor'])
+    assert older['messages'] == messages[-6:-3]
+    first = store.load_page('c', 100, 2)
+    assert first['messages'] == messages[:2] and first['next_cursor'] is None
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+    store = ChatStore(str(tmp_path))
+    store.save('c', turn(1), 'Title', None)
+    chat = json.loads((tmp_path / 'c.json').read_text())
+    chat['messages'].append({'role': 'user', 'content': 'edited by hand'})
+    (tmp_path / 'c.json').write_text(json.dumps(chat))
+    page = ChatStore(str(tmp_path)).load_page('c', 1)
+    assert page['messages'] == [{'role': 'user', 'content': 'edited by hand'}]
+    assert page['total'] == 3
+
+
+def test_update_and_delete(store):
+    store.save('c', turn(1), 'Title', None)
+    store.update('c', title='Renamed', folder_name='work')
+    chat = store.load('c')
+    assert (chat['title'], chat['folder_name']) == ('Renamed', 'work')
+    assert store.update('missing', title='x') is None
+    assert store.delete('c') is True
+    assert store.load('c') is None
+    assert store.delete('c') is False
+    if isinstance(store, ChatStore):
+        assert not any(name.startswith('c.') for name in os.listdir(store.history_dir))
+
+
+def test_chat_locks_are_per_chat_and_reentrant(tmp_path):
+    store = ChatStore(str(tmp_path))
+    holding = threading.Event()
+    done = threading.Event()
+    order = []
+
+    def hold_a():
+        with store._locked('a'):
+            with store._locked('a'):
+                holding.set()
+                done.wait(5)
+            order.append('a released')
+
+    def wait_for_a():
+        with store._locked('a'):
+            order.append('second a')
+
+    holder = threading.Thread(target=hold_a)
+    holder.start()
+    assert holding.wait(5)
+    # Another chat is not held up, in this process or through its lock file
+    other = threading.Thread(target=store.save, args=('b', turn(1), 'B', None))
+    other.start()
+    other.join(5)
+    assert not other.is_alive()
+    waiter = threading.Thread(target=wait_for_a)
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    done.set()
+    holder.join(5)
+    waiter.join(5)
+    assert order == ['a released', 'second a']
+    assert store._held == {}
@@ -0,0 +1,58 @@
+import re
+import gzip
+
+from werkzeug.http import parse_accept_header, parse_etags
+from werkzeug.datastructures import Accept
+
+from compression import negotiate, variant_etag, etag_matches, compress, encodings
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+def test_negotiation_and_variant_etags():
+    assert negotiate(parse_accept_header('gzip;q=0.5, identity', Accept)) == 'gzip'
+    assert negotiate(parse_accept_header('gzip;q=0', Accept)) is None
+    assert negotiate(parse_accept_header('', Accept)) is None
+    assert variant_etag('abc', 'gzip') == 'abc-gzip' and variant_etag('abc', None) == 'abc'
+    assert etag_matches(parse_etags('"abc-gzip"'), 'abc')
+    assert etag_matches(parse_etags('"abc"'), 'abc')
+    assert not etag_matches(parse_etags('"abd-gzip"'), 'abc')
+    assert gzip.decompress(compress(b'x' * 100, 'gzip')) == b'x' * 100
+    assert 'gzip' in encodings()
+
+
+def test_pages_are_compressed_with_an_etag_per_encoding(client):
+    page = client.get('/', headers=GZIP)
+    assert page.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in page.headers['Vary']
+    etag = page.headers['ETag']
+    assert etag.endswith('-gzip"')
+    assert b'<html' in gzip.decompress(page.get_data())
+
+    plain = client.get('/')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['ETag'] == etag.replace('-gzip"', '"')
+
+    again = client.get('/', headers=dict(GZIP, **{'If-None-Match': etag}))
+    assert again.status_code == 304 and again.headers['ETag'] == etag
+
+
+def test_versioned_static_files_are_immutable(client):
+    page = client.get('/').get_data(as_text=True)
+    url = re.search(r'src="(/static/script\.js\?v=\w+)"', page).group(1)
+    response = client.get(url, headers=GZIP)
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.headers['Content-Encoding'] == 'gzip'
+    with open('%s/script.js' % client.application.static_folder, 'rb') as f:
+        assert gzip.decompress(response.get_data()) == f.read()
+    stale = client.get(url.split('?')[0] + '?v=old', headers=GZIP)
+    assert 'immutable' not in stale.headers.get('Cache-Control', '')
+
+
+def test_small_bodies_and_streams_are_sent_as_is(client):
+    small = client.get('/api/jobs/missing', headers=GZIP)
+    assert 'Content-Encoding' not in small.headers
+    stream = client.post('/api/chat/stream', json={'message': 'hi', 'provider': 'openai', 'model': 'm'},
+                         headers=GZIP)
+    assert 'Content-Encoding' not in stream.headers
+    assert '"type": "done"' in stream.get_data(as_text=True)
@@ -0,0 +1,39 @@
+import json
+
+from config_cache import CachedFile
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_file_is_read_once_until_it_changes(tmp_path):
+    path = tmp_path / 'credentials.json'
+    path.write_text('{"a": 1}')
+    cache = CachedFile(str(path), read_json, default={}, check_interval=0)
+    assert cache.get() == {'a': 1}
+    assert cache.get() == {'a': 1}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    path.write_text('{"a": 22}')
+    assert cache.get() == {'a': 22}
+    path.unlink()
+    assert cache.get() == {}
+    assert cache.misses == 3
+
+
+def test_signature_is_checked_once_per_interval(tmp_path):
+    path = tmp_path / 'behavior.txt'
+    path.write_text('old')
+    cache = CachedFile(str(path), lambda p: open(p).read(), default='', check_interval=60)
+    assert cache.get() == 'old'
+    path.write_text('newer')
+    assert cache.get() == 'old'
+    cache.invalidate()
+    assert cache.get() == 'newer'
+
+
+def test_missing_file_gives_the_default(tmp_path):
+    cache = CachedFile(str(tmp_path / 'model_groups.json'), read_json, default={})
+    assert cache.get() == {}
@@ -0,0 +1,70 @@
+import json
+
+from context_builder import build_context, context_budget, estimate_tokens, message_tokens
+
+
+def history(turns, size=400):
+    messages = []
+    for n in range(turns):
+        messages.append({'role': 'user', 'content': f'question {n} ' + 'x' * size})
+        messages.append({'role': 'assistant', 'content': f'answer {n} ' + 'y' * size})
+    return messages
+
+
+def test_message_tokens_leaves_the_message_alone():
+    message = {'role': 'user', 'content': 'x' * 40, 'attachments': [{'id': 'a', 'name': 'f', 'tokens': 100}]}
+    before = json.dumps(message)
+    assert message_tokens(message) == estimate_tokens('x' * 40) + 100
+    assert json.dumps(message) == before
+    # A count stored by an older version is not trusted
+    assert message_tokens(dict(message, content='', tokens=5000)) == estimate_tokens('') + 100
+
+
+def test_history_is_trimmed_to_the_budget_with_a_summary():
+    messages = history(10) + [{'role': 'user', 'content': 'newest'}]
+    context = build_context(messages, 'openai', 'gpt', budget=500)
+    assert context[-1] == {'role': 'user', 'content': 'newest'}
+    assert context[0]['role'] == 'system'
+    assert 'question 0' in context[0]['content'] and context[1]['content'] not in context[0]['content']
+    assert context[1]['role'] == 'user'
+    assert sum(estimate_tokens(m['content']) for m in context[1:]) <= 500
+    assert all('tokens' not in message for message in messages)
+
+
+def test_leading_system_prompt_is_kept_through_trimming():
+    system = {'role': 'system', 'content': 'Answer in French'}
+    assert build_context([system, {'role': 'user', 'content': 'hi'}], 'openai', 'gpt') == [
+        system, {'role': 'user', 'content': 'hi'}]
+    context = build_context([system] + history(10) + [{'role': 'user', 'content': 'newest'}], 'openai', 'gpt',
+                            budget=500)
+    assert context[0] == system
+    assert context[1]['role'] == 'system' and '(16 older messages omitted)' in context[1]['content']
+    assert context[2]['role'] == 'user' and context[-1]['content'] == 'newest'
+
+
+def test_newest_message_is_always_sent():
+    context = build_context([{'role': 'user', 'content': 'x' * 10000}], 'openai', 'gpt', budget=10)
+    assert context == [{'role': 'user', 'content': 'x' * 10000}]
+
+
+def test_combined_answers_are_cut_to_the_models_part():
+    combined = '**openai - a:**\nfrom a\n\n---\n\n**anthropic - b:**\nfrom b'
+    messages = [{'role': 'user', 'content': 'q'}, {'role': 'assistant', 'content': combined},
+                {'role': 'user', 'content': 'next'}]
+    assert build_context(messages, 'anthropic', 'b')[1]['content'] == 'from b'
+    assert build_context(messages, 'openai', 'other')[1]['content'] == 'from a'
+
+
+def test_budget_from_credentials():
+    assert context_budget({'context_tokens': 100}, 'm') == 100
+    assert context_budget({'context_tokens': {'m': 50, 'default': 70}}, 'm') == 50
+    assert context_budget({'context_tokens': {'default': 70}}, 'other') == 70
+
+
+def test_saved_messages_carry_no_token_counts(client):
+    chat_id = client.post('/api/chat', json={'message': 'hello', 'provider': 'openai',
+                                             'model': 'm'}).get_json()['chat_id']
+    client.post('/api/chat', json={'message': 'again', 'provider': 'openai', 'model': 'm', 'chat_id': chat_id})
+    messages = client.get(f'/api/chat/{chat_id}').get_json()['messages']
+    assert len(messages) == 4
+    assert all('tokens' not in message for message in messages)
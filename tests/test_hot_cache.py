@@ -0,0 +1,91 @@
+import threading
+
+from chat_store import ChatStore
+from hot_cache import HotChatCache
+
+
+def turn(n):
+    return [{'role': 'user', 'content': f'question {n}'}, {'role': 'assistant', 'content': f'answer {n}'}]
+
+
+def test_saves_are_written_through_by_default(tmp_path):
+    store = ChatStore(str(tmp_path))
+    cache = HotChatCache(store)
+    assert cache.flush_delay == 0
+    cache.save('c', turn(1), 'T', None, base=0)
+    assert store.load('c')['messages'] == turn(1)
+    messages = cache.load('c')['messages'] + turn(2)
+    cache.save('c', messages, 'T', None, base=2)
+    assert store.load('c')['messages'] == turn(1) + turn(2)
+
+
+def test_write_behind_defers_saves_until_flushed(tmp_path):
+    store = ChatStore(str(tmp_path))
+    cache = HotChatCache(store, flush_delay=60)
+    cache.save('c', turn(1), 'T', None, base=0)
+    assert store.load('c') is None
+    assert cache.load('c')['messages'] == turn(1)
+    assert cache.exists('c')
+    cache.flush()
+    assert store.load('c')['messages'] == turn(1)
+    cache.close()
+
+
+def test_write_back_keeps_turns_saved_elsewhere(tmp_path):
+    merged = []
+    cache = HotChatCache(ChatStore(str(tmp_path)), flush_delay=60,
+                         on_merged=lambda chat_id, start: merged.append((chat_id, start)))
+    cache.save('c', turn(1), 'T', None, base=0)
+    cache.flush()
+    cache.save('c', cache.load('c')['messages'] + turn(2), 'T', None, base=2)
+    # Another process appends a turn before this one is written back
+    ChatStore(str(tmp_path)).save('c', turn(1) + turn(3), 'T', None, base=2)
+    cache.flush()
+    assert merged == [('c', 4)]
+    assert cache.load('c')['messages'] == turn(1) + turn(3) + turn(2)
+    cache.close()
+
+
+def test_changes_made_elsewhere_are_picked_up(tmp_path):
+    cache = HotChatCache(ChatStore(str(tmp_path)))
+    cache.save('c', turn(1), 'T', None, base=0)
+    assert cache.load('c')['messages'] == turn(1)
+    ChatStore(str(tmp_path)).save('c', turn(1) + turn(2), 'T', None, base=2)
+    assert cache.load('c')['messages'] == turn(1) + turn(2)
+
+
+def test_eviction_writes_dirty_chats_back(tmp_path):
+    store = ChatStore(str(tmp_path))
+    cache = HotChatCache(store, max_bytes=500, flush_delay=60)
+    cache.save('a', turn(1), 'A', None, base=0)
+    cache.save('b', turn(2), 'B', None, base=0)
+    assert 'a' not in cache._entries
+    assert store.load('a')['messages'] == turn(1)
+    assert store.load('b') is None
+    cache.close()
+    assert store.load('b')['messages'] == turn(2)
+
+
+def test_a_slow_save_does_not_hold_up_other_chats(tmp_path):
+    store = ChatStore(str(tmp_path))
+    writing = threading.Event()
+    release = threading.Event()
+    save = store.save
+
+    def slow_save(chat_id, *args):
+        if chat_id == 'slow':
+            writing.set()
+            release.wait(5)
+        return save(chat_id, *args)
+
+    store.save = slow_save
+    cache = HotChatCache(store)
+    thread = threading.Thread(target=cache.save, args=('slow', turn(1), 'S', None, 0))
+    thread.start()
+    assert writing.wait(5)
+    cache.save('fast', turn(2), 'F', None, base=0)
+    assert cache.load('fast')['messages'] == turn(2)
+    assert thread.is_alive()
+    release.set()
+    thread.join(5)
+    assert store.load('slow')['messages'] == turn(1)
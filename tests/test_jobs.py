@@ -0,0 +1,140 @@
+import json
+import time
+import asyncio
+import threading
+
+from jobs import Job, JobQueue
+
+
+def frame(n):
+    return f'data: {json.dumps({"type": "content", "content": str(n)})}\n\n'
+
+
+def queue(tmp_path, runner, workers=1):
+    jobs = JobQueue(str(tmp_path / 'jobs.db'), runner, workers=workers)
+    jobs.start()
+    return jobs
+
+
+def drain(events):
+    return [(event_id, frame) for event_id, frame in events if event_id is not None]
+
+
+def test_subscribers_resume_after_the_last_event_id(tmp_path):
+    release = threading.Event()
+
+    def runner(job):
+        for n in range(3):
+            job.emit(frame(n))
+        release.wait(5)
+        job.emit(frame(3))
+
+    jobs = queue(tmp_path, runner)
+    job = jobs.submit('u', {}, ['openai'])
+    live = jobs.subscribe(job.id, '1.2')
+    release.set()
+    assert [event_id for event_id, _ in drain(live)] == ['1.3', '1.4']
+    # Once finished the frames are read back from the database
+    assert drain(jobs.subscribe(job.id, '1.3')) == [('1.4', frame(3))]
+    assert jobs.status(job.id)['status'] == 'done'
+    assert jobs.subscribe('missing') is None
+
+
+def test_jobs_of_an_exited_process_are_run_again(tmp_path):
+    ran = []
+    crashed = JobQueue(str(tmp_path / 'jobs.db'), ran.append, workers=1)
+    job = crashed.submit('u', {'message': 'hi'}, ['openai'])
+    crashed._connect().execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job.id,))
+    crashed._connect().commit()
+    # The lock file a live process holds is what marks its jobs as taken
+    assert JobQueue(str(tmp_path / 'jobs.db'), ran.append)._recover() == 0
+    crashed._owner_lock.release()
+
+    def runner(job):
+        ran.append(job)
+        job.emit(frame('again'))
+
+    jobs = queue(tmp_path, runner)
+    events = list(jobs.subscribe(job.id, '1.5'))
+    assert events[0] == (None, 'data: {"type": "reset"}\n\n')
+    assert events[1] == ('2.1', frame('again'))
+    assert [(rerun.id, rerun.attempt, rerun.request) for rerun in ran] == [(job.id, 2, {'message': 'hi'})]
+
+
+def test_another_process_reads_frames_while_the_job_runs(tmp_path):
+    release = threading.Event()
+
+    def runner(job):
+        job.emit(frame(0))
+        release.wait(5)
+        job.emit(frame(1))
+
+    jobs = queue(tmp_path, runner)
+    job = jobs.submit('u', {}, ['openai'])
+    # A second queue on the same database stands in for another process
+    other = JobQueue(str(tmp_path / 'jobs.db'), runner, workers=0)
+    events = other.subscribe(job.id)
+    assert next(events) == ('1.1', frame(0))
+    release.set()
+    assert drain(events) == [('1.2', frame(1))]
+
+
+def test_attached_jobs_run_on_the_loop_without_holding_a_worker(tmp_path):
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    started = []
+    release = asyncio.Event()
+
+    async def runner(job):
+        started.append(job.id)
+        await release.wait()
+        job.emit(frame(job.id))
+
+    jobs = queue(tmp_path, None)
+    jobs.attach(loop, runner)
+    submitted = [jobs.submit(f'u{n}', {}, [f'p{n}']) for n in range(3)]
+    deadline = time.monotonic() + 5
+    while len(started) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # One worker thread, three jobs running at once
+    assert sorted(started) == sorted(job.id for job in submitted)
+    loop.call_soon_threadsafe(release.set)
+    for job in submitted:
+        assert drain(jobs.subscribe(job.id)) == [('1.1', frame(job.id))]
+        assert jobs.status(job.id)['status'] == 'done'
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_cancelling_a_queued_job(tmp_path):
+    jobs = JobQueue(str(tmp_path / 'jobs.db'), lambda job: None)
+    job = jobs.submit('u', {}, ['openai'])
+    assert jobs.cancel(job.id)
+    assert not jobs.cancel(job.id)
+    assert jobs.status(job.id)['status'] == 'cancelled'
+    assert '"code": "cancelled"' in drain(jobs.subscribe(job.id))[0][1]
+
+
+def test_a_rerun_job_sends_the_saved_turn_instead_of_a_second_one(client, app_module, mock):
+    models = [{'provider': 'openai', 'model': 'a'}, {'provider': 'anthropic', 'model': 'b'}]
+    for selection in (models[:1], models):
+        response = client.post('/api/chat/stream', json={'message': 'once', 'selected_models': selection})
+        response.get_data()
+        job_id = response.headers['X-Job-Id']
+        row = app_module.jobs._connect().execute('SELECT request FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        request = json.loads(row['request'])
+        saved = client.get(f"/api/chat/{request['chat_id']}").get_json()['messages']
+        calls = mock.requests
+
+        # As if the process died after saving but before the job was marked done
+        rerun = Job(job_id, 'u', request, ['openai'], 0, attempt=2)
+        app_module.run_stream_job(rerun)
+        assert mock.requests == calls
+        assert client.get(f"/api/chat/{request['chat_id']}").get_json()['messages'] == saved
+        replayed = [json.loads(f[6:]) for f in rerun.frames]
+        assert replayed[-1]['type'] == 'done'
+        if len(selection) == 1:
+            assert replayed[-2] == {'type': 'content', 'content': saved[-1]['content']}
+        else:
+            contents = [event['content'] for event in replayed if event['type'] == 'model_content']
+            assert [content.split(' ')[0] for content in contents] == ['a-token0', 'b-token0']
+            assert [event['type'] for event in replayed].count('model_done') == 2
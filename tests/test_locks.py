@@ -0,0 +1,23 @@
+from locks import FileLock
+
+
+def test_lock_is_exclusive_until_released(tmp_path):
+    path = str(tmp_path / 'x.lock')
+    first, second = FileLock(path), FileLock(path)
+    assert first.acquire()
+    assert not second.acquire(blocking=False)
+    first.release()
+    assert second.acquire(blocking=False)
+    second.release()
+    # Releasing twice is harmless and the file stays for the next holder
+    second.release()
+    assert (tmp_path / 'x.lock').exists()
+
+
+def test_other_files_are_independent(tmp_path):
+    first = FileLock(str(tmp_path / 'a.lock'))
+    assert first.acquire()
+    other = FileLock(str(tmp_path / 'b.lock'))
+    assert other.acquire(blocking=False)
+    other.release()
+    first.release()
@@ -0,0 +1,46 @@
+from metrics import Counter, Histogram, CallTimer, CALL_OBSERVERS, REGISTRY
+
+
+def test_counters_and_histograms_render_in_prometheus_format():
+    counter = Counter('test_requests_total', 'Requests', ('route',))
+    histogram = Histogram('test_latency_seconds', 'Latency', buckets=(0.1, 1))
+    try:
+        counter.inc(route='a "quoted"\nroute')
+        counter.inc(2, route='b')
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        lines = counter.render() + histogram.render()
+    finally:
+        REGISTRY.remove(counter)
+        REGISTRY.remove(histogram)
+    assert 'test_requests_total{route="a \\"quoted\\"\\nroute"} 1' in lines
+    assert 'test_requests_total{route="b"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count 3' in lines
+
+
+def test_call_timer_reports_to_observers():
+    seen = []
+    CALL_OBSERVERS.append(lambda *args: seen.append(args))
+    try:
+        timer = CallTimer('p', 'm', 40)
+        timer.chunk('hello')
+        timer.chunk(' world')
+        timer.finish('ok')
+    finally:
+        CALL_OBSERVERS.pop()
+    provider, model, outcome, ttft, elapsed, chars = seen[0]
+    assert (provider, model, outcome, chars) == ('p', 'm', 'ok', 11)
+    assert 0 <= ttft <= elapsed
+
+
+def test_metrics_endpoint_and_timings(client):
+    response = client.post('/api/chat/stream', json={'message': 'hi', 'provider': 'openai', 'model': 'm',
+                                                     'timings': True})
+    done = [line for line in response.get_data(as_text=True).splitlines() if '"type": "done"' in line][0]
+    assert '"ttft_ms"' in done and '"save_ms"' in done
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'queryquest_provider_requests_total{provider="openai",model="m",outcome="ok"}' in body
+    assert 'queryquest_http_request_seconds_bucket' in body
@@ -0,0 +1,54 @@
+import pytest
+
+from providers import Provider, OpenAIProvider, AnthropicProvider, CoforgeProvider, get_provider
+
+
+def config(mock_server, path):
+    return {'api_key': 'test', 'base_url': f'http://127.0.0.1:{mock_server[1]}{path}'}
+
+
+PATHS = {OpenAIProvider: '/v1/chat/completions', CoforgeProvider: '/qag/llmrouter-api/v2/chat/completions',
+         AnthropicProvider: '/v1/messages'}
+
+
+def test_adapters_must_implement_the_wire_format():
+    class Incomplete(Provider):
+        name = 'incomplete'
+
+        def headers(self, config):
+            return {}
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    assert isinstance(get_provider('openai'), OpenAIProvider)
+    assert get_provider('missing') is None
+
+
+@pytest.mark.parametrize('cls', list(PATHS))
+def test_complete_and_stream(cls, mock, mock_server):
+    adapter = cls()
+    messages = [{'role': 'system', 'content': 'Be brief'}, {'role': 'user', 'content': 'hi'}]
+    expected = ''.join(mock.words('m'))
+    assert adapter.complete(messages, 'm', config(mock_server, PATHS[cls])) == expected
+    assert ''.join(adapter.stream(messages, 'm', config(mock_server, PATHS[cls]))) == expected
+
+
+def test_messages_without_content_are_timed(mock, mock_server):
+    messages = [{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': None}, {'role': 'user'}]
+    assert OpenAIProvider().complete(messages, 'm', config(mock_server, PATHS[OpenAIProvider]))
+
+
+def test_anthropic_payload_moves_system_prompts_and_marks_the_cache():
+    data = AnthropicProvider().payload([{'role': 'system', 'content': 'Be brief'},
+                                        {'role': 'user', 'content': 'hi'}], 'm', False)
+    assert data['system'][0]['text'] == 'Be brief'
+    assert data['messages'] == [{'role': 'user', 'content': [
+        {'type': 'text', 'text': 'hi', 'cache_control': {'type': 'ephemeral'}}]}]
+
+
+def test_parse_line_fast_path_and_escapes():
+    adapter = OpenAIProvider()
+    assert adapter.parse_line(b'data: {"choices": [{"delta": {"content": "a\\"b"}}]}') == 'a"b'
+    assert adapter.parse_line(b'data: {"choices": [{"delta": {"role": "assistant"}}]}') is None
+    assert adapter.parse_line(b'data: [DONE]') is None
+    assert adapter.parse_line(b': keepalive') is None
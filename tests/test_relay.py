@@ -0,0 +1,51 @@
+import json
+
+from relay import Coalescer, content_framer
+
+
+def sse_event(event):
+    return f'data: {json.dumps(event)}\n\n'
+
+
+def test_framer_matches_a_plain_sse_event():
+    event = {'type': 'model_content', 'provider': 'openai', 'model': 'm'}
+    framer = content_framer(event)
+    for text in ('plain', 'quote " and \\ and\nnewline', 'ünïcode'):
+        assert framer(text) == sse_event(dict(event, content=text))
+
+
+def test_first_delta_is_due_at_once_then_deltas_are_merged():
+    coalescer = Coalescer(window=0.02, max_chars=100)
+    coalescer.add(0, 'first', 1.0)
+    assert coalescer.due(1.0)
+    assert coalescer.flush() == [(0, 'first')]
+    coalescer.add(0, 'a', 1.001)
+    coalescer.add(0, 'b', 1.005)
+    coalescer.add(1, 'other', 1.006)
+    assert coalescer.due(1.006)
+    assert sorted(coalescer.flush()) == [(0, 'ab'), (1, 'other')]
+    coalescer.add(0, 'c', 1.010)
+    assert not coalescer.due(1.015)
+    assert abs(coalescer.wait(1.015, 5.0) - 0.015) < 1e-9
+    assert coalescer.due(1.031)
+
+
+def test_size_limit_and_per_model_flush():
+    coalescer = Coalescer(window=10, max_chars=10)
+    coalescer.add(0, 'x', 0.0)
+    coalescer.flush()
+    coalescer.add(0, 'y' * 6, 0.1)
+    assert not coalescer.due(0.1)
+    coalescer.add(0, 'z' * 6, 0.2)
+    assert coalescer.due(0.2)
+    assert coalescer.flush(0) == [(0, 'y' * 6 + 'z' * 6)]
+    assert coalescer.flush(0) == [] and coalescer.chars == 0
+
+
+def test_streamed_text_arrives_whole(client, mock):
+    mock.tokens = 200
+    response = client.post('/api/chat/stream', json={'message': 'hi', 'provider': 'openai', 'model': 'm'})
+    lines = [line for line in response.get_data(as_text=True).splitlines() if '"type": "content"' in line]
+    text = ''.join(json.loads(line[6:])['content'] for line in lines)
+    assert text == ''.join(mock.words('m'))
+    assert len(lines) < 200
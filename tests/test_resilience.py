@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from resilience import (ProviderError, Resilience, CircuitBreaker, TokenBucket, error_info, retry_after,
+                        MAX_RETRIES)
+
+
+def failing(status, times):
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) <= times:
+            raise ProviderError.from_status('p', status, {}, 'nope')
+        return 'ok'
+    return send, calls
+
+
+def test_retryable_errors_are_retried():
+    send, calls = failing(503, MAX_RETRIES)
+    assert Resilience('p').call(send) == 'ok'
+    assert len(calls) == MAX_RETRIES + 1
+
+
+def test_client_errors_are_not_retried():
+    send, calls = failing(400, 1)
+    with pytest.raises(ProviderError) as raised:
+        Resilience('p').call(send)
+    assert raised.value.code == 'bad_request' and len(calls) == 1
+
+
+def test_async_calls_retry_too():
+    send, calls = failing(429, 1)
+
+    async def asend():
+        return send()
+    assert asyncio.run(Resilience('p').acall(asend)) == 'ok'
+    assert len(calls) == 2
+
+
+def test_breaker_opens_after_consecutive_failures_and_lets_one_trial_through():
+    breaker = CircuitBreaker(failures=2, reset=0.05)
+    breaker.record_failure()
+    breaker.before_call('p')
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(ProviderError) as raised:
+        breaker.before_call('p')
+    assert raised.value.code == 'circuit_open' and raised.value.retry_after >= 1
+    breaker.opened_at -= 1
+    breaker.before_call('p')
+    with pytest.raises(ProviderError):
+        breaker.before_call('p')
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_rate_limit_waits_and_refuses_long_waits():
+    bucket = TokenBucket(60, burst=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0
+    assert 0.9 < bucket.reserve() <= 1.0
+    resilience = Resilience('p')
+    resilience.configure({'rate_limit': 1, 'burst': 1})
+    assert resilience.call(lambda: 'first') == 'first'
+    with pytest.raises(ProviderError) as raised:
+        resilience.call(lambda: 'second')
+    assert raised.value.code == 'rate_limited'
+
+
+def test_error_descriptions():
+    error = ProviderError.from_status('p', 429, {'Retry-After': '7'}, 'slow down')
+    assert error.to_dict() == {'error': 'p returned HTTP 429: slow down', 'code': 'rate_limited', 'retryable': True,
+                               'status': 429, 'retry_after': 7.0}
+    assert error_info(ValueError('bad'))['code'] == 'bad_request'
+    assert error_info(RuntimeError())['error'] == 'RuntimeError'
+    assert retry_after({'Retry-After': 'soon'}) is None
+
+
+def test_provider_failures_reach_the_client(client, mock):
+    mock.fail_rate = 1.0
+    mock.fail_status = 401
+    response = client.post('/api/chat', json={'message': 'hi', 'provider': 'anthropic', 'model': 'm'})
+    assert response.status_code == 502
+    assert response.get_json()['code'] == 'auth'
+    assert not client.get(f"/api/chat/{response.get_json()['chat_id']}").get_json().get('messages')
@@ -0,0 +1,45 @@
+from response_cache import ResponseCache, replay
+
+
+def test_hit_miss_and_persistence(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    key = cache.key('openai', 'm', [{'role': 'user', 'content': 'hi'}], 0.7, 2000)
+    assert key != cache.key('openai', 'm', [{'role': 'user', 'content': 'hi'}], 0.2, 2000)
+    assert cache.get(key) is None
+    cache.put(key, 'answer', provider='openai', model='m')
+    assert cache.get(key) == 'answer'
+    assert ResponseCache(str(tmp_path)).get(key) == 'answer'
+    assert cache.stats()['hit_rate'] == 0.5
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=-1)
+    cache.put('k', 'answer')
+    assert cache.get('k') is None
+    assert not (tmp_path / 'k.json').exists()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=250)
+    for key in 'abc':
+        cache.put(key, key * 50)
+        cache.get('a')
+    assert cache.get('a') == 'a' * 50
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] >= 1
+
+
+def test_replay_reassembles_the_response():
+    text = 'one two  three\nfour ' * 20
+    chunks = list(replay(text))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == text
+
+
+def test_cached_answer_skips_the_provider(client, mock):
+    request = {'message': 'cache me', 'provider': 'openai', 'model': 'cached', 'use_cache': True}
+    first = client.post('/api/chat', json=request).get_json()['response']
+    calls = mock.requests
+    second = client.post('/api/chat', json=request).get_json()['response']
+    assert second == first
+    assert mock.requests == calls
@@ -0,0 +1,48 @@
+import pytest
+
+import retrieval
+from retrieval import Retriever, split_passages, insert_passages
+
+pytestmark = pytest.mark.skipif(retrieval.np is None, reason='retrieval needs NumPy')
+
+GARDEN = 'Tomatoes need full sun and regular watering.\nPrune the suckers for bigger fruit.\n'
+TAXES = 'File the quarterly estimated tax payment before the deadline.\nKeep receipts.\n'
+
+
+def test_split_passages_cuts_at_line_ends():
+    text = ''.join(f'line {n}\n' for n in range(400))
+    passages = split_passages(text, size=100)
+    assert all(len(passage) <= 100 for passage in passages)
+    assert all(passage.startswith('line ') for passage in passages)
+    assert '\n'.join(passages) == text.strip()
+
+
+def test_search_finds_the_relevant_source(tmp_path):
+    retriever = Retriever(str(tmp_path))
+    retriever.index('note:garden.txt', GARDEN * 3)
+    retriever.index('note:taxes.txt', TAXES * 3)
+    hits = retriever.search('when should I water tomatoes', ['note:garden.txt', 'note:taxes.txt'])
+    assert hits and hits[0]['source'] == 'note:garden.txt'
+    assert retriever.search('quarterly tax deadline', ['note:garden.txt'], min_score=0.3) == []
+
+
+def test_index_survives_a_restart_and_reuses_removed_rows(tmp_path):
+    retriever = Retriever(str(tmp_path))
+    retriever.index('note:garden.txt', GARDEN)
+    retriever.index('note:taxes.txt', TAXES)
+    reopened = Retriever(str(tmp_path))
+    assert reopened.has('note:taxes.txt')
+    assert reopened.sources('note:') and set(reopened.sources('note:')) == {'note:garden.txt', 'note:taxes.txt'}
+    reopened.remove('note:taxes.txt')
+    assert not reopened.has('note:taxes.txt')
+    rows = reopened._rows
+    reopened.index('note:other.txt', TAXES)
+    assert reopened._rows == rows
+    assert reopened.search('tax receipts', ['note:other.txt'])[0]['source'] == 'note:other.txt'
+
+
+def test_passages_go_in_a_system_message_before_their_turn():
+    messages = [{'role': 'user', 'content': 'q', 'context': [{'label': 'garden.txt', 'text': 'sun'}]}]
+    assert insert_passages(messages) == [
+        {'role': 'system', 'content': "Relevant excerpts from the user's notes and files:\n\n[garden.txt]\nsun"},
+        {'role': 'user', 'content': 'q'}]
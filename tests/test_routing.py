@@ -0,0 +1,141 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import routing
+from resilience import ProviderError
+from routing import LatencyTracker, hedged_call, routed_selection, selection_providers
+
+A = {'provider': 'openai', 'model': 'a'}
+B = {'provider': 'anthropic', 'model': 'b'}
+
+
+def streamed(tracker, candidate, ttft, times=1):
+    for _ in range(times):
+        tracker.observe(candidate['provider'], candidate['model'], 'ok', ttft, ttft + 0.1, 10)
+
+
+def test_cancelled_backup_does_not_look_fast():
+    tracker = LatencyTracker(explore=0)
+    streamed(tracker, A, 1.0, times=10)
+    before = tracker.stats()['openai/a']
+    # Cancelled shortly after launch, before its first token: says nothing
+    tracker.observe('openai', 'a', 'cancelled', None, 0.05, 0)
+    assert tracker.stats()['openai/a'] == before
+    # Never tried and cancelled early: still untried
+    tracker.observe('anthropic', 'b', 'cancelled', None, 0.05, 0)
+    assert tracker.estimate('anthropic', 'b') is None
+    # Outlasting its average without a token is evidence it is slower
+    tracker.observe('openai', 'a', 'cancelled', None, 3.0, 0)
+    assert tracker.stats()['openai/a']['ttft_ms'] > before['ttft_ms']
+    # A token before the cancel is a real sample
+    tracker.observe('openai', 'a', 'cancelled', 0.2, 0.5, 0)
+    assert len(tracker._stats[('openai', 'a')].ttfts) == 12
+
+
+def test_ranking_prefers_fast_reliable_models():
+    tracker = LatencyTracker(explore=0)
+    untried = {'provider': 'openai', 'model': 'new'}
+    streamed(tracker, A, 0.5, times=3)
+    streamed(tracker, B, 0.2, times=3)
+    assert tracker.rank([A, B, untried]) == [untried, B, A]
+    for _ in range(5):
+        tracker.observe('anthropic', 'b', 'error', None, 0.1, 0)
+    assert tracker.rank([A, B]) == [A, B]
+    assert tracker.rank([A, B], available=lambda provider: provider != 'openai') == [B, A]
+
+
+def test_hedge_delay_is_the_percentile_once_there_are_samples():
+    tracker = LatencyTracker()
+    assert tracker.hedge_delay('openai', 'a') == routing.HEDGE_DELAY
+    streamed(tracker, A, 0.3, times=routing.HEDGE_MIN_SAMPLES)
+    assert tracker.hedge_delay('openai', 'a') == pytest.approx(0.3)
+    assert tracker.hedge_delay('openai', 'a', stream=False) == routing.HEDGE_DELAY
+
+
+def test_routed_selections():
+    groups = {'fast': ['openai/a', 'anthropic/b', 'bad']}
+    selection = routed_selection({'group': 'fast', 'hedge': True}, groups)
+    assert selection['candidates'] == [A, B] and selection['provider'] == 'auto' and selection['hedge']
+    assert routed_selection({'provider': 'auto', 'model': 'fast'}, groups)['group'] == 'fast'
+    assert routed_selection(A, groups) is None
+    assert selection_providers([selection, {'provider': 'openai', 'model': 'c'}]) == ['openai', 'anthropic']
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=False)
+
+
+def test_hedged_call_sends_a_backup_when_the_first_is_slow(executor):
+    def call(candidate, cancel):
+        time.sleep(1.0 if candidate is A else 0.05)
+        return candidate['model']
+
+    started = time.monotonic()
+    assert hedged_call([A, B], call, executor, timeout=5, delay=0.05) == (B, 'b', True)
+    assert time.monotonic() - started < 0.5
+    assert hedged_call([B, A], call, executor, timeout=5, delay=0.5) == (B, 'b', False)
+
+
+def test_hedged_call_moves_on_after_failures(executor):
+    def call(candidate, cancel):
+        if candidate is A:
+            raise ProviderError('openai', 'server_error', 'down')
+        return 'b'
+
+    assert hedged_call([A, B], call, executor, timeout=5) == (B, 'b', True)
+    with pytest.raises(ProviderError, match='down'):
+        hedged_call([A], call, executor, timeout=5)
+    with pytest.raises(ProviderError) as raised:
+        hedged_call([B], lambda candidate, cancel: time.sleep(0.5), executor, timeout=0.05)
+    assert raised.value.code == 'timeout'
+
+
+def test_hedged_call_stops_the_losing_call(executor):
+    stopped = threading.Event()
+
+    def call(candidate, cancel):
+        if candidate is B:
+            time.sleep(0.05)
+            return 'b'
+        # A slow answer read piece by piece, as call_routed does
+        for _ in range(100):
+            if cancel.wait(0.05):
+                stopped.set()
+                return None
+        return 'a'
+
+    assert hedged_call([A, B], call, executor, timeout=10, delay=0.05) == (B, 'b', True)
+    assert stopped.wait(0.5)
+
+
+def test_routed_stream_answers_with_the_fastest_candidate(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module.latency, 'explore', 0)
+    slow = {'provider': 'openai', 'model': 'route-slow'}
+    fast = {'provider': 'anthropic', 'model': 'route-fast'}
+    streamed(app_module.latency, slow, 1.0, times=3)
+    streamed(app_module.latency, fast, 0.01, times=3)
+    selection = {'group': 'pair', 'candidates': [slow, fast]}
+    body = client.post('/api/chat/stream', json={'message': 'route me', 'selected_models': [selection]}
+                       ).get_data(as_text=True)
+    frames = [json.loads(line[6:]) for line in body.splitlines() if line.startswith('data: ')]
+    routed = next(frame for frame in frames if frame['type'] == 'routed')
+    assert (routed['provider'], routed['model']) == ('auto', 'pair')
+    assert (routed['routed_provider'], routed['routed_model'], routed['hedged']) == ('anthropic', 'route-fast', False)
+    assert ''.join(frame['content'] for frame in frames if frame['type'] == 'content').startswith('route-fast-token0')
+
+
+def test_routed_call_answers_with_the_whole_response(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module.latency, 'explore', 0)
+    fast = {'provider': 'anthropic', 'model': 'route-fast'}
+    selection = {'group': 'pair', 'candidates': [fast, {'provider': 'openai', 'model': 'route-slow'}]}
+    data = client.post('/api/chat', json={'message': 'route me', 'selected_models': [selection]}).get_json()
+    direct = client.post('/api/chat', json={'message': 'route me', 'selected_models': [fast]}).get_json()
+    assert data['response'] == direct['response']
+    assert data['response'].startswith('route-fast-token0')
@@ -0,0 +1,53 @@
+from search_index import SearchIndex
+
+
+def test_messages_titles_and_notes_are_ranked(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    assert index.is_empty()
+    index.index_messages('c', [{'role': 'user', 'content': 'how do pandas dataframes merge'},
+                               {'role': 'assistant', 'content': 'use merge on a key column'}])
+    index.index_title('c', 'Pandas merging')
+    index.index_note('tips.txt', 'dataframes can be merged with join too')
+
+    hits = index.search('merg')
+    assert {(hit['kind'], hit['doc_id']) for hit in hits} == {
+        ('message', 'c'), ('title', 'c'), ('note', 'tips.txt')}
+    assert [hit['position'] for hit in index.search('key col')] == [1]
+    assert {hit['kind'] for hit in index.search('dataframes', kind='note')} == {'note'}
+    assert index.search('!!!') == []
+
+
+def test_reindexing_replaces_messages_from_a_position(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    index.index_messages('c', [{'role': 'user', 'content': 'first'}, {'role': 'assistant', 'content': 'old'}])
+    index.index_messages('c', [{'role': 'user', 'content': 'first'}, {'role': 'assistant', 'content': 'new'}], 1)
+    assert index.search('old') == []
+    assert index.search('new')[0]['position'] == 1
+    index.remove_chat('c')
+    assert index.is_empty()
+
+
+def test_snippets_are_escaped_html(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    index.index_messages('c', [{'role': 'user', 'content': '<img src=x onerror=alert(1)> findme & more'}])
+    snippet = index.search('findme')[0]['snippet']
+    assert '<img' not in snippet
+    assert '&lt;img src=x onerror=alert(1)&gt;' in snippet
+    assert '<mark>findme</mark> &amp; more' in snippet
+
+
+def test_search_route(client):
+    chat_id = client.post('/api/chat', json={'message': 'zebra <b>stripes</b>', 'provider': 'openai',
+                                             'model': 'm'}).get_json()['chat_id']
+    results = client.get('/api/search?q=zebra').get_json()
+    message = next(result for result in results if result['type'] == 'message')
+    assert message['chat_id'] == chat_id and message['role'] == 'user'
+    assert '&lt;b&gt;' in message['snippet'] and '<mark>zebra</mark>' in message['snippet']
+
+
+def test_search_limit_is_clamped(client):
+    for n in range(3):
+        client.post('/api/chat', json={'message': f'okapi {n}', 'provider': 'openai', 'model': 'm'})
+    assert len(client.get('/api/search?q=okapi&limit=-1').get_json()) == 1
+    assert len(client.get('/api/search?q=okapi&limit=0').get_json()) == 1
+    assert len(client.get('/api/search?q=okapi&limit=2&offset=-5').get_json()) == 2